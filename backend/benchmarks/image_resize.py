@@ -0,0 +1,126 @@
+"""Benchmark draft-mode downscaling against a full-resolution decode.
+
+Run from backend/:
+
+    python -m benchmarks.image_resize [jpeg file] [--size 8000x6000] [--repeat 3]
+
+Without a file a synthetic 48 MP photo-like JPEG is generated. For each
+thumbnail size it compares image_ops.scaled_open (JPEG DCT scaling on load,
+reducing-gap resampling) with the naive path (full decode, exif_transpose,
+LANCZOS resize), reporting the best wall time of `--repeat` runs, the peak
+memory growth of the process and the PSNR between the two results (higher
+is closer; above ~40 dB the difference is not visible).
+
+Each measurement runs in a fresh process whose peak resident memory is
+reset first (Linux /proc/self/clear_refs), so it is not hidden by earlier
+allocations; elsewhere the memory columns read 0.
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from core import image_ops
+
+SIZES = [256, 512, 1024, 2048]
+
+
+def generate_photo(size: str) -> bytes:
+    width, height = (int(n) for n in size.split("x"))
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    rng = np.random.default_rng(0)
+    channels = [
+        128 + 100 * np.sin(x / (width / (3 + i)) + y / (height / (2 + i))) + rng.normal(0, 12, (height, width))
+        for i in range(3)
+    ]
+    pixels = np.clip(np.stack(channels, axis=-1), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def peak_kb() -> int:
+    """Peak resident memory (VmHWM), or 0 where /proc is not available"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def reset_peak():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def full_decode(data: bytes, size: int) -> Image.Image:
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    return img.resize(image_ops.target_size(img.size, size, size, fit=True), Image.Resampling.LANCZOS)
+
+
+def measure(method: str, data: bytes, size: int):
+    """(seconds, peak memory growth in MB, result pixels); runs in a fresh worker"""
+    resize = full_decode if method == "full" else lambda d, s: image_ops.scaled_open(d, s, s, fit=True)
+    reset_peak()
+    baseline = peak_kb()
+    started = time.perf_counter()
+    img = resize(data, size)
+    img.load()
+    seconds = time.perf_counter() - started
+    return seconds, (peak_kb() - baseline) / 1024, np.asarray(img.convert("RGB"))
+
+
+def isolated(method: str, data: bytes, size: int, repeat: int):
+    runs = []
+    for _ in range(repeat):
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            runs.append(pool.submit(measure, method, data, size).result())
+    return min(run[0] for run in runs), max(run[1] for run in runs), runs[0][2]
+
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", help="JPEG to resize (default: synthetic photo)")
+    parser.add_argument("--size", default="8000x6000", help="size of the synthetic photo")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (best time is kept)")
+    options = parser.parse_args()
+
+    if options.path:
+        with open(options.path, "rb") as f:
+            data = f.read()
+        name = os.path.basename(options.path)
+    else:
+        data = generate_photo(options.size)
+        name = "synthetic"
+    with Image.open(io.BytesIO(data)) as img:
+        print(f"{name}: {img.format} {img.width}x{img.height} ({img.width * img.height / 1e6:.1f} MP), "
+              f"{len(data) / 1e6:.1f} MB\n")
+
+    print(f"{'size':>6}  {'full s':>7}  {'draft s':>7}  {'speedup':>7}  {'full MB':>7}  {'draft MB':>8}  {'PSNR dB':>7}")
+    for size in SIZES:
+        full_seconds, full_mb, full_pixels = isolated("full", data, size, options.repeat)
+        draft_seconds, draft_mb, draft_pixels = isolated("draft", data, size, options.repeat)
+        print(
+            f"{size:>6}  {full_seconds:>7.3f}  {draft_seconds:>7.3f}  {full_seconds / draft_seconds:>6.1f}x"
+            f"  {full_mb:>7.0f}  {draft_mb:>8.0f}  {psnr(full_pixels, draft_pixels):>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
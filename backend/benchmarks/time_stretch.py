@@ -0,0 +1,112 @@
+"""Benchmark the NumPy WSOLA time stretch against ffmpeg's atempo.
+
+Run from backend/:
+
+    python -m benchmarks.time_stretch [audio file] [--seconds 30]
+
+Without a file a synthetic test signal is used (a harmonic tone with vibrato
+and noise bursts). For each speed it reports throughput as multiples of real time and
+how close the result is to atempo's:
+
+- spectral correlation: correlation of the two log-magnitude spectrograms
+  (1.0 = identical spectral content over time)
+- pitch drift: shift of the dominant frequency from the input, in cents
+"""
+import argparse
+import subprocess
+import time
+
+import numpy as np
+
+from core.time_stretch import time_stretch
+from core.toolchain import toolchain
+
+SPEEDS = [0.5, 0.75, 1.25, 1.5, 2.0]
+SAMPLE_RATE = 44100
+STFT_SIZE = 2048
+STFT_HOP = 512
+MIN_PITCH_HZ = 50
+
+
+def synthetic_signal(seconds: float) -> np.ndarray:
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    # Phase of a 1 Hz carrier with 0.4% vibrato at 5 Hz
+    phase = 2 * np.pi * t - 0.004 / 5 * np.cos(2 * np.pi * 5 * t)
+    # 220 Hz fundamental with decaying harmonics, plus a quieter fifth above
+    signal = sum(np.sin(220 * h * phase) / h for h in range(1, 6))
+    signal += 0.3 * np.sin(330 * phase)
+    bursts = (np.sin(2 * np.pi * 2 * t) > 0.95) * np.random.default_rng(0).normal(0, 0.05, len(t))
+    return (0.2 * signal + bursts).astype(np.float32)
+
+
+def decode(path: str, seconds: float) -> np.ndarray:
+    args = [toolchain.path("ffmpeg"), "-v", "error", "-i", path, "-t", str(seconds),
+            "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "f32le", "-"]
+    return np.frombuffer(subprocess.run(args, capture_output=True, check=True).stdout, dtype="<f4")
+
+
+def atempo(samples: np.ndarray, speed: float) -> np.ndarray:
+    args = [toolchain.path("ffmpeg"), "-v", "error", "-f", "f32le", "-ar", str(SAMPLE_RATE), "-ac", "1",
+            "-i", "-", "-af", f"atempo={speed}", "-f", "f32le", "-"]
+    out = subprocess.run(args, input=samples.tobytes(), capture_output=True, check=True).stdout
+    return np.frombuffer(out, dtype="<f4")
+
+
+def log_spectrogram(samples: np.ndarray) -> np.ndarray:
+    frames = np.lib.stride_tricks.sliding_window_view(samples, STFT_SIZE)[::STFT_HOP]
+    return np.log1p(np.abs(np.fft.rfft(frames * np.hanning(STFT_SIZE), axis=1)))
+
+
+def spectral_correlation(a: np.ndarray, b: np.ndarray) -> float:
+    sa, sb = log_spectrogram(a), log_spectrogram(b)
+    n = min(len(sa), len(sb))
+    return float(np.corrcoef(sa[:n].ravel(), sb[:n].ravel())[0, 1])
+
+
+def dominant_frequency(samples: np.ndarray) -> float:
+    # Peak of the long-term average spectrum, refined by parabolic interpolation
+    average = np.log(np.exp(log_spectrogram(samples)).mean(axis=0))
+    freqs = np.fft.rfftfreq(STFT_SIZE, 1 / SAMPLE_RATE)
+    average[freqs < MIN_PITCH_HZ] = -np.inf
+    k = int(np.argmax(average[1:-1])) + 1
+    left, centre, right = average[k - 1:k + 2]
+    shift = 0.5 * (left - right) / (left - 2 * centre + right)
+    return float((k + shift) * SAMPLE_RATE / STFT_SIZE)
+
+
+def pitch_drift_cents(reference: np.ndarray, stretched: np.ndarray) -> float:
+    return 1200 * np.log2(dominant_frequency(stretched) / dominant_frequency(reference))
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", help="audio file to stretch (default: synthetic signal)")
+    parser.add_argument("--seconds", type=float, default=30.0)
+    options = parser.parse_args()
+
+    samples = decode(options.path, options.seconds) if options.path else synthetic_signal(options.seconds)
+    duration = len(samples) / SAMPLE_RATE
+    has_ffmpeg = toolchain.available("ffmpeg")
+    print(f"{duration:.1f}s of audio, ffmpeg {'available' if has_ffmpeg else 'not found (WSOLA only)'}\n")
+    print(f"{'speed':>5}  {'wsola x-rt':>10}  {'atempo x-rt':>11}  {'spectral corr':>13}  {'wsola drift':>11}  {'atempo drift':>12}")
+
+    for speed in SPEEDS:
+        stretched, wsola_seconds = timed(lambda: time_stretch(samples, speed, SAMPLE_RATE)[:, 0])
+        row = f"{speed:>5}  {duration / wsola_seconds:>10.1f}"
+        if has_ffmpeg:
+            reference, atempo_seconds = timed(atempo, samples, speed)
+            row += f"  {duration / atempo_seconds:>11.1f}  {spectral_correlation(stretched, reference):>13.3f}"
+            row += f"  {pitch_drift_cents(samples, stretched):>10.1f}c  {pitch_drift_cents(samples, reference):>11.1f}c"
+        else:
+            row += f"  {'-':>11}  {'-':>13}  {pitch_drift_cents(samples, stretched):>10.1f}c  {'-':>12}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
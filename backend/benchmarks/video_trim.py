@@ -0,0 +1,100 @@
+"""Benchmark the keyframe-aware smart trim against a full re-encode.
+
+Run from backend/:
+
+    python -m benchmarks.video_trim [video file] [--seconds 30] [--size 1920x1080]
+
+Without a file a synthetic clip is generated (testsrc2, H.264 with a
+keyframe every 2 seconds, plus a tone). Several ranges are trimmed both ways
+and for each it reports wall time, the speedup, how much of the range was
+stream-copied and the PSNR of each result against the source frames (copied
+GOPs are bit-exact, so the smart trim only loses quality in its two
+re-encoded partial GOPs).
+"""
+import argparse
+import asyncio
+import os
+import re
+import subprocess
+import tempfile
+import time
+
+from core.toolchain import toolchain
+from core.video_trim import index_video, reencode_args, trim_video
+
+# (start, end) as fractions of the clip; edges inside GOPs, on keyframes, and short cuts
+RANGES = [(0.1, 0.9), (0.25, 0.75), (0.0, 0.5), (0.41, 0.47)]
+GOP_SECONDS = 2
+
+
+def generate_clip(path: str, seconds: float, size: str):
+    args = [
+        toolchain.path("ffmpeg"), "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30",
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000",
+        "-t", str(seconds), "-c:v", "libx264", "-preset", "veryfast",
+        "-g", str(30 * GOP_SECONDS), "-pix_fmt", "yuv420p", "-c:a", "aac", path
+    ]
+    subprocess.run(args, check=True)
+
+
+def psnr(output: str, source: str, start: float, end: float) -> float:
+    """Average PSNR of `output` against the same frames of `source`, compared by frame number"""
+    args = [
+        toolchain.path("ffmpeg"), "-i", output, "-ss", f"{start:.6f}", "-t", f"{end - start:.6f}", "-i", source,
+        "-lavfi", "[0:v]setpts=N[a];[1:v]setpts=N[b];[a][b]psnr", "-f", "null", "-"
+    ]
+    stderr = subprocess.run(args, capture_output=True, text=True).stderr
+    match = re.search(r"average:(\S+)", stderr)
+    return float(match.group(1)) if match else float("nan")
+
+
+async def timed(coro):
+    started = time.perf_counter()
+    result = await coro
+    return result, time.perf_counter() - started
+
+
+async def run(path: str, workdir: str):
+    index = await index_video(path)
+    duration = index.frames[-1] if index.frames else 0.0
+    print(f"{os.path.basename(path)}: {index.codec} {index.pix_fmt}, {duration:.1f}s, {len(index.keyframes)} keyframes\n")
+    print(f"{'range':>15}  {'smart s':>8}  {'mode':>8}  {'copied':>7}  {'full s':>7}  {'speedup':>7}  {'smart dB':>8}  {'full dB':>7}")
+
+    extension = os.path.splitext(path)[1] or ".mp4"
+    for low, high in RANGES:
+        start, end = round(low * duration, 3), round(high * duration, 3)
+        smart_path = os.path.join(workdir, f"smart{extension}")
+        full_path = os.path.join(workdir, f"full{extension}")
+
+        result, smart_seconds = await timed(trim_video(path, smart_path, start, end))
+        args = reencode_args(path, full_path, start, end, "libx264", index)
+        _, full_seconds = await timed(asyncio.to_thread(subprocess.run, args, check=True))
+
+        print(
+            f"{start:>6.2f}-{end:<8.2f}  {smart_seconds:>8.2f}  {result['mode']:>8}"
+            f"  {result['copied_seconds'] / (end - start):>6.0%}  {full_seconds:>7.2f}"
+            f"  {full_seconds / smart_seconds:>6.1f}x  {psnr(smart_path, path, start, end):>8.1f}"
+            f"  {psnr(full_path, path, start, end):>7.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", help="video file to trim (default: synthetic clip)")
+    parser.add_argument("--seconds", type=float, default=30.0, help="length of the synthetic clip")
+    parser.add_argument("--size", default="1920x1080", help="frame size of the synthetic clip")
+    options = parser.parse_args()
+
+    if not toolchain.available("ffmpeg"):
+        parser.error("ffmpeg is required")
+    with tempfile.TemporaryDirectory() as workdir:
+        path = options.path
+        if not path:
+            path = os.path.join(workdir, "source.mp4")
+            generate_clip(path, options.seconds, options.size)
+        asyncio.run(run(path, workdir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+import heapq
+import math
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from uuid import uuid4
+
+from starlette.background import BackgroundTask
+
+from core.config import settings
+
+# Size-bounded store for generated files in processed/.
+#
+# Every output gets a unique name (or a caller-chosen content key) in a
+# two-character shard directory, is written under processed/tmp/ first and
+# renamed into place only when complete, so readers never see a partial file
+# and two requests for "photo.jpg" never share a path. The index is an LRU
+# of path -> size: committing past the byte budget evicts the least recently
+# used files, and a min-heap of expiry times lets the reaper drop files whose
+# TTL has passed without scanning the rest. Files pinned by a response that
+# is still streaming are skipped by both and deleted once released.
+#
+# The directory is the source of truth; each uvicorn worker keeps its own
+# index of it. A lookup of a file another worker committed indexes it on the
+# spot, and every few reaper ticks the directory is rescanned, so every worker
+# counts every worker's files against the one byte budget and forgets files
+# another worker deleted. A worker expires only the files it wrote (its TTL
+# is not known for the others); the others count for the budget and LRU
+# until their writer, or the next restart, expires them. Job workers commit
+# into the same directories and the server adopts the file when the job
+# finishes.
+
+STAGING = "tmp"
+
+
+@dataclass
+class _Entry:
+    size: int
+    expires_at: float
+    refs: int = 0
+    doomed: bool = False
+
+
+class PendingArtifact:
+    """An output being written: write to `temp`, commit() renames it to `path`"""
+
+    def __init__(self, store: "ArtifactStore", name: str, ttl: Optional[float]):
+        self.store = store
+        self.name = name
+        self.ttl = ttl
+        self.temp = store.temp_path(os.path.splitext(name)[1])
+        self.path: Optional[str] = None
+
+    def commit(self) -> str:
+        self.path = self.store.commit(self.temp, self.name, self.ttl)
+        return self.path
+
+    def discard(self):
+        if os.path.exists(self.temp):
+            os.remove(self.temp)
+
+    def __enter__(self) -> "PendingArtifact":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and self.path is None:
+            self.commit()
+        self.discard()
+
+
+class ArtifactStore:
+    def __init__(self, root: str, max_bytes: int, ttl: float):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._expiry: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+        self._active = False
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bytes_evicted = 0
+        self.bytes_expired = 0
+        os.makedirs(os.path.join(root, STAGING), exist_ok=True)
+
+    def owns(self, path: str) -> bool:
+        return os.path.abspath(path).startswith(os.path.abspath(self.root) + os.sep)
+
+    def path_for(self, name: str) -> str:
+        """Final location of a stored file (sharded on the first two characters)"""
+        return os.path.join(self.root, name[:2], name)
+
+    def temp_path(self, extension: str = "") -> str:
+        """Unique staging path on the same filesystem, keeping `extension` for tools that infer the format"""
+        return os.path.join(self.root, STAGING, f"{uuid4().hex}{extension}")
+
+    def create(self, extension: str = "", name: Optional[str] = None, ttl: Optional[float] = None) -> PendingArtifact:
+        """Start a new output, named `name` (a content key) or a fresh unique name"""
+        return PendingArtifact(self, name or f"{uuid4().hex}{extension}", ttl)
+
+    def commit(self, temp: str, name: Optional[str] = None, ttl: Optional[float] = None) -> str:
+        """Atomically move a finished staging file into the store"""
+        path = self.path_for(name or f"{uuid4().hex}{os.path.splitext(temp)[1]}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp, path)
+        self.adopt(path, ttl)
+        return path
+
+    def adopt(self, path: str, ttl: Optional[float] = None, expires_at: Optional[float] = None):
+        """Index a file already in place (e.g. written by a job worker) and enforce the budget.
+
+        An `expires_at` of math.inf indexes the file without scheduling its expiry.
+        """
+        if not self._active:
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if expires_at is None:
+            expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self.bytes -= entry.size
+            self._entries[path] = _Entry(size, expires_at, refs=entry.refs if entry else 0)
+            self.bytes += size
+            if expires_at != math.inf:
+                heapq.heappush(self._expiry, (expires_at, path))
+            victims = self._over_budget(keep=path)
+        self._delete(victims)
+
+    def lookup(self, path: str) -> bool:
+        """Whether a stored file is present; counts as a use for LRU order"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                if not entry.doomed and os.path.exists(path):
+                    self._entries.move_to_end(path)
+                    self.hits += 1
+                    return True
+                if not entry.refs and not os.path.exists(path):
+                    # Deleted by another worker
+                    self._forget(path)
+                self.misses += 1
+                return False
+        # Not in this worker's index: another worker may have committed it
+        if not self.owns(path) or not os.path.isfile(path):
+            with self._lock:
+                self.misses += 1
+            return False
+        self.adopt(path, expires_at=math.inf)
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def acquire(self, path: str):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                entry.refs += 1
+                self._entries.move_to_end(path)
+
+    def release(self, path: str):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry.refs == 0:
+                return
+            entry.refs -= 1
+            victims = self._forget(path) if entry.refs == 0 and entry.doomed else []
+        self._delete(victims)
+
+    def hold(self, path: str, discard: bool = False) -> BackgroundTask:
+        """Pin `path` until the response is sent; pass the result as its background task"""
+        self.acquire(path)
+
+        def done():
+            self.release(path)
+            if discard:
+                self.discard(path)
+        return BackgroundTask(done)
+
+    def discard(self, path: str):
+        """Delete a file now, or as soon as the last response using it finishes"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.refs:
+                entry.doomed = True
+                return
+            victims = self._forget(path) if entry is not None else [(path, 0)]
+        self._delete(victims)
+
+    def expire(self, limit: int) -> int:
+        """Delete up to `limit` files whose TTL has passed; returns how many"""
+        now = time.time()
+        victims = []
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now and len(victims) < limit:
+                expires_at, path = heapq.heappop(self._expiry)
+                entry = self._entries.get(path)
+                # Stale heap item: the file was replaced, evicted or discarded since
+                if entry is None or entry.expires_at != expires_at:
+                    continue
+                if entry.refs:
+                    entry.doomed = True
+                    continue
+                victims += self._forget(path)
+            self.expirations += len(victims)
+            self.bytes_expired += sum(size for _, size in victims)
+        self._delete(victims)
+        return len(victims)
+
+    def load(self):
+        """Index what is already on disk (left over from a restart) and clear old staging files"""
+        self._active = True
+        with os.scandir(os.path.join(self.root, STAGING)) as leftovers:
+            for entry in leftovers:
+                try:
+                    if entry.is_dir():
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass    # another worker starting up cleared it first
+        # Oldest first, so the LRU order starts out as the write order
+        for mtime, path in self._scan():
+            self.adopt(path, expires_at=mtime + self.ttl)
+
+    def rescan(self):
+        """Bring the index in line with the directory other workers also write to"""
+        if not self._active:
+            return
+        found = self._scan()
+        with self._lock:
+            gone = [path for path, entry in self._entries.items() if not entry.refs and not os.path.exists(path)]
+            for path in gone:
+                self._forget(path)
+            new = [path for _, path in found if path not in self._entries]
+        for path in new:
+            self.adopt(path, expires_at=math.inf)
+
+    def _scan(self) -> List[Tuple[float, str]]:
+        """(mtime, path) of every stored file, oldest first"""
+        found = []
+        with os.scandir(self.root) as shards:
+            for shard in shards:
+                # Files outside the shards predate the store; they just age out
+                if shard.is_file():
+                    found.append((shard.stat().st_mtime, shard.path))
+                if not shard.is_dir() or shard.name == STAGING:
+                    continue
+                with os.scandir(shard.path) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_file():
+                                found.append((entry.stat().st_mtime, entry.path))
+                        except FileNotFoundError:
+                            pass    # deleted while scanning
+        return sorted(found)
+
+    def _over_budget(self, keep: str) -> List[Tuple[str, int]]:
+        # Called with the lock held; least recently used first
+        victims = []
+        if self.bytes <= self.max_bytes:
+            return victims
+        for path in list(self._entries):
+            entry = self._entries[path]
+            if path == keep or entry.refs:
+                continue
+            victims += self._forget(path)
+            self.evictions += 1
+            self.bytes_evicted += entry.size
+            if self.bytes <= self.max_bytes:
+                break
+        return victims
+
+    def _forget(self, path: str) -> List[Tuple[str, int]]:
+        entry = self._entries.pop(path)
+        self.bytes -= entry.size
+        return [(path, entry.size)]
+
+    def _delete(self, victims: List[Tuple[str, int]]):
+        for path, _ in victims:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Artifact store could not delete {path}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            files = len(self._entries)
+            pinned = sum(1 for entry in self._entries.values() if entry.refs)
+            used = self.bytes
+        lookups = self.hits + self.misses
+        return {
+            "files": files,
+            "bytes": used,
+            "max_bytes": self.max_bytes,
+            "occupancy": round(used / self.max_bytes, 4) if self.max_bytes else 0.0,
+            "pinned": pinned,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes_evicted": self.bytes_evicted,
+            "expirations": self.expirations,
+            "bytes_expired": self.bytes_expired,
+        }
+
+
+artifacts = ArtifactStore(
+    root="processed",
+    max_bytes=settings.PROCESSED_MAX_MB * 1024 * 1024,
+    ttl=settings.PROCESSED_TTL_SECONDS,
+)
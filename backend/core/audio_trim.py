@@ -0,0 +1,120 @@
+import asyncio
+import math
+import os
+from typing import Optional, Tuple
+
+from core.media_probe import probe_headers
+from core.process import run_process
+from core.toolchain import toolchain
+
+TRIM_TIMEOUT = 120
+
+# Lossy codecs whose frames can be cut and copied into the same container as-is.
+# FLAC and PCM are lossless, so re-encoding them costs CPU but no quality, and
+# their copy output has stale headers / packet-granular cuts.
+STREAM_COPY_CODECS = {"mp3", "aac"}
+
+# Encoder used when a trim has to be re-encoded: keep the source codec,
+# falling back to one that suits the file extension
+CODEC_ENCODERS = {
+    "mp3": "libmp3lame",
+    "aac": "aac",
+    "vorbis": "libvorbis",
+    "opus": "libopus",
+    "flac": "flac",
+}
+EXTENSION_ENCODERS = {
+    ".mp3": "libmp3lame",
+    ".m4a": "aac",
+    ".mp4": "aac",
+    ".ogg": "libvorbis",
+    ".flac": "flac",
+    ".wav": "pcm_s16le",
+}
+
+
+def frame_seconds(media: Optional[dict]) -> Optional[float]:
+    """Duration of one compressed frame, or None if the codec has no fixed frame size"""
+    if not media or not media.get("sample_rate"):
+        return None
+    sample_rate = media["sample_rate"]
+    if media.get("codec") == "mp3":
+        return (1152 if sample_rate >= 32000 else 576) / sample_rate
+    if media.get("codec") == "aac":
+        return 1024 / sample_rate
+    return None
+
+
+def snap_to_frames(start: float, end: float, media: Optional[dict]) -> Tuple[float, float]:
+    """Widen [start, end] outwards to whole frames, as a stream copy will"""
+    frame = frame_seconds(media)
+    if not frame:
+        return start, end
+    start = math.floor(start / frame) * frame
+    end = math.ceil(end / frame) * frame
+    if media.get("duration"):
+        end = min(end, media["duration"])
+    return start, end
+
+
+def can_stream_copy(media: Optional[dict]) -> bool:
+    if not media:
+        return False
+    return media.get("codec") in STREAM_COPY_CODECS
+
+
+def encoder_args(media: Optional[dict], dst: str) -> list:
+    """Codec arguments that re-encode to the source codec and bitrate"""
+    codec = (media or {}).get("codec") or ""
+    if codec.startswith("pcm_"):
+        encoder = codec
+    else:
+        encoder = CODEC_ENCODERS.get(codec) or EXTENSION_ENCODERS.get(os.path.splitext(dst)[1].lower())
+    if not encoder:
+        return []
+    args = ["-c:a", encoder]
+    lossless = encoder == "flac" or encoder.startswith("pcm_")
+    if not lossless and media and media.get("bit_rate"):
+        args += ["-b:a", str(media["bit_rate"])]
+    return args
+
+
+def trim_args(src: str, dst: str, start: float, end: float, media: Optional[dict], exact: bool) -> Tuple[list, str]:
+    """Build the ffmpeg command for a trim; returns (args, mode)"""
+    ffmpeg = toolchain.path("ffmpeg")
+    if not exact and can_stream_copy(media):
+        # Input seeking + packet copy: no decode, cost is just reading the range
+        return [
+            ffmpeg, "-y", "-v", "error",
+            "-ss", f"{start:.6f}", "-i", src,
+            "-t", f"{end - start:.6f}",
+            "-map", "0:a:0", "-c", "copy",
+            "-avoid_negative_ts", "make_zero",
+            dst
+        ], "stream_copy"
+
+    args = [
+        ffmpeg, "-y", "-v", "error",
+        "-i", src,
+        "-ss", f"{start:.6f}", "-t", f"{end - start:.6f}",
+        "-map", "0:a:0",
+    ]
+    return args + encoder_args(media, dst) + [dst], "reencode"
+
+
+async def trim_file(src: str, dst: str, start: float, end: float, media: Optional[dict], exact: bool = False) -> dict:
+    """Write the [start, end] range of `src` to `dst`; returns the mode used and the resulting range"""
+    if not exact and can_stream_copy(media):
+        start, end = snap_to_frames(start, end, media)
+    args, mode = trim_args(src, dst, start, end, media, exact)
+    try:
+        await run_process(args, tool="ffmpeg", timeout=TRIM_TIMEOUT)
+    except BaseException:
+        if os.path.exists(dst):
+            os.remove(dst)
+        raise
+
+    # Prefer the real length from the new headers; fall back to the analytic one
+    probed = await asyncio.to_thread(probe_headers, dst)
+    duration = probed["duration"] if probed else round(end - start, 3)
+    return {"mode": mode, "start": round(start, 6), "end": round(end, 6), "duration": duration}
@@ -9,4 +9,59 @@ class Settings:
     SECRET_KEY: str = os.getenv("SECRET_KEY", "secret")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
+    # Audio session registry: "database" (uses DATABASE_URL) or "redis"
+    SESSION_BACKEND: str = os.getenv("SESSION_BACKEND", "database")
+    REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    SESSION_TTL_SECONDS: int = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+
+    # Background reaper for expired sessions and processed/ outputs
+    REAPER_INTERVAL_SECONDS: float = float(os.getenv("REAPER_INTERVAL_SECONDS", "60"))
+    REAPER_BATCH_SIZE: int = int(os.getenv("REAPER_BATCH_SIZE", "200"))
+    # processed/ is listed in full (to see other workers' files) only every Nth tick
+    REAPER_RESCAN_TICKS: int = int(os.getenv("REAPER_RESCAN_TICKS", "10"))
+    PROCESSED_TTL_SECONDS: int = int(os.getenv("PROCESSED_TTL_SECONDS", "3600"))
+    # Disk budget for processed/; least recently used outputs are evicted past it
+    PROCESSED_MAX_MB: int = int(os.getenv("PROCESSED_MAX_MB", "2048"))
+    # Video preview sprites are cached by content hash, so they are kept longer
+    THUMBNAIL_CACHE_TTL_SECONDS: int = int(os.getenv("THUMBNAIL_CACHE_TTL_SECONDS", "86400"))
+
+    # Results cached by input hash and parameters: small ones in memory, all on disk
+    RESULT_CACHE_MEMORY_MB: int = int(os.getenv("RESULT_CACHE_MEMORY_MB", "64"))
+    RESULT_CACHE_DISK_MB: int = int(os.getenv("RESULT_CACHE_DISK_MB", "1024"))
+    RESULT_CACHE_TTL_SECONDS: int = int(os.getenv("RESULT_CACHE_TTL_SECONDS", "86400"))
+
+    # Per-tool upload size limits, enforced while the upload streams to disk
+    MAX_AUDIO_UPLOAD_MB: int = int(os.getenv("MAX_AUDIO_UPLOAD_MB", "200"))
+    MAX_IMAGE_UPLOAD_MB: int = int(os.getenv("MAX_IMAGE_UPLOAD_MB", "50"))
+    MAX_VIDEO_UPLOAD_MB: int = int(os.getenv("MAX_VIDEO_UPLOAD_MB", "2048"))
+    MAX_PDF_UPLOAD_MB: int = int(os.getenv("MAX_PDF_UPLOAD_MB", "100"))
+    MAX_MUSIC_ID_UPLOAD_MB: int = int(os.getenv("MAX_MUSIC_ID_UPLOAD_MB", "50"))
+    # Images over this many megapixels are refused before they are decoded
+    MAX_IMAGE_MEGAPIXELS: float = float(os.getenv("MAX_IMAGE_MEGAPIXELS", "100"))
+    # Rows per strip when the image tools filter an image piece by piece
+    IMAGE_TILE_ROWS: int = int(os.getenv("IMAGE_TILE_ROWS", "256"))
+    # zlib level (0-9) for PNG outputs of the image tools: higher is smaller and slower
+    IMAGE_PNG_COMPRESS_LEVEL: int = int(os.getenv("IMAGE_PNG_COMPRESS_LEVEL", "9"))
+    # Largest image a resize will produce; bigger targets are scaled down to fit
+    MAX_IMAGE_OUTPUT_MEGAPIXELS: float = float(os.getenv("MAX_IMAGE_OUTPUT_MEGAPIXELS", "50"))
+    # A ZIP of images sent to /image/batch (each image still has the image limit)
+    MAX_IMAGE_BATCH_UPLOAD_MB: int = int(os.getenv("MAX_IMAGE_BATCH_UPLOAD_MB", "500"))
+
+    # Concurrent external processes (0 = derive from CPU count)
+    PROCESS_CONCURRENCY: int = int(os.getenv("PROCESS_CONCURRENCY", "0"))
+    FFMPEG_CONCURRENCY: int = int(os.getenv("FFMPEG_CONCURRENCY", "0"))
+    # Files of one /audio/batch request processed at once (0 = CPU count)
+    BATCH_CONCURRENCY: int = int(os.getenv("BATCH_CONCURRENCY", "0"))
+
+    # Process-pool workers for background jobs (0 = CPU count)
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "0"))
+    # Reverse proxies (comma-separated IPs) whose X-Forwarded-For is believed
+    # when jobs are queued fairly per client; empty ignores the header
+    TRUSTED_PROXIES: frozenset = frozenset(ip.strip() for ip in os.getenv("TRUSTED_PROXIES", "").split(",") if ip.strip())
+    # Process-pool workers for /image/batch (0 = CPU count)
+    IMAGE_WORKERS: int = int(os.getenv("IMAGE_WORKERS", "0"))
+
+    # How often ffmpeg/ffprobe/fpcalc are re-probed (0 disables the schedule)
+    TOOLCHAIN_REFRESH_SECONDS: float = float(os.getenv("TOOLCHAIN_REFRESH_SECONDS", "600"))
+
 settings = Settings()
@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+# Shared responder for generated files.
+#
+# Starlette's FileResponse already answers Range and If-Range requests (single
+# and multipart/byteranges) and hands whole files to the server with
+# http.response.pathsend when it supports zero-copy sending. What it lacks is
+# added here: strong content ETags, 304 Not Modified, and media types taken
+# from the probed container instead of a hardcoded default.
+
+# Revalidate on every use; a matching ETag makes that a bodiless 304
+CACHE_CONTROL = "private, no-cache"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Container names as reported by probe_media
+FORMAT_MEDIA_TYPES = {
+    "mp3": "audio/mpeg",
+    "wav": "audio/wav",
+    "flac": "audio/flac",
+    "ogg": "audio/ogg",
+    "mov": "audio/mp4",
+    "mp4": "audio/mp4",
+    "matroska": "audio/x-matroska",
+}
+EXTENSION_MEDIA_TYPES = {
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".flac": "audio/flac",
+    ".ogg": "audio/ogg",
+    ".opus": "audio/ogg",
+    ".m4a": "audio/mp4",
+    ".mp4": "video/mp4",
+    ".mov": "video/quicktime",
+    ".mkv": "video/x-matroska",
+    ".webm": "video/webm",
+    ".avi": "video/x-msvideo",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".svg": "image/svg+xml",
+    ".vtt": "text/vtt",
+    ".pdf": "application/pdf",
+    ".zip": "application/zip",
+}
+
+
+def media_type_for(path: str, media: Optional[dict] = None) -> str:
+    """Media type from the probed container, falling back to the file extension"""
+    container = (media or {}).get("format")
+    if container in FORMAT_MEDIA_TYPES:
+        return FORMAT_MEDIA_TYPES[container]
+    ext = os.path.splitext(str(path))[1].lower()
+    return EXTENSION_MEDIA_TYPES.get(ext) or mimetypes.guess_type(str(path))[0] or "application/octet-stream"
+
+
+def strong_etag(digest: str, version: Optional[int] = None, variant: Optional[str] = None) -> str:
+    """Quoted ETag for content `digest`, optionally qualified by edit version and rendition"""
+    parts = [digest[:32]]
+    if version is not None:
+        parts.append(f"v{version}")
+    if variant:
+        parts.append(variant)
+    return '"' + "-".join(parts) + '"'
+
+
+@lru_cache(maxsize=1024)
+def _file_digest(path: str, mtime_ns: int, size: int) -> str:
+    # Keyed on mtime and size so a rewritten file is hashed again
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def file_etag(path: str) -> str:
+    """Strong ETag from the file's SHA-256 (hashed once per file version)"""
+    stat = os.stat(path)
+    digest = await asyncio.to_thread(_file_digest, str(path), stat.st_mtime_ns, stat.st_size)
+    return strong_etag(digest)
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 requires for this header)"""
+    if header.strip() == "*":
+        return True
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def not_modified(request: Request, etag: str, background=None) -> Optional[Response]:
+    """A 304 response if the client already holds `etag`, else None"""
+    header = request.headers.get("if-none-match")
+    if header and etag_matches(header, etag):
+        return Response(status_code=304, headers={"etag": etag, "cache-control": CACHE_CONTROL}, background=background)
+    return None
+
+
+async def download_response(
+    request: Request,
+    path: str,
+    filename: Optional[str] = None,
+    media_type: Optional[str] = None,
+    media: Optional[dict] = None,
+    etag: Optional[str] = None,
+    headers: Optional[dict] = None,
+    background=None,
+    one_shot: bool = False,
+) -> Response:
+    """Serve a file with a strong ETag, 304 revalidation and byte-range support.
+
+    Pass `etag` when it is already known (e.g. from an upload hash) to skip
+    hashing the file. A `one_shot` file is deleted once sent, so nothing
+    could revalidate against it: it is served without hashing or a 304 check.
+    """
+    if one_shot:
+        return FileResponse(
+            path,
+            media_type=media_type or media_type_for(path, media),
+            filename=filename,
+            headers={**(headers or {}), "cache-control": "no-store"},
+            background=background,
+        )
+    if etag is None:
+        etag = await file_etag(path)
+    cached = not_modified(request, etag, background)
+    if cached is not None:
+        return cached
+    return FileResponse(
+        path,
+        media_type=media_type or media_type_for(path, media),
+        filename=filename,
+        headers={**(headers or {}), "etag": etag, "cache-control": CACHE_CONTROL},
+        background=background,
+    )
@@ -0,0 +1,245 @@
+import asyncio
+import hashlib
+import json
+from typing import AsyncIterator, List, Optional, Tuple
+
+from core.artifacts import artifacts
+from core.audio_trim import can_stream_copy, encoder_args, trim_file
+from core.process import ProcessError, ProcessTimeout, run_process, stream_process
+from core.time_stretch import pcm_blocks, stretch_pcm
+from core.toolchain import toolchain
+
+# Edit decision list for an audio session.
+#
+# /trim, /speed, /fade and /gain only append an entry to metadata['edits'];
+# the source file is never rewritten. Durations are tracked analytically and
+# the list is rendered once, as a single ffmpeg filtergraph, when a download
+# or preview is requested, into the artifact store. Undo is just popping the
+# last entry.
+
+RENDER_TIMEOUT = 300
+PREVIEW_ARGS = ["-c:a", "libmp3lame", "-b:a", "96k"]
+
+EDIT_OPS = ("trim", "speed", "fade", "gain")
+
+# Streamable outputs for /transcode: encoder, muxer, extension, media type.
+# AAC goes out as ADTS because MP4 needs a seekable output for its index.
+TRANSCODE_FORMATS = {
+    "mp3": ("libmp3lame", "mp3", ".mp3", "audio/mpeg"),
+    "opus": ("libopus", "ogg", ".opus", "audio/ogg"),
+    "aac": ("aac", "adts", ".aac", "audio/aac"),
+    "flac": ("flac", "flac", ".flac", "audio/flac"),
+    "wav": ("pcm_s16le", "wav", ".wav", "audio/wav"),
+}
+LOSSLESS_FORMATS = {"flac", "wav"}
+TRANSCODE_SAMPLE_RATES = {8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000, 96000}
+OPUS_SAMPLE_RATES = {8000, 12000, 16000, 24000, 48000}
+
+
+def edited_duration(source_duration: float, edits: List[dict]) -> float:
+    """Length of the timeline after applying `edits`, computed without decoding"""
+    duration = source_duration
+    for edit in edits:
+        if edit["op"] == "trim":
+            duration = edit["end"] - edit["start"]
+        elif edit["op"] == "speed":
+            duration = duration / edit["speed"]
+    return round(duration, 6)
+
+
+def edit_key(edits: List[dict]) -> str:
+    return hashlib.sha1(json.dumps(edits, sort_keys=True).encode()).hexdigest()
+
+
+def validate_edit(edit: dict, duration: float):
+    """Raise ValueError if `edit` cannot apply to a timeline of `duration` seconds"""
+    op = edit.get("op")
+    if op not in EDIT_OPS:
+        raise ValueError(f"Unknown edit operation: {op}")
+    if op == "trim":
+        if edit["start"] < 0 or edit["start"] >= edit["end"] or (duration and edit["end"] > duration + 0.001):
+            raise ValueError("Invalid start or end time")
+    elif op == "speed":
+        if edit["speed"] < 0.5 or edit["speed"] > 2.0:
+            raise ValueError("Speed must be between 0.5 and 2.0")
+    elif op == "fade":
+        if edit["direction"] not in ("in", "out"):
+            raise ValueError("Fade direction must be 'in' or 'out'")
+        if edit["seconds"] <= 0 or (duration and edit["seconds"] > duration):
+            raise ValueError("Fade length must be positive and no longer than the audio")
+    elif op == "gain":
+        if abs(edit["db"]) > 40:
+            raise ValueError("Gain must be between -40 and 40 dB")
+
+
+def apply_edit(metadata: dict, edit: dict):
+    """Record `edit` on the session; nothing is rendered"""
+    edits = metadata.setdefault('edits', [])
+    validate_edit(edit, metadata['duration'])
+    if edit["op"] == "trim" and metadata['duration']:
+        edit["end"] = min(edit["end"], metadata['duration'])
+    edits.append(edit)
+    metadata['duration'] = edited_duration(source_duration(metadata), edits)
+    metadata['version'] = metadata.get('version', 0) + 1
+
+
+def undo_edit(metadata: dict) -> Optional[dict]:
+    edits = metadata.get('edits') or []
+    if not edits:
+        return None
+    edit = edits.pop()
+    metadata['duration'] = edited_duration(source_duration(metadata), edits)
+    metadata['version'] = metadata.get('version', 0) + 1
+    return edit
+
+
+def source_duration(metadata: dict) -> float:
+    media = metadata.get('media') or {}
+    return media.get('duration') or metadata.get('source_duration') or 0.0
+
+
+def build_filtergraph(edits: List[dict], duration: float) -> str:
+    """Combine the edit list into one ffmpeg audio filter chain"""
+    filters = []
+    for edit in edits:
+        op = edit["op"]
+        if op == "trim":
+            filters.append(f"atrim=start={edit['start']:.6f}:end={edit['end']:.6f}")
+            filters.append("asetpts=PTS-STARTPTS")
+            duration = edit["end"] - edit["start"]
+        elif op == "speed":
+            filters.append(f"atempo={edit['speed']}")
+            duration = duration / edit["speed"]
+        elif op == "fade":
+            start = 0 if edit["direction"] == "in" else max(duration - edit["seconds"], 0)
+            filters.append(f"afade=t={edit['direction']}:st={start:.6f}:d={edit['seconds']:.6f}")
+        elif op == "gain":
+            filters.append(f"volume={edit['db']}dB")
+    return ",".join(filters)
+
+
+def trim_only_range(edits: List[dict]) -> Optional[Tuple[float, float]]:
+    """If every edit is a non-exact trim, the single source range they select"""
+    start, end = 0.0, None
+    for edit in edits:
+        if edit["op"] != "trim" or edit.get("exact"):
+            return None
+        end = start + edit["end"]
+        start = start + edit["start"]
+    return (start, end) if end is not None else None
+
+
+def session_files(metadata: dict) -> List[str]:
+    """Every file on disk that belongs to a session (source plus cached renders)"""
+    paths = [metadata['path']]
+    for render in (metadata.get('renders') or {}).values():
+        paths.append(render['path'])
+    return paths
+
+
+def _stretch_segment(audio, speed: float):
+    """Time-stretch a pydub segment block by block into a single preallocated buffer.
+
+    pydub holds the decoded segment; the stretch adds only its output and a
+    block of working memory, not float copies of the whole file.
+    """
+    frames = len(audio.raw_data) // audio.frame_width
+    out = bytearray(int(round(frames / speed)) * audio.frame_width)
+    written = 0
+    blocks = pcm_blocks(audio.raw_data, audio.frame_width, audio.frame_rate)
+    for chunk in stretch_pcm(blocks, audio.sample_width, audio.channels, audio.frame_rate, speed):
+        out[written:written + len(chunk)] = chunk
+        written += len(chunk)
+    return audio._spawn(out)
+
+
+def _render_with_pydub(src: str, dst: str, edits: List[dict], export_format: str):
+    """Slow fallback used only when ffmpeg cannot run the filtergraph"""
+    from pydub import AudioSegment
+
+    audio = AudioSegment.from_file(src)
+    for edit in edits:
+        op = edit["op"]
+        if op == "trim":
+            audio = audio[edit["start"] * 1000:edit["end"] * 1000]
+        elif op == "speed":
+            # WSOLA keeps the pitch, like atempo does
+            audio = _stretch_segment(audio, edit["speed"])
+        elif op == "fade":
+            fade_ms = int(edit["seconds"] * 1000)
+            audio = audio.fade_in(fade_ms) if edit["direction"] == "in" else audio.fade_out(fade_ms)
+        elif op == "gain":
+            audio = audio.apply_gain(edit["db"])
+    audio.export(dst, format=export_format)
+
+
+async def render(file_id: str, metadata: dict, kind: str = "download", request=None) -> str:
+    """Render the session's edit list to a file and cache it on the session.
+
+    kind="download" keeps the source codec; kind="preview" is a small MP3.
+    Renders are keyed by the edit list, so repeated downloads (and undo back
+    to an already rendered state) are served from disk.
+    """
+    edits = metadata.get('edits') or []
+    if kind == "download" and not edits:
+        return metadata['path']
+
+    key = edit_key(edits)
+    renders = metadata.setdefault('renders', {})
+    cached = renders.get(kind)
+    # Evicted renders are simply rendered again
+    if cached and cached['key'] == key and artifacts.lookup(cached['path']):
+        return cached['path']
+
+    media = metadata.get('media')
+    ext = ".mp3" if kind == "preview" else metadata['extension']
+    src = metadata['path']
+
+    with artifacts.create(name=f"{file_id}.{kind}.{key[:12]}{ext}") as output:
+        copy_range = trim_only_range(edits) if kind == "download" else None
+        if copy_range and can_stream_copy(media) and toolchain.available("ffmpeg"):
+            await trim_file(src, output.temp, copy_range[0], copy_range[1], media)
+        else:
+            codec_args = PREVIEW_ARGS if kind == "preview" else encoder_args(media, output.temp)
+            args = [toolchain.path("ffmpeg"), "-y", "-v", "error", "-i", src, "-map", "0:a:0"]
+            graph = build_filtergraph(edits, source_duration(metadata))
+            if graph:
+                args += ["-af", graph]
+            args += codec_args + [output.temp]
+            try:
+                if not toolchain.available("ffmpeg"):
+                    raise FileNotFoundError("ffmpeg is not installed")
+                await run_process(args, tool="ffmpeg", timeout=RENDER_TIMEOUT, request=request)
+            except (ProcessError, ProcessTimeout, FileNotFoundError) as e:
+                print(f"FFmpeg render failed, using pydub fallback: {e}")
+                await asyncio.to_thread(_render_with_pydub, src, output.temp, edits, ext[1:])
+
+    if cached and cached['path'] != output.path:
+        artifacts.discard(cached['path'])
+    renders[kind] = {'key': key, 'path': output.path}
+    return output.path
+
+
+def transcode_args(metadata: dict, fmt: str, bitrate: Optional[int] = None, sample_rate: Optional[int] = None) -> List[str]:
+    """ffmpeg command that applies the edit list and encodes to stdout in `fmt`"""
+    encoder, muxer, _, _ = TRANSCODE_FORMATS[fmt]
+    args = [toolchain.path("ffmpeg"), "-v", "error", "-i", metadata['path'], "-map", "0:a:0"]
+    graph = build_filtergraph(metadata.get('edits') or [], source_duration(metadata))
+    if graph:
+        args += ["-af", graph]
+    args += ["-c:a", encoder]
+    if bitrate and fmt not in LOSSLESS_FORMATS:
+        args += ["-b:a", f"{bitrate}k"]
+    if sample_rate:
+        args += ["-ar", str(sample_rate)]
+    elif fmt == "opus":
+        # libopus only takes a few rates; resample anything else to 48 kHz
+        source_rate = (metadata.get('media') or {}).get('sample_rate')
+        if source_rate not in OPUS_SAMPLE_RATES:
+            args += ["-ar", "48000"]
+    return args + ["-f", muxer, "-"]
+
+
+def transcode(metadata: dict, fmt: str, bitrate: Optional[int] = None, sample_rate: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Encoded bytes of the edited audio, yielded as ffmpeg produces them (no temp file)"""
+    return stream_process(transcode_args(metadata, fmt, bitrate, sample_rate), tool="ffmpeg", timeout=RENDER_TIMEOUT)
@@ -0,0 +1,96 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Callable, List, Optional
+
+from core.config import settings
+from core.image_ops import process_image
+
+# Batch image processing on a process pool.
+#
+# Pillow holds the GIL for most of its work, so threads would not scale and
+# running it in the request handler stalls every other request on the
+# worker. Items are decoded, processed and encoded in a pool of processes
+# sized to the cores; the event loop only reads inputs and writes the ZIP.
+# At most `in_flight` items are read, queued, processing or waiting to be
+# written at any time, so memory stays bounded however large the batch is.
+
+
+class ImagePool:
+    def __init__(self, workers: int):
+        self.workers = workers
+        # Enough queued work to keep every worker busy while results are written
+        self.in_flight = workers * 2
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.processed = 0
+        self.failed = 0
+
+    def start(self):
+        if self._pool is None:
+            # spawn: workers must not inherit the event loop or DB connections
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def run(self, readers: List[Callable[[], bytes]], stages: list,
+                  output_format: Optional[str], quality: Optional[int], strip: bool = False) -> AsyncIterator[dict]:
+        """Process one item per reader and yield results in completion order.
+
+        A reader is called in a thread and returns the item's bytes (or
+        raises ValueError for an unusable item). Each result is {index, ok,
+        data, extension} or {index, ok: False, error}, `index` being the
+        reader's position; items past the in-flight bound are only read once
+        earlier results have been consumed.
+        """
+        if self._pool is None:
+            raise RuntimeError("Image pool is not running")
+        loop = asyncio.get_running_loop()
+        limit = asyncio.Semaphore(self.in_flight)
+        results: asyncio.Queue = asyncio.Queue()
+        tasks = []
+
+        async def one(index: int, read: Callable[[], bytes]):
+            try:
+                data = await asyncio.to_thread(read)
+                encoded, extension = await loop.run_in_executor(
+                    self._pool, process_image, data, stages, output_format, quality, strip
+                )
+                self.processed += 1
+                await results.put({"index": index, "ok": True, "data": encoded, "extension": extension})
+            except Exception as e:
+                self.failed += 1
+                await results.put({"index": index, "ok": False, "error": str(e) or type(e).__name__})
+
+        async def feed():
+            for index, read in enumerate(readers):
+                await limit.acquire()
+                tasks.append(asyncio.create_task(one(index, read)))
+
+        feeder = asyncio.create_task(feed())
+        try:
+            for _ in range(len(readers)):
+                result = await results.get()
+                try:
+                    yield result
+                finally:
+                    limit.release()
+        finally:
+            # Client gone or batch done: stop reading and drop queued work
+            feeder.cancel()
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+
+image_pool = ImagePool(workers=settings.IMAGE_WORKERS or os.cpu_count() or 1)
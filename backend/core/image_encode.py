@@ -0,0 +1,109 @@
+import os
+import time
+from typing import Optional, Tuple
+
+from PIL import Image, features
+
+from core.config import settings
+
+# Output encoders for the image tools.
+#
+# Every format is written with the options that make it small: optimized
+# progressive JPEG, PNG at a high zlib level, WebP and AVIF at a quality
+# tuned for photos. When the client does not name a format, the Accept
+# header picks the most compact one it can display (AVIF, then WebP), and
+# otherwise the input's own format is kept. EXIF and the ICC profile are
+# carried over unless stripping is asked for.
+
+# format -> (Pillow format, extension, media type)
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+    "png": ("PNG", ".png", "image/png"),
+    "webp": ("WEBP", ".webp", "image/webp"),
+    "gif": ("GIF", ".gif", "image/gif"),
+}
+if features.check("avif"):
+    OUTPUT_FORMATS["avif"] = ("AVIF", ".avif", "image/avif")
+
+# Quality when none is given; the scales differ, these are visually close
+DEFAULT_QUALITY = {"jpeg": 85, "webp": 80, "avif": 60}
+# Negotiated formats, best first
+PREFERRED = ["avif", "webp"]
+
+# Modes each format can store directly (RGBX is what the filter engine hands
+# over for RGB); anything else is converted to RGB, or RGBA when it has
+# transparency the format can keep
+NATIVE_MODES = {
+    "jpeg": {"RGB", "RGBX", "L", "CMYK"},
+    "png": {"1", "L", "LA", "P", "RGB", "RGBA", "I;16"},
+    "webp": {"RGB", "RGBX", "RGBA"},
+    "avif": {"RGB", "RGBX", "RGBA"},
+    "gif": {"P", "L"},
+}
+# Formats that keep transparency (GIF as a transparent palette entry, which
+# Pillow's GIF writer makes from RGBA)
+ALPHA_FORMATS = {"png", "webp", "avif", "gif"}
+# Metadata each format can carry
+METADATA = {"jpeg", "png", "webp", "avif"}
+
+
+def accepted_format(accept: str) -> Optional[str]:
+    """Most compact format the Accept header lists (q > 0), or None"""
+    listed = set()
+    for part in accept.split(","):
+        media_type, *params = (piece.strip() for piece in part.split(";"))
+        q = next((param[2:] for param in params if param.startswith("q=")), "1")
+        try:
+            if float(q) > 0:
+                listed.add(media_type.lower())
+        except ValueError:
+            continue
+    for name in PREFERRED:
+        if name in OUTPUT_FORMATS and OUTPUT_FORMATS[name][2] in listed:
+            return name
+    return None
+
+
+def check_options(output_format: Optional[str], quality: Optional[int]):
+    """ValueError unless the format is known and the quality is 1-100"""
+    if output_format is not None and output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Format must be one of: {', '.join(OUTPUT_FORMATS)}")
+    if quality is not None and not 1 <= quality <= 100:
+        raise ValueError("Quality must be between 1 and 100")
+
+
+def _options(img: Image.Image, output_format: str, quality: Optional[int], strip: bool) -> dict:
+    options = {}
+    if output_format in DEFAULT_QUALITY:
+        options["quality"] = quality if quality is not None else DEFAULT_QUALITY[output_format]
+    if output_format == "jpeg":
+        options.update(optimize=True, progressive=True)
+    elif output_format == "png":
+        options["compress_level"] = settings.IMAGE_PNG_COMPRESS_LEVEL
+    elif output_format == "webp":
+        options["method"] = 5
+    elif output_format == "avif":
+        options["speed"] = 6
+    elif output_format == "gif":
+        options["optimize"] = True
+    if not strip and output_format in METADATA:
+        for name in ("exif", "icc_profile"):
+            if img.info.get(name):
+                options[name] = img.info[name]
+    return options
+
+
+def encode(img: Image.Image, path, output_format: str, quality: Optional[int] = None,
+           strip: bool = False) -> Tuple[str, dict]:
+    """Write `img` to `path` or a file object; returns (media type, size and timing headers)"""
+    pil_format, _, media_type = OUTPUT_FORMATS[output_format]
+    modes = NATIVE_MODES.get(output_format)
+    if modes and img.mode not in modes:
+        target = "RGBA" if output_format in ALPHA_FORMATS and img.has_transparency_data else "RGB"
+        if img.mode != target:
+            img = img.convert(target)
+    started = time.perf_counter()
+    img.save(path, pil_format, **_options(img, output_format, quality, strip))
+    elapsed = time.perf_counter() - started
+    size = path.tell() if hasattr(path, "tell") else os.path.getsize(path)
+    return media_type, {"X-Encoded-Size": str(size), "X-Encode-Time": f"{elapsed * 1000:.1f}ms"}
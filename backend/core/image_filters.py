@@ -0,0 +1,281 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+from PIL import Image
+
+from core.config import settings
+
+# Filter engine: filters as NumPy operations on the decoded pixels.
+#
+# A filter is a list of operations of four kinds:
+#
+# - ColorMatrix: each RGB pixel becomes M[:, :3] @ rgb + M[:, 3] (3x4 matrix)
+# - Curve: a 256-entry lookup table per channel
+# - Convolution: a separable kernel (a row and a column pass), optionally
+#   mixed with the input, which turns a blur into an unsharp mask
+# - Vignette: darkening by distance from the centre
+#
+# A run of per-pixel operations (matrices, curves, vignettes) is one pass:
+# consecutive matrices are multiplied into one, consecutive curves composed
+# into one table, and what is left is applied to chunks of about
+# POINT_CHUNK_PIXELS pixels while they are in cache. A convolution is a pass
+# of its own over strips of IMAGE_TILE_ROWS rows, with a halo of rows like
+# image_tiles.
+#
+# Pixels live in an H x W x 4 uint8 array that a Pillow image maps without
+# copying (Image.frombuffer; Pillow keeps RGB as 4 bytes a pixel as well),
+# and the result is handed to the encoder as is. Pillow decodes the upload
+# as usual and its pixels are copied into the array once, in that 4-byte
+# layout (Image.tobytes), so only public Pillow API is involved.
+
+# Part of the image tools' result cache keys: bump it when a change here
+# changes any output
+VERSION = 1
+
+MAX_KERNEL_SIZE = 31
+# Pixels per chunk of a per-pixel pass (~1 MB of float32 working memory)
+POINT_CHUNK_PIXELS = 1 << 16
+
+
+@dataclass(frozen=True)
+class ColorMatrix:
+    matrix: np.ndarray      # 3 x 4 float
+
+
+@dataclass(frozen=True)
+class Curve:
+    table: np.ndarray       # 3 x 256 uint8
+
+
+@dataclass(frozen=True)
+class Convolution:
+    kernel_x: np.ndarray    # odd length, applied along rows
+    kernel_y: np.ndarray    # odd length, applied along columns
+    mix: float = 1.0        # input + mix * (convolved - input)
+
+
+@dataclass(frozen=True)
+class Vignette:
+    strength: float = 0.5   # darkening at the corners, 0-1
+    radius: float = 0.5     # distance from the centre (1 = corner) where it starts
+
+
+Operation = Union[ColorMatrix, Curve, Convolution, Vignette]
+
+
+def color_matrix(values: Sequence[float]) -> ColorMatrix:
+    """From 12 numbers, row by row: R' = m0*R + m1*G + m2*B + m3, then G', B'"""
+    matrix = np.asarray(values, dtype=np.float32).reshape(3, 4)
+    return ColorMatrix(matrix)
+
+
+def curve(points: Sequence[Sequence[float]]) -> Curve:
+    """Tone curve through (input, output) points (0-255), interpolated linearly, the same for every channel"""
+    xs, ys = zip(*sorted(points))
+    table = np.clip(np.rint(np.interp(np.arange(256), xs, ys)), 0, 255).astype(np.uint8)
+    return Curve(np.stack([table] * 3))
+
+
+def gamma(value: float) -> Curve:
+    table = np.rint(255 * (np.arange(256) / 255) ** (1 / value)).astype(np.uint8)
+    return Curve(np.stack([table] * 3))
+
+
+def gaussian(sigma: float) -> np.ndarray:
+    radius = min(MAX_KERNEL_SIZE // 2, max(1, int(3 * sigma + 0.5)))
+    kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def convolution(kernel: Sequence[float], kernel_y: Optional[Sequence[float]] = None,
+                normalize: bool = True, mix: float = 1.0) -> Convolution:
+    """Separable convolution; `kernel` is used for both directions unless `kernel_y` is given"""
+    kernels = []
+    for values in (kernel, kernel if kernel_y is None else kernel_y):
+        k = np.asarray(values, dtype=np.float32)
+        if k.ndim != 1 or len(k) % 2 == 0 or len(k) > MAX_KERNEL_SIZE:
+            raise ValueError(f"Kernels must be a list of an odd number of values, at most {MAX_KERNEL_SIZE}")
+        if normalize:
+            if abs(float(k.sum())) < 1e-6:
+                raise ValueError("A kernel that sums to zero cannot be normalized")
+            k = k / k.sum()
+        kernels.append(k)
+    return Convolution(kernels[0], kernels[1], mix)
+
+
+SEPIA = color_matrix([
+    0.393, 0.769, 0.189, 0,
+    0.349, 0.686, 0.168, 0,
+    0.272, 0.534, 0.131, 0,
+])
+
+# Named filters
+FILTERS: Dict[str, List[Operation]] = {
+    "sepia": [SEPIA],
+    "invert": [Curve(np.stack([np.arange(255, -1, -1, dtype=np.uint8)] * 3))],
+    "warm": [color_matrix([1.08, 0, 0, 8, 0, 1.0, 0, 0, 0, 0, 0.88, -8])],
+    "cool": [color_matrix([0.9, 0, 0, -8, 0, 1.0, 0, 0, 0, 0, 1.1, 8])],
+    "punch": [curve([(0, 0), (64, 48), (128, 128), (192, 208), (255, 255)])],
+    "brighten": [gamma(1.3)],
+    "gaussian_blur": [convolution(gaussian(2.0))],
+    "box_blur": [convolution([1] * 5)],
+    "sharpen": [convolution(gaussian(1.0), mix=-1.0)],
+    "vignette": [Vignette()],
+    "vintage": [SEPIA, curve([(0, 20), (128, 128), (255, 235)]), Vignette(0.6, 0.4)],
+}
+
+
+def register(name: str, *operations: Operation):
+    FILTERS[name] = list(operations)
+
+
+def _fuse(operations: List[Operation]) -> List[List[Operation]]:
+    """Passes over the image: runs of per-pixel operations with neighbours merged, and convolutions"""
+    passes: List[List[Operation]] = []
+    for op in operations:
+        if isinstance(op, Convolution):
+            passes.append([op])
+            continue
+        if not passes or isinstance(passes[-1][0], Convolution):
+            passes.append([])
+        current = passes[-1]
+        previous = current[-1] if current else None
+        if isinstance(op, ColorMatrix) and isinstance(previous, ColorMatrix):
+            # (A then B) = B[:, :3] @ A + B's offset
+            combined = op.matrix[:, :3] @ previous.matrix
+            combined[:, 3] += op.matrix[:, 3]
+            current[-1] = ColorMatrix(combined)
+        elif isinstance(op, Curve) and isinstance(previous, Curve):
+            current[-1] = Curve(np.stack([op.table[c][previous.table[c]] for c in range(3)]))
+        else:
+            current.append(op)
+    return passes
+
+
+def _vignette_mask(op: Vignette, top: int, bottom: int, width: int, height: int) -> np.ndarray:
+    y = (np.arange(top, bottom, dtype=np.float32) - (height - 1) / 2) / (height / 2)
+    x = (np.arange(width, dtype=np.float32) - (width - 1) / 2) / (width / 2)
+    distance = np.sqrt((y[:, None] ** 2 + x[None, :] ** 2) / 2)
+    falloff = np.clip((distance - op.radius) / max(1e-6, 1 - op.radius), 0, 1)
+    return (1 - op.strength * falloff ** 2)[..., None]
+
+
+def _affine(op: ColorMatrix) -> np.ndarray:
+    """The 3x4 matrix as 4x4 over (R, G, B, A) rows, alpha passed through; the offset is a fifth row"""
+    affine = np.zeros((5, 4), dtype=np.float32)
+    affine[:3, :3] = op.matrix[:, :3].T
+    affine[3, 3] = 1
+    affine[4, :3] = op.matrix[:, 3] + 0.5   # + 0.5: truncating to uint8 then rounds
+    return affine
+
+
+def _store(values: np.ndarray, chunk: np.ndarray):
+    """Write float pixels (already offset by 0.5) back into the uint8 chunk"""
+    np.clip(values, 0, 255, out=values)
+    chunk[...] = values.reshape(chunk.shape)
+
+
+def _point_pass(pixels: np.ndarray, operations: List[Operation]):
+    height, width = pixels.shape[:2]
+    # Matrices run on all four bytes of a pixel, which keeps the chunk
+    # contiguous; the fourth column maps to itself
+    prepared = [_affine(op) if isinstance(op, ColorMatrix) else op for op in operations]
+    rows = max(1, POINT_CHUNK_PIXELS // width)
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        chunk = pixels[top:bottom]
+        values = None       # float (pixels x 4) while a matrix or vignette is pending, rounded on store
+        for op in prepared:
+            if isinstance(op, Curve):
+                if values is not None:
+                    _store(values, chunk)
+                    values = None
+                for c in range(3):
+                    chunk[..., c] = op.table[c][chunk[..., c]]
+            elif isinstance(op, np.ndarray):
+                if values is None:
+                    values = chunk.reshape(-1, 4).astype(np.float32) @ op[:4]
+                    values += op[4]
+                else:
+                    values -= 0.5
+                    values = values @ op[:4] + op[4]
+            else:
+                if values is None:
+                    values = chunk.reshape(-1, 4).astype(np.float32)
+                else:
+                    values -= 0.5
+                mask = _vignette_mask(op, top, bottom, width, height).reshape(-1, 1)
+                values[:, :3] *= mask
+                values += 0.5
+        if values is not None:
+            _store(values, chunk)
+
+
+def _convolution_pass(pixels: np.ndarray, op: Convolution, rows: int):
+    height, width = pixels.shape[:2]
+    ry, rx = len(op.kernel_y) // 2, len(op.kernel_x) // 2
+    rows = max(rows, ry)    # the saved halo must come from the previous strip alone
+    above = None            # source rows just above the strip, saved before they were overwritten
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        below = min(height, bottom + ry)
+        window = pixels[top:below, :, :3].astype(np.float32)
+        if above is not None:
+            window = np.concatenate([above, window])
+        # Past the image edges the edge rows and columns repeat
+        pad_top = ry - (len(above) if above is not None else 0)
+        window = np.pad(window, ((pad_top, ry - (below - bottom)), (rx, rx), (0, 0)), mode="edge")
+        if ry and bottom < height:
+            above = pixels[bottom - ry:bottom, :, :3].astype(np.float32)
+        count = bottom - top
+        # Accumulate in place: one temporary per direction, not one per tap
+        vertical = window[:count] * op.kernel_y[0]
+        for i in range(1, len(op.kernel_y)):
+            vertical += window[i:i + count] * op.kernel_y[i]
+        result = vertical[:, :width] * op.kernel_x[0]
+        for j in range(1, len(op.kernel_x)):
+            result += vertical[:, j:j + width] * op.kernel_x[j]
+        if op.mix != 1.0:
+            source = window[ry:ry + count, rx:rx + width]
+            result -= source
+            result *= op.mix
+            result += source
+        result += 0.5
+        np.clip(result, 0, 255, out=result)
+        pixels[top:bottom, :, :3] = result
+
+
+def shared_image(pixels: np.ndarray, mode: str) -> Image.Image:
+    """A Pillow image over `pixels` (H x W x 4 uint8), sharing its memory.
+
+    An RGB image comes out as RGBX, the 4-byte layout it maps. Pillow
+    treats it as read-only (writing through it would copy); the engine
+    writes to `pixels` directly.
+    """
+    height, width = pixels.shape[:2]
+    return Image.frombuffer(mode, (width, height), pixels, "raw", "RGBA" if mode == "RGBA" else "RGBX", 0, 1)
+
+
+def to_pixels(img: Image.Image):
+    """(pixels, image over them) for `img` as RGB (an RGBX image) or RGBA"""
+    mode = "RGBA" if img.mode in ("RGBA", "LA", "PA") or img.info.get("transparency") is not None else "RGB"
+    pixels = np.empty((img.height, img.width, 4), dtype=np.uint8)
+    shared = shared_image(pixels, mode)
+    if img.mode != mode:
+        img = img.convert(mode)
+    pixels.reshape(-1)[:] = np.frombuffer(img.tobytes("raw", shared.mode), dtype=np.uint8)
+    shared.info = img.info.copy()
+    return pixels, shared
+
+
+def apply(img: Image.Image, operations: List[Operation]) -> Image.Image:
+    """Run `operations` on `img`; the result shares its pixels with the engine's array"""
+    pixels, out = to_pixels(img)
+    rows = settings.IMAGE_TILE_ROWS
+    for group in _fuse(operations):
+        if isinstance(group[0], Convolution):
+            _convolution_pass(pixels, group[0], rows)
+        else:
+            _point_pass(pixels, group)
+    return out
@@ -0,0 +1,363 @@
+import io
+import math
+from typing import Callable, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageEnhance, ImageFilter
+
+from core.artifacts import artifacts
+from core.config import settings
+from core import image_filters
+from core.image_encode import OUTPUT_FORMATS, check_options, encode
+from core.image_tiles import decode_rows, filter_strips
+
+# Image operations as composable stages.
+#
+# Every stage takes a decoded image and returns a new one. /image/crop and
+# /image/filter run a single stage; /image/pipeline decodes the upload once
+# from memory, runs an ordered list of stages and encodes exactly once at the
+# end, so a crop followed by a filter costs one decode and one (lossy) encode
+# instead of two of each.
+#
+# Images are refused before decoding once they are over MAX_IMAGE_MEGAPIXELS
+# (counting only what will actually be decoded), and kernel filters run in
+# place strip by strip (core/image_tiles.py), so a huge upload cannot take a
+# worker down. The decoded image itself is held whole.
+# Color matrices, curves, separable kernels and the named filters built from
+# them run on the NumPy filter engine (core/image_filters.py); consecutive
+# engine stages are handed to it together so it can fuse them.
+
+FILTERS = {
+    "blur": ImageFilter.BLUR,
+    "contour": ImageFilter.CONTOUR,
+    "detail": ImageFilter.DETAIL,
+    "edge_enhance": ImageFilter.EDGE_ENHANCE,
+}
+ENHANCERS = {
+    "brightness": ImageEnhance.Brightness,
+    "contrast": ImageEnhance.Contrast,
+    "color": ImageEnhance.Color,
+    "sharpness": ImageEnhance.Sharpness,
+}
+MAX_DIMENSION = 16384
+MAX_ENHANCE_FACTOR = 10.0
+# Largest |mix| of a convolve operation (negative mixes sharpen)
+MAX_MIX = 10.0
+
+# Downscales first shrink by whole factors (JPEG DCT scaling on load, then
+# box reduction) to no less than this multiple of the target, and resample
+# only the rest with LANCZOS: a fraction of the work for the same result.
+REDUCING_GAP = 2.0
+
+# Pillow's own decompression-bomb guard (a warning past the limit, an error at
+# twice it) follows the same budget, for the tools that open images directly
+Image.MAX_IMAGE_PIXELS = int(settings.MAX_IMAGE_MEGAPIXELS * 1_000_000)
+
+# EXIF orientation -> transpose that makes the image upright
+ORIENTATION_TAG = 0x0112
+ORIENTATIONS = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def crop(img: Image.Image, left: int, top: int, right: int, bottom: int) -> Image.Image:
+    return img.crop((left, top, right, bottom))
+
+
+def apply_filter(img: Image.Image, filter_type: str) -> Image.Image:
+    """Named filter (a Pillow kernel or a filter engine one); unknown names leave the image as it is"""
+    if filter_type == "grayscale":
+        return grayscale(img)
+    if filter_type in image_filters.FILTERS:
+        return image_filters.apply(img, image_filters.FILTERS[filter_type])
+    kernel = FILTERS.get(filter_type)
+    return filter_strips(img, kernel) if kernel else img
+
+
+def grayscale(img: Image.Image) -> Image.Image:
+    return img.convert("L")
+
+
+def resize(img: Image.Image, width: Optional[int] = None, height: Optional[int] = None) -> Image.Image:
+    """Resize to width x height; with only one given the aspect ratio is kept"""
+    return img.resize(target_size(img.size, width, height), Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+
+
+def rotate(img: Image.Image, degrees: float, expand: bool = True) -> Image.Image:
+    """Counter-clockwise rotation; right angles are exact transposes"""
+    transposes = {90: Image.Transpose.ROTATE_90, 180: Image.Transpose.ROTATE_180, 270: Image.Transpose.ROTATE_270}
+    if degrees % 360 == 0:
+        return img
+    if expand and degrees % 90 == 0:
+        return img.transpose(transposes[int(degrees % 360)])
+    return img.rotate(degrees, resample=Image.Resampling.BICUBIC, expand=expand)
+
+
+def enhance(img: Image.Image, kind: str, factor: float) -> Image.Image:
+    return ENHANCERS[kind](img).enhance(factor)
+
+
+def engine_operations(stage: str, kwargs: dict) -> Optional[list]:
+    """Filter engine operations of a stage, or None for stages the engine does not run"""
+    if stage == "filter":
+        return image_filters.FILTERS.get(kwargs["filter_type"])
+    if stage == "color_matrix":
+        return [image_filters.color_matrix(kwargs["matrix"])]
+    if stage == "curve":
+        return [image_filters.curve(kwargs["points"])]
+    if stage == "convolve":
+        return [image_filters.convolution(kwargs["kernel"], kwargs["kernel_y"], kwargs["normalize"], kwargs["mix"])]
+    return None
+
+
+# Pillow stages; filter engine stages (see engine_operations) are run by _apply
+STAGES: Dict[str, Callable[..., Image.Image]] = {
+    "crop": crop,
+    "resize": resize,
+    "rotate": rotate,
+    "filter": apply_filter,
+    "enhance": enhance,
+    "grayscale": grayscale,
+}
+
+
+def _number(operation: dict, name: str, kind=int, required: bool = True):
+    value = operation.get(name)
+    if value is None:
+        if required:
+            raise ValueError(f"'{name}' is required for {operation['op']}")
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or (kind is int and value != int(value)):
+        raise ValueError(f"'{name}' must be {'an integer' if kind is int else 'a number'}")
+    return kind(value)
+
+
+def _numbers(values) -> bool:
+    return isinstance(values, list) and all(
+        isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v) for v in values
+    )
+
+
+def build_stage(operation: dict) -> Tuple[str, dict]:
+    """Validate one operation ({"op": ..., params}); returns (stage, keyword arguments)"""
+    op = operation.get("op")
+    if op == "crop":
+        box = {name: _number(operation, name) for name in ("left", "top", "right", "bottom")}
+        if box["left"] >= box["right"] or box["top"] >= box["bottom"]:
+            raise ValueError("Crop box must have right > left and bottom > top")
+        return op, box
+    if op == "resize":
+        width, height = _number(operation, "width", required=False), _number(operation, "height", required=False)
+        if width is None and height is None:
+            raise ValueError("Resize needs a width, a height or both")
+        for value in (width, height):
+            if value is not None and not 1 <= value <= MAX_DIMENSION:
+                raise ValueError(f"Resize dimensions must be between 1 and {MAX_DIMENSION}")
+        return op, {"width": width, "height": height}
+    if op == "rotate":
+        return op, {"degrees": _number(operation, "degrees", float), "expand": bool(operation.get("expand", True))}
+    if op == "filter":
+        names = sorted([*FILTERS, *image_filters.FILTERS, "grayscale"])
+        if operation.get("type") not in names:
+            raise ValueError(f"Filter type must be one of: {', '.join(names)}")
+        return op, {"filter_type": operation["type"]}
+    if op == "color_matrix":
+        matrix = operation.get("matrix")
+        if not _numbers(matrix) or len(matrix) != 12:
+            raise ValueError("'matrix' must be a list of 12 numbers (3 rows of R, G, B, offset)")
+        return op, {"matrix": [float(value) for value in matrix]}
+    if op == "curve":
+        points = operation.get("points")
+        if (not isinstance(points, list) or len(points) < 2
+                or not all(_numbers(point) and len(point) == 2 and all(0 <= v <= 255 for v in point) for point in points)):
+            raise ValueError("'points' must be a list of at least two [input, output] pairs between 0 and 255")
+        return op, {"points": [[float(x), float(y)] for x, y in points]}
+    if op == "convolve":
+        kwargs = {"kernel": operation.get("kernel"), "kernel_y": operation.get("kernel_y"),
+                  "normalize": bool(operation.get("normalize", True)),
+                  "mix": _number(operation, "mix", float, required=False)}
+        kwargs["mix"] = 1.0 if kwargs["mix"] is None else kwargs["mix"]
+        for name in ("kernel", "kernel_y"):
+            if kwargs[name] is not None and not _numbers(kwargs[name]):
+                raise ValueError(f"'{name}' must be a list of numbers")
+        if kwargs["kernel"] is None:
+            raise ValueError("'kernel' is required for convolve")
+        if not -MAX_MIX <= kwargs["mix"] <= MAX_MIX:
+            raise ValueError(f"'mix' must be between -{MAX_MIX} and {MAX_MIX}")
+        image_filters.convolution(kwargs["kernel"], kwargs["kernel_y"], kwargs["normalize"], kwargs["mix"])
+        return op, kwargs
+    if op == "enhance":
+        if operation.get("kind") not in ENHANCERS:
+            raise ValueError(f"Enhance kind must be one of: {', '.join(sorted(ENHANCERS))}")
+        factor = _number(operation, "factor", float)
+        if not 0 <= factor <= MAX_ENHANCE_FACTOR:
+            raise ValueError(f"Enhance factor must be between 0 and {MAX_ENHANCE_FACTOR}")
+        return op, {"kind": operation["kind"], "factor": factor}
+    if op == "grayscale":
+        return op, {}
+    raise ValueError(f"Unknown operation: {op}")
+
+
+def build_pipeline(operations: List[dict]) -> Tuple[List[Tuple[str, dict]], Optional[str], Optional[int]]:
+    """Stages plus the output format and quality from an optional "format" operation"""
+    stages, output_format, quality = [], None, None
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise ValueError("Each operation must be an object")
+        if operation.get("op") != "format":
+            stages.append(build_stage(operation))
+            continue
+        if output_format is not None:
+            raise ValueError("Only one format operation is allowed")
+        output_format = operation.get("format")
+        if output_format is None:
+            raise ValueError("'format' is required for format")
+        quality = _number(operation, "quality", required=False)
+        check_options(output_format, quality)
+    return stages, output_format, quality
+
+
+def open_image(data: bytes) -> Image.Image:
+    """Image.open from memory (only the header is read); ValueError for decompression bombs"""
+    try:
+        return Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError as e:
+        raise ValueError(str(e))
+
+
+def check_pixels(img: Image.Image):
+    """ValueError if decoding `img` at its current size would exceed MAX_IMAGE_MEGAPIXELS"""
+    megapixels = img.width * img.height / 1_000_000
+    if megapixels > settings.MAX_IMAGE_MEGAPIXELS:
+        raise ValueError(
+            f"Image is too large ({megapixels:.0f} megapixels, at most {settings.MAX_IMAGE_MEGAPIXELS:g})"
+        )
+
+
+def source_format(img: Image.Image) -> str:
+    """Output format when none is asked for: the input's, if it can be written"""
+    name = (img.format or "").lower()
+    return name if name in OUTPUT_FORMATS else "png"
+
+
+def target_size(size: Tuple[int, int], width: Optional[int], height: Optional[int],
+                fit: bool = False) -> Tuple[int, int]:
+    """Output size for a resize of `size`, within the megapixel budget.
+
+    With `fit` the image is scaled to fit inside width x height and never
+    enlarged; otherwise a single dimension keeps the aspect ratio and both
+    are taken as given.
+    """
+    if fit:
+        scale = min(1.0, width / size[0], height / size[1])
+        width, height = max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+    elif width is None:
+        width = max(1, round(size[0] * height / size[1]))
+    elif height is None:
+        height = max(1, round(size[1] * width / size[0]))
+    budget = settings.MAX_IMAGE_OUTPUT_MEGAPIXELS * 1_000_000
+    if width * height > budget:
+        scale = (budget / (width * height)) ** 0.5
+        width, height = max(1, int(width * scale)), max(1, int(height * scale))
+    return width, height
+
+
+def upright_size(img: Image.Image) -> Tuple[int, int]:
+    """Size as displayed, once the EXIF orientation is applied"""
+    return img.size[::-1] if img.getexif().get(ORIENTATION_TAG) in (5, 6, 7, 8) else img.size
+
+
+def scaled_open(data: bytes, width: Optional[int], height: Optional[int], fit: bool = False) -> Image.Image:
+    """Decode `data` straight to its resized, upright form.
+
+    JPEGs are decoded at the smallest DCT scale (1/2, 1/4 or 1/8) that still
+    covers REDUCING_GAP times the target, so a 48 MP photo bound for a 512 px
+    preview never exists at full resolution in memory. The EXIF orientation
+    is applied to the small result rather than the full image.
+    """
+    img = open_image(data)
+    orientation = img.getexif().get(ORIENTATION_TAG)
+    target = target_size(upright_size(img), width, height, fit)
+    if orientation in (5, 6, 7, 8):
+        target = target[::-1]   # the stored image is sideways
+    draft = img.draft(img.mode, (int(target[0] * REDUCING_GAP), int(target[1] * REDUCING_GAP)))
+    # The part of the (possibly reduced) image that maps onto the target
+    box = draft[1] if draft else None
+    check_pixels(img)
+    if img.size != target:
+        img = img.resize(target, Image.Resampling.LANCZOS, box=box, reducing_gap=REDUCING_GAP)
+    if orientation in ORIENTATIONS:
+        img = img.transpose(ORIENTATIONS[orientation])
+        # Kept EXIF must not rotate the upright result again
+        exif = img.getexif()
+        exif[ORIENTATION_TAG] = 1
+        img.info["exif"] = exif.tobytes()
+    return img
+
+
+def run_resize(data: bytes, width: Optional[int], height: Optional[int], fit: bool = False,
+               output_format: Optional[str] = None, quality: Optional[int] = None, strip: bool = False) -> dict:
+    """scaled_open, stored in `output_format` (default: the input's)"""
+    if output_format is None:
+        output_format = source_format(open_image(data))     # reads only the header
+    img = scaled_open(data, width, height, fit)
+    result = _store(img, output_format, quality, strip)
+    result["headers"]["X-Image-Size"] = f"{img.width}x{img.height}"
+    return result
+
+
+def _apply(data: bytes, stages: List[Tuple[str, dict]], output_format: Optional[str]) -> Tuple[Image.Image, str]:
+    img = open_image(data)
+    output_format = output_format or source_format(img)
+    first, kwargs = stages[0] if stages else (None, {})
+    if first == "resize":
+        # A leading resize can shrink a JPEG while it is decoded
+        width, height = target_size(img.size, kwargs["width"], kwargs["height"])
+        draft = img.draft(img.mode, (int(width * REDUCING_GAP), int(height * REDUCING_GAP)))
+        check_pixels(img)
+        img = img.resize((width, height), Image.Resampling.LANCZOS,
+                         box=draft[1] if draft else None, reducing_gap=REDUCING_GAP)
+        stages = stages[1:]
+    elif first == "crop":
+        # and a leading crop need not decode the rows below it
+        decode_rows(img, kwargs["bottom"])
+    check_pixels(img)
+    operations = []     # consecutive filter engine stages run (and fuse) as one
+    for name, kwargs in stages:
+        engine = engine_operations(name, kwargs)
+        if engine is not None:
+            operations.extend(engine)
+            continue
+        if operations:
+            img, operations = image_filters.apply(img, operations), []
+        img = STAGES[name](img, **kwargs)
+    if operations:
+        img = image_filters.apply(img, operations)
+    return img, output_format
+
+
+def _store(img: Image.Image, output_format: str, quality: Optional[int], strip: bool) -> dict:
+    with artifacts.create(OUTPUT_FORMATS[output_format][1]) as output:
+        media_type, headers = encode(img, output.temp, output_format, quality, strip)
+    return {"path": output.path, "media_type": media_type, "headers": headers}
+
+
+def run_pipeline(data: bytes, stages: List[Tuple[str, dict]], output_format: Optional[str] = None,
+                 quality: Optional[int] = None, strip: bool = False) -> dict:
+    """Decode `data` once, apply `stages` in order and store the single encode"""
+    img, output_format = _apply(data, stages, output_format)
+    return _store(img, output_format, quality, strip)
+
+
+def process_image(data: bytes, stages: List[Tuple[str, dict]], output_format: Optional[str] = None,
+                  quality: Optional[int] = None, strip: bool = False) -> Tuple[bytes, str]:
+    """run_pipeline in memory, for pool workers: returns (encoded bytes, extension)"""
+    img, output_format = _apply(data, stages, output_format)
+    buffer = io.BytesIO()
+    encode(img, buffer, output_format, quality, strip)
+    return buffer.getvalue(), OUTPUT_FORMATS[output_format][1]
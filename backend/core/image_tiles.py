@@ -0,0 +1,114 @@
+import io
+from typing import Optional
+
+from PIL import Image, ImageFilter
+
+from core.config import settings
+
+# Strip-wise execution of the kernel filters, and row-limited PNG decoding.
+#
+# A kernel filter used to allocate a second full-size bitmap for its result.
+# Here it runs over strips of IMAGE_TILE_ROWS rows, each read with a halo of
+# `radius` rows above and below so that every output pixel sees the same
+# neighbours as in a single pass, and the result is written back over the
+# source strip by strip: on top of the decoded image, the working memory is
+# a few strips, not another image. Output is byte-identical to Image.filter.
+#
+# The decoded image itself is not tiled: Pillow decodes JPEG, WebP and
+# (apart from the case below) PNG in one piece, so peak memory is the full
+# bitmap plus a few strips, not proportional to the strip size. That floor
+# is bounded by MAX_IMAGE_MEGAPIXELS, checked before decoding. Per-pixel
+# conversions (grayscale) gain nothing from strips, since their output needs
+# a bitmap of its own either way, and use Image.convert directly.
+#
+# A crop of a (non-interlaced) PNG is decoded only down to its bottom edge,
+# since rows below it are never needed. Pillow has no public way to stop a
+# PNG decode early (draft and reduce are JPEG-only, crop loads everything),
+# so this shortens the extents of the image's tile before load(). The image
+# keeps its size; rows below the limit are simply never decoded. The tile
+# layout is not documented, so it is tried on a tiny PNG at import, and if
+# that fails the PNG decodes in full and a warning is printed.
+
+
+def kernel_radius(kernel) -> Optional[int]:
+    """Rows of context a fixed-size kernel filter reads on each side, or None if unknown"""
+    if isinstance(kernel, type):
+        kernel = kernel()   # ImageFilter.BLUR and friends are classes
+    args = getattr(kernel, "filterargs", None)
+    if not isinstance(kernel, ImageFilter.BuiltinFilter) or not args:
+        return None
+    return max(args[0]) // 2
+
+
+def filter_strips(img: Image.Image, kernel, rows: Optional[int] = None) -> Image.Image:
+    """img.filter(kernel), computed strip by strip in place of `img`"""
+    rows = rows or settings.IMAGE_TILE_ROWS
+    radius = kernel_radius(kernel)
+    if radius is None or img.height <= rows or img.mode == "P":
+        return img.filter(kernel)
+    # The saved halo must come from the previous strip alone
+    rows = max(rows, radius)
+    img.load()
+    width, height = img.size
+    above = None    # source rows just above the strip, saved before they were overwritten
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        window_top, window_bottom = max(0, top - radius), min(height, bottom + radius)
+        window = img.crop((0, top, width, window_bottom))
+        if above is not None:
+            # Halo above the strip, as it was before filtering
+            expanded = Image.new(img.mode, (width, window_bottom - window_top))
+            expanded.paste(above, (0, 0))
+            expanded.paste(window, (0, top - window_top))
+            window = expanded
+        if bottom < height:
+            above = img.crop((0, bottom - radius, width, bottom))
+        filtered = window.filter(kernel)
+        img.paste(filtered.crop((0, top - window_top, width, bottom - window_top)), (0, top))
+    return img
+
+
+# Relies on ImageFile.tile as of Pillow 11 (pinned <12 in requirements.txt);
+# re-run the probe below against a new major version before raising the pin.
+def _limit_rows(img: Image.Image, rows: int):
+    name, extents, offset, args = tile = img.tile[0]
+    extents = (0, 0, img.width, rows)
+    img.tile = [tile._replace(extents=extents) if hasattr(tile, "_replace") else (name, extents, offset, args)]
+
+
+def _probe_row_limit() -> bool:
+    """Whether limiting a PNG's rows before load() works in this Pillow, tried on a tiny PNG"""
+    try:
+        sample = Image.new("L", (2, 4))
+        sample.putdata([1, 1, 2, 2, 3, 3, 4, 4])
+        buffer = io.BytesIO()
+        sample.save(buffer, "PNG")
+        buffer.seek(0)
+        img = Image.open(buffer)
+        _limit_rows(img, 2)
+        img.load()
+        return img.size == (2, 4) and list(img.getdata())[:4] == [1, 1, 2, 2]
+    except Exception:
+        return False
+
+
+ROW_LIMIT = _probe_row_limit()
+if not ROW_LIMIT:
+    print(f"Warning: row-limited PNG decoding does not work with Pillow {Image.__version__}; crops decode in full")
+
+
+def decode_rows(img: Image.Image, rows: int) -> bool:
+    """Decode only the first `rows` rows of a not yet loaded PNG; the rest stay blank.
+
+    Returns whether it applied (other formats, interlaced PNGs and Pillow
+    versions where ROW_LIMIT failed decode in full).
+    """
+    if not ROW_LIMIT or img.format != "PNG" or img.info.get("interlace") or getattr(img, "is_animated", False):
+        return False
+    if len(img.tile) != 1 or rows >= img.height:
+        return False
+    name, extents, offset, args = img.tile[0]
+    if name != "zip" or extents != (0, 0) + img.size:
+        return False
+    _limit_rows(img, rows)
+    return True
@@ -0,0 +1,281 @@
+import asyncio
+import importlib
+import json
+import multiprocessing
+import os
+import socket
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+from uuid import uuid4
+
+from fastapi.responses import JSONResponse
+
+from core.config import settings
+
+# Background job queue for heavy media operations.
+#
+# Job status lives in the `jobs` table so any worker can answer a status
+# poll; execution happens in a bounded process pool owned by the worker that
+# accepted the job. Pending jobs are picked by priority first, then
+# round-robin across owners so one client cannot starve the others.
+#
+# Job functions run in spawned pool workers without an event loop; external
+# tools go through the shared async runner (core/process) under asyncio.run.
+#
+# A job belongs to the server worker that accepted it. When that worker
+# starts again, its unfinished jobs are marked failed; the reaper deletes
+# job rows once they are older than the processed/ TTL, finished or not.
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Higher runs first: edits someone is waiting on before bulk conversions and downloads
+PRIORITIES = {
+    "video.trim": 20,
+    "video.remove_sound": 20,
+    "converter.pdf_to_image": 10,
+    "socials.download": 0,
+}
+
+RESTARTED = "The server restarted before the job finished"
+
+
+def _call(module: str, name: str, kwargs: dict) -> dict:
+    """Entry point inside a pool worker: import the task and run it"""
+    fn = getattr(importlib.import_module(module), name)
+    return fn(**kwargs)
+
+
+def public_view(job: dict) -> dict:
+    """Job status as returned to clients (server paths stay private)"""
+    view = dict(job)
+    result = view.pop("result", None)
+    if view["status"] == DONE and result:
+        view["result_url"] = f"/api/v1/jobs/{view['job_id']}/result"
+        view["filename"] = result["filename"]
+    return view
+
+
+def accepted(job: dict) -> JSONResponse:
+    """202 response for an endpoint called with ?async=true"""
+    view = public_view(job)
+    view["status_url"] = f"/api/v1/jobs/{view['job_id']}"
+    return JSONResponse(status_code=202, content=view)
+
+
+def _orphaned(worker: Optional[str], host: str) -> bool:
+    """Whether the server worker that owned a job is gone (only judged on this host)"""
+    if not worker:
+        return True
+    worker_host, _, pid = worker.rpartition(":")
+    if worker_host != host or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        return True     # an earlier process that had this pid
+    if os.name == "nt":
+        return False    # os.kill would terminate it; the reaper's TTL covers these
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def client_key(request) -> str:
+    """Identify the submitting client for fair scheduling.
+
+    X-Forwarded-For is only believed from a TRUSTED_PROXIES peer, and then
+    read from the right: the last address not itself a trusted proxy is
+    the one our proxy saw. Entries to its left are client-supplied.
+    """
+    peer = request.client.host if request.client else "anonymous"
+    forwarded = request.headers.get("x-forwarded-for")
+    if not forwarded or peer not in settings.TRUSTED_PROXIES:
+        return peer
+    for hop in reversed(forwarded.split(",")):
+        hop = hop.strip()
+        if hop and hop not in settings.TRUSTED_PROXIES:
+            return hop
+    return peer
+
+
+class JobQueue:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # priority -> owner -> job ids, in arrival order
+        self._pending: Dict[int, "OrderedDict[str, deque]"] = {}
+        self._payloads: Dict[str, Tuple[Callable, dict]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task = None
+        self.worker_id = None
+        self.completed = 0
+        self.failed = 0
+        self.recovered = 0
+        self.reaped = 0
+
+    def _session(self):
+        from database import SessionLocal
+        return SessionLocal()
+
+    def _update(self, job_id: str, **fields):
+        from models import Job
+        with self._session() as db:
+            db.query(Job).filter(Job.id == job_id).update(fields, synchronize_session=False)
+            db.commit()
+
+    async def submit(self, kind: str, fn: Callable, owner: str, priority: Optional[int] = None, **kwargs) -> dict:
+        """Queue `fn(**kwargs)` to run in the process pool; returns the job status.
+
+        The priority defaults to the one PRIORITIES gives the job's kind.
+        """
+        from models import Job
+        if self._task is None:
+            raise RuntimeError("Job queue is not running")
+        if priority is None:
+            priority = PRIORITIES.get(kind, 0)
+        job_id = str(uuid4())
+        with self._session() as db:
+            db.add(Job(id=job_id, kind=kind, owner=owner, worker=self.worker_id, priority=priority,
+                       status=QUEUED, created_at=datetime.now()))
+            db.commit()
+        self._payloads[job_id] = (fn, kwargs)
+        self._pending.setdefault(priority, OrderedDict()).setdefault(owner, deque()).append(job_id)
+        self._wakeup.set()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        from models import Job
+        with self._session() as db:
+            job = db.get(Job, job_id)
+            if job is None:
+                return None
+            return {
+                "job_id": job.id,
+                "kind": job.kind,
+                "status": job.status,
+                "error": job.error,
+                "result": json.loads(job.result) if job.result else None,
+                "created_at": job.created_at.isoformat() if job.created_at else None,
+                "started_at": job.started_at.isoformat() if job.started_at else None,
+                "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+            }
+
+    def _pop(self) -> Optional[str]:
+        for priority in sorted(self._pending, reverse=True):
+            owners = self._pending[priority]
+            if not owners:
+                continue
+            owner, queue = next(iter(owners.items()))
+            job_id = queue.popleft()
+            if queue:
+                owners.move_to_end(owner)
+            else:
+                del owners[owner]
+            return job_id
+        return None
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()
+            job_id = self._pop()
+            while job_id is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                job_id = self._pop()
+            fn, kwargs = self._payloads.pop(job_id)
+            loop.create_task(self._run(job_id, fn, kwargs))
+
+    async def _run(self, job_id: str, fn: Callable, kwargs: dict):
+        loop = asyncio.get_running_loop()
+        try:
+            self._update(job_id, status=RUNNING, started_at=datetime.now())
+            result = await loop.run_in_executor(self._pool, _call, fn.__module__, fn.__name__, kwargs)
+            self._update(job_id, status=DONE, result=json.dumps(result), finished_at=datetime.now())
+            self.completed += 1
+            from core.artifacts import artifacts
+            artifacts.adopt(result["path"])
+        except Exception as e:
+            print(f"Job {job_id} failed: {type(e).__name__}: {e}")
+            self._update(job_id, status=FAILED, error=str(e), finished_at=datetime.now())
+            self.failed += 1
+        finally:
+            self._slots.release()
+
+    def recover(self) -> int:
+        """Fail the queued and running jobs whose server worker is gone; returns how many"""
+        from models import Job
+        host = socket.gethostname()
+        with self._session() as db:
+            rows = db.query(Job).filter(Job.status.in_([QUEUED, RUNNING])).all()
+            orphans = [row for row in rows if _orphaned(row.worker, host)]
+            for row in orphans:
+                row.status = FAILED
+                row.error = RESTARTED
+                row.finished_at = datetime.now()
+            db.commit()
+        self.recovered += len(orphans)
+        return len(orphans)
+
+    def reap(self, cutoff: datetime, limit: int) -> int:
+        """Delete up to `limit` jobs created before `cutoff` and not finished since; returns how many"""
+        from models import Job
+        with self._session() as db:
+            ids = [
+                job_id for job_id, in db.query(Job.id)
+                .filter(Job.created_at < cutoff)
+                .filter((Job.finished_at == None) | (Job.finished_at < cutoff))  # noqa: E711
+                .order_by(Job.created_at)
+                .limit(limit)
+            ]
+            if ids:
+                db.query(Job).filter(Job.id.in_(ids)).delete(synchronize_session=False)
+                db.commit()
+        self.reaped += len(ids)
+        return len(ids)
+
+    def start(self):
+        if self._task is None:
+            self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+            try:
+                self.recover()
+            except Exception as e:
+                print(f"Job recovery failed: {type(e).__name__}: {e}")
+            # spawn: workers must not inherit the event loop or DB connections
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.workers)
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": sum(len(q) for owners in self._pending.values() for q in owners.values()),
+            "completed": self.completed,
+            "failed": self.failed,
+            "recovered": self.recovered,
+            "reaped": self.reaped,
+        }
+
+
+job_queue = JobQueue(workers=settings.JOB_WORKERS or os.cpu_count() or 1)
@@ -0,0 +1,448 @@
+import asyncio
+import json
+import os
+import re
+import struct
+from typing import Optional
+
+from core.process import ProcessError, ProcessTimeout, run_process
+from core.toolchain import toolchain
+
+# Metadata is read from container headers only; samples are never decoded.
+# Order: ffprobe (most complete) -> built-in header parsers -> `ffmpeg -i` banner.
+
+PROBE_TIMEOUT = 15
+TAIL_SCAN_BYTES = 64 * 1024
+
+
+def _result(duration, sample_rate, channels, codec, bit_rate, container, probed_with) -> dict:
+    return {
+        "duration": round(float(duration), 3) if duration else 0.0,
+        "sample_rate": int(sample_rate) if sample_rate else None,
+        "channels": int(channels) if channels else None,
+        "codec": codec,
+        "bit_rate": int(bit_rate) if bit_rate else None,
+        "format": container,
+        "probed_with": probed_with,
+    }
+
+
+def _average_bit_rate(path: str, duration: float) -> Optional[int]:
+    if not duration:
+        return None
+    return int(os.path.getsize(path) * 8 / duration)
+
+
+# --- ffprobe / ffmpeg -------------------------------------------------------
+
+def ffprobe_args(path: str) -> list:
+    return [
+        toolchain.path("ffprobe"), "-v", "error",
+        "-show_format", "-show_streams", "-of", "json", path
+    ]
+
+
+def parse_ffprobe(output: str) -> Optional[dict]:
+    data = json.loads(output)
+    streams = [s for s in data.get("streams", []) if s.get("codec_type") == "audio"]
+    if not streams:
+        return None
+    stream = streams[0]
+    fmt = data.get("format", {})
+    duration = stream.get("duration") or fmt.get("duration")
+    return _result(
+        duration,
+        stream.get("sample_rate"),
+        stream.get("channels"),
+        stream.get("codec_name"),
+        stream.get("bit_rate") or fmt.get("bit_rate"),
+        (fmt.get("format_name") or "").split(",")[0] or None,
+        "ffprobe",
+    )
+
+
+_DURATION_RE = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+_BITRATE_RE = re.compile(r"bitrate: (\d+) kb/s")
+_INPUT_RE = re.compile(r"Input #0, ([\w,]+), from")
+_AUDIO_RE = re.compile(r"Stream #\d+:\d+.*?: Audio: (\w+)[^,]*, (\d+) Hz, ([^,]+)")
+_CHANNEL_LAYOUTS = {"mono": 1, "stereo": 2, "2.1": 3, "quad": 4, "4.0": 4, "5.0": 5, "5.1": 6, "6.1": 7, "7.1": 8}
+
+
+def ffmpeg_banner_args(path: str) -> list:
+    # With no output file ffmpeg only opens the input and prints its headers
+    return [toolchain.path("ffmpeg"), "-hide_banner", "-i", path]
+
+
+def parse_ffmpeg_banner(stderr: str) -> Optional[dict]:
+    audio = _AUDIO_RE.search(stderr)
+    duration = _DURATION_RE.search(stderr)
+    if not audio or not duration:
+        return None
+    hours, minutes, seconds = duration.groups()
+    layout = audio.group(3).strip()
+    channels = _CHANNEL_LAYOUTS.get(layout)
+    if channels is None:
+        match = re.match(r"(\d+) channels", layout)
+        channels = int(match.group(1)) if match else None
+    bit_rate = _BITRATE_RE.search(stderr)
+    container = _INPUT_RE.search(stderr)
+    return _result(
+        int(hours) * 3600 + int(minutes) * 60 + float(seconds),
+        audio.group(2),
+        channels,
+        audio.group(1),
+        int(bit_rate.group(1)) * 1000 if bit_rate else None,
+        container.group(1).split(",")[0] if container else None,
+        "ffmpeg",
+    )
+
+
+# --- Built-in header parsers ------------------------------------------------
+
+def _probe_wav(f, path: str) -> Optional[dict]:
+    header = f.read(12)
+    if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        return None
+    fmt = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack("<HHIIHH", f.read(16))
+            f.seek(size - 16 + (size & 1), os.SEEK_CUR)
+        elif chunk_id == b"data":
+            break
+        else:
+            f.seek(size + (size & 1), os.SEEK_CUR)
+    if fmt is None:
+        return None
+    audio_format, channels, sample_rate, byte_rate, _, bits = fmt
+    if not byte_rate:
+        return None
+    if audio_format == 3:
+        codec = f"pcm_f{bits}le"
+    elif audio_format in (1, 0xFFFE):
+        codec = "pcm_u8" if bits == 8 else f"pcm_s{bits}le"
+    else:
+        codec = f"wav_0x{audio_format:04x}"
+    return _result(size / byte_rate, sample_rate, channels, codec, byte_rate * 8, "wav", "header")
+
+
+def _probe_flac(f, path: str) -> Optional[dict]:
+    if f.read(4) != b"fLaC":
+        return None
+    block_header = f.read(4)
+    if len(block_header) < 4 or block_header[0] & 0x7F != 0:
+        return None
+    streaminfo = f.read(34)
+    if len(streaminfo) < 34:
+        return None
+    bits = int.from_bytes(streaminfo[10:18], "big")
+    sample_rate = bits >> 44
+    channels = ((bits >> 41) & 0x7) + 1
+    total_samples = bits & ((1 << 36) - 1)
+    if not sample_rate:
+        return None
+    duration = total_samples / sample_rate
+    return _result(duration, sample_rate, channels, "flac", _average_bit_rate(path, duration), "flac", "header")
+
+
+_MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],   # MPEG-1
+    2: [22050, 24000, 16000],   # MPEG-2
+    0: [11025, 12000, 8000],    # MPEG-2.5
+}
+
+
+def _skip_id3(f) -> int:
+    header = f.read(10)
+    if header[:3] != b"ID3":
+        return 0
+    size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _probe_mp3(f, path: str) -> Optional[dict]:
+    start = _skip_id3(f)
+    f.seek(start)
+    buf = f.read(TAIL_SCAN_BYTES)
+    for i in range(len(buf) - 4):
+        if buf[i] != 0xFF or buf[i + 1] & 0xE0 != 0xE0:
+            continue
+        header = struct.unpack(">I", buf[i:i + 4])[0]
+        version = (header >> 19) & 0x3
+        layer = (header >> 17) & 0x3
+        bitrate_index = (header >> 12) & 0xF
+        rate_index = (header >> 10) & 0x3
+        channel_mode = (header >> 6) & 0x3
+        # Layer III only; skip reserved values (likely a false sync)
+        if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            continue
+        mpeg1 = version == 3
+        bitrate = _MP3_BITRATES[1 if mpeg1 else 2][bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+        channels = 1 if channel_mode == 3 else 2
+        samples_per_frame = 1152 if mpeg1 else 576
+        side_info = (32 if channels == 2 else 17) if mpeg1 else (17 if channels == 2 else 9)
+
+        frames = None
+        xing = buf[i + 4 + side_info:i + 4 + side_info + 12]
+        if xing[:4] in (b"Xing", b"Info") and struct.unpack(">I", xing[4:8])[0] & 0x1:
+            frames = struct.unpack(">I", xing[8:12])[0]
+        vbri = buf[i + 36:i + 36 + 18]
+        if frames is None and vbri[:4] == b"VBRI":
+            frames = struct.unpack(">I", vbri[14:18])[0]
+
+        audio_bytes = os.path.getsize(path) - (start + i)
+        if frames:
+            duration = frames * samples_per_frame / sample_rate
+            bitrate = int(audio_bytes * 8 / duration) if duration else bitrate
+        else:
+            # Constant bitrate: size / bitrate is exact enough without decoding
+            duration = audio_bytes * 8 / bitrate
+        return _result(duration, sample_rate, channels, "mp3", bitrate, "mp3", "header")
+    return None
+
+
+def _probe_ogg(f, path: str) -> Optional[dict]:
+    page = f.read(27)
+    if page[:4] != b"OggS":
+        return None
+    segments = page[26]
+    f.read(segments)
+    packet = f.read(64)
+    if packet[:7] == b"\x01vorbis":
+        channels = packet[11]
+        sample_rate, _, nominal = struct.unpack("<IiI", packet[12:24])
+        codec, pre_skip, granule_rate = "vorbis", 0, sample_rate
+    elif packet[:8] == b"OpusHead":
+        channels = packet[9]
+        pre_skip = struct.unpack("<H", packet[10:12])[0]
+        sample_rate = struct.unpack("<I", packet[12:16])[0] or 48000
+        codec, nominal, granule_rate = "opus", 0, 48000
+    else:
+        return None
+
+    size = os.path.getsize(path)
+    f.seek(max(0, size - TAIL_SCAN_BYTES))
+    tail = f.read()
+    last = tail.rfind(b"OggS")
+    if last < 0 or last + 14 > len(tail):
+        return None
+    granule = struct.unpack("<q", tail[last + 6:last + 14])[0]
+    duration = max(granule - pre_skip, 0) / granule_rate
+    bit_rate = nominal if nominal and nominal < 2 ** 31 else _average_bit_rate(path, duration)
+    return _result(duration, sample_rate, channels, codec, bit_rate, "ogg", "header")
+
+
+def _iter_boxes(data: bytes, offset: int = 0, end: int = None):
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, box_type = struct.unpack(">I4s", data[offset:offset + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", data[offset + 8:offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            return
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def _find_box(data: bytes, path: list, offset: int = 0, end: int = None):
+    for box_type, body, box_end in _iter_boxes(data, offset, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return body, box_end
+            found = _find_box(data, path[1:], body, box_end)
+            if found:
+                return found
+    return None
+
+
+def _read_moov(f, path: str) -> Optional[bytes]:
+    # Walk top-level boxes by their sizes so mdat is skipped, not read
+    size = os.path.getsize(path)
+    offset = 0
+    while offset + 8 <= size:
+        f.seek(offset)
+        header = f.read(16)
+        box_size, box_type = struct.unpack(">I4s", header[:8])
+        header_len = 8
+        if box_size == 1:
+            box_size = struct.unpack(">Q", header[8:16])[0]
+            header_len = 16
+        elif box_size == 0:
+            box_size = size - offset
+        if box_size < header_len:
+            return None
+        if box_type == b"moov":
+            f.seek(offset)
+            return f.read(box_size)
+        offset += box_size
+    return None
+
+
+def _probe_mp4(f, path: str) -> Optional[dict]:
+    head = f.read(12)
+    if head[4:8] != b"ftyp":
+        return None
+    moov = _read_moov(f, path)
+    if moov is None:
+        return None
+    for box_type, body, box_end in _iter_boxes(moov, 8):
+        if box_type != b"trak":
+            continue
+        hdlr = _find_box(moov, [b"mdia", b"hdlr"], body, box_end)
+        if not hdlr or moov[hdlr[0] + 8:hdlr[0] + 12] != b"soun":
+            continue
+        mdhd = _find_box(moov, [b"mdia", b"mdhd"], body, box_end)
+        stsd = _find_box(moov, [b"mdia", b"minf", b"stbl", b"stsd"], body, box_end)
+        if not mdhd or not stsd:
+            continue
+        start = mdhd[0]
+        if moov[start] == 1:
+            timescale, duration = struct.unpack(">IQ", moov[start + 20:start + 32])
+        else:
+            timescale, duration = struct.unpack(">II", moov[start + 12:start + 20])
+        entry = stsd[0] + 8
+        entry_type = moov[entry + 4:entry + 8]
+        channels = struct.unpack(">H", moov[entry + 24:entry + 26])[0]
+        sample_rate = struct.unpack(">I", moov[entry + 32:entry + 36])[0] >> 16
+        codec = {b"mp4a": "aac", b"alac": "alac", b"Opus": "opus", b"fLaC": "flac"}.get(
+            entry_type, entry_type.decode("latin-1").strip()
+        )
+        seconds = duration / timescale if timescale else 0
+        return _result(seconds, sample_rate, channels, codec, _average_bit_rate(path, seconds), "mp4", "header")
+    return None
+
+
+_HEADER_PROBES = [_probe_wav, _probe_flac, _probe_ogg, _probe_mp4, _probe_mp3]
+
+
+def probe_headers(path: str) -> Optional[dict]:
+    """Parse duration and stream info from container headers in pure Python"""
+    with open(path, "rb") as f:
+        for probe in _HEADER_PROBES:
+            f.seek(0)
+            try:
+                result = probe(f, path)
+            except (struct.error, IndexError, ValueError, OSError):
+                result = None
+            if result and result["duration"]:
+                return result
+    return None
+
+
+async def probe_media(path: str) -> Optional[dict]:
+    """Return duration, sample rate, channels, codec and bitrate without decoding samples"""
+    if toolchain.available("ffprobe"):
+        try:
+            result = await run_process(ffprobe_args(path), tool="ffprobe", timeout=PROBE_TIMEOUT)
+            parsed = parse_ffprobe(result.text)
+            if parsed:
+                return parsed
+        except (OSError, ProcessError, ProcessTimeout, ValueError) as e:
+            print(f"ffprobe failed for {path}: {e}")
+
+    parsed = await asyncio.to_thread(probe_headers, path)
+    if parsed:
+        return parsed
+
+    if toolchain.available("ffmpeg"):
+        try:
+            # ffmpeg exits non-zero here ("no output file"); the banner is all we need
+            result = await run_process(
+                ffmpeg_banner_args(path), tool="ffmpeg", timeout=PROBE_TIMEOUT, check=False, stderr_lines=500
+            )
+            return parse_ffmpeg_banner(result.stderr)
+        except (OSError, ProcessTimeout) as e:
+            print(f"ffmpeg probe failed for {path}: {e}")
+    return None
+
+
+# --- Video ------------------------------------------------------------------
+
+_VIDEO_RE = re.compile(r"Stream #\d+:\d+.*?: Video: (\w+).*?, (\d+)x(\d+)[\s,\[]")
+_ROTATION_RE = re.compile(r"rotation of (-?[\d.]+) degrees")
+
+
+def _video_result(duration, codec, width, height, rotation, probed_with) -> dict:
+    width, height = int(width), int(height)
+    # Decoders apply the display matrix, so frames come out turned
+    if round(float(rotation or 0)) % 180:
+        width, height = height, width
+    return {
+        "duration": round(float(duration), 3) if duration else 0.0,
+        "codec": codec,
+        "width": width,
+        "height": height,
+        "probed_with": probed_with,
+    }
+
+
+def parse_ffprobe_video(output: str) -> Optional[dict]:
+    data = json.loads(output)
+    streams = [s for s in data.get("streams", []) if s.get("codec_type") == "video"]
+    if not streams or not streams[0].get("width"):
+        return None
+    stream = streams[0]
+    rotation = stream.get("tags", {}).get("rotate")
+    for side_data in stream.get("side_data_list", []):
+        rotation = side_data.get("rotation", rotation)
+    return _video_result(
+        stream.get("duration") or data.get("format", {}).get("duration"),
+        stream.get("codec_name"),
+        stream["width"],
+        stream["height"],
+        rotation,
+        "ffprobe",
+    )
+
+
+def parse_ffmpeg_video_banner(stderr: str) -> Optional[dict]:
+    video = _VIDEO_RE.search(stderr)
+    duration = _DURATION_RE.search(stderr)
+    if not video or not duration:
+        return None
+    hours, minutes, seconds = duration.groups()
+    rotation = _ROTATION_RE.search(stderr)
+    return _video_result(
+        int(hours) * 3600 + int(minutes) * 60 + float(seconds),
+        video.group(1),
+        video.group(2),
+        video.group(3),
+        rotation.group(1) if rotation else None,
+        "ffmpeg",
+    )
+
+
+async def probe_video(path: str) -> Optional[dict]:
+    """Return duration, codec and displayed frame size of the first video stream"""
+    if toolchain.available("ffprobe"):
+        try:
+            result = await run_process(ffprobe_args(path), tool="ffprobe", timeout=PROBE_TIMEOUT)
+            parsed = parse_ffprobe_video(result.text)
+            if parsed:
+                return parsed
+        except (OSError, ProcessError, ProcessTimeout, ValueError) as e:
+            print(f"ffprobe failed for {path}: {e}")
+
+    if toolchain.available("ffmpeg"):
+        try:
+            result = await run_process(
+                ffmpeg_banner_args(path), tool="ffmpeg", timeout=PROBE_TIMEOUT, check=False, stderr_lines=500
+            )
+            return parse_ffmpeg_video_banner(result.stderr)
+        except (OSError, ProcessTimeout) as e:
+            print(f"ffmpeg probe failed for {path}: {e}")
+    return None
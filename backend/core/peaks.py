@@ -0,0 +1,135 @@
+import asyncio
+import struct
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from core.artifacts import artifacts
+from core.edl import build_filtergraph, edit_key, source_duration
+from core.process import stream_process
+from core.toolchain import toolchain
+
+# Waveform peaks for the editor timeline.
+#
+# ffmpeg decodes the edited timeline (the edit list is applied as a
+# filtergraph, nothing is rendered to disk) to mono 16-bit PCM on a pipe, and
+# each chunk is reduced to per-bin min/max pairs with NumPy as it arrives, so
+# memory is bounded by the chunk size rather than the file length. Only the
+# finest level is stored, in the artifact store under a name derived from the
+# session and its edit list; zoomed-out levels are derived from it by
+# pairwise reduction.
+
+PEAKS_TIMEOUT = 120
+SAMPLES_PER_PEAK = 256      # finest level, matching audiowaveform's default
+MIN_LEVEL_PEAKS = 64        # the coarsest level is the first one this short
+DEFAULT_SAMPLE_RATE = 44100
+
+
+class PeakAccumulator:
+    """Reduces a stream of int16 PCM to per-bin (min, max) without holding the signal"""
+
+    def __init__(self, samples_per_peak: int = SAMPLES_PER_PEAK):
+        self.samples_per_peak = samples_per_peak
+        self._carry = b""
+        self._blocks: List[np.ndarray] = []
+
+    def feed(self, data: bytes):
+        data = self._carry + data
+        usable = len(data) - len(data) % (2 * self.samples_per_peak)
+        self._carry = data[usable:]
+        if usable:
+            bins = np.frombuffer(data, dtype="<i2", count=usable // 2).reshape(-1, self.samples_per_peak)
+            self._blocks.append(np.stack([bins.min(axis=1), bins.max(axis=1)], axis=1))
+
+    def finish(self) -> np.ndarray:
+        """All peaks so far as an (n, 2) int16 array; a short final bin is kept"""
+        tail = self._carry[:len(self._carry) - len(self._carry) % 2]
+        if tail:
+            samples = np.frombuffer(tail, dtype="<i2")
+            self._blocks.append(np.array([[samples.min(), samples.max()]], dtype=np.int16))
+        self._carry = b""
+        if not self._blocks:
+            return np.zeros((0, 2), dtype=np.int16)
+        return np.concatenate(self._blocks)
+
+
+def zoom_out(peaks: np.ndarray, level: int) -> np.ndarray:
+    """Peaks at `level`, where each level halves the resolution of the one below"""
+    for _ in range(level):
+        if len(peaks) % 2:
+            peaks = np.concatenate([peaks, peaks[-1:]])
+        pairs = peaks.reshape(-1, 2, 2)
+        peaks = np.stack([pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1)], axis=1)
+    return peaks
+
+
+def level_count(length: int) -> int:
+    levels = 1
+    while length > MIN_LEVEL_PEAKS:
+        length = (length + 1) // 2
+        levels += 1
+    return levels
+
+
+def select_level(peaks: np.ndarray, level: Optional[int], max_peaks: int) -> Tuple[np.ndarray, int, int]:
+    """Pick a zoom level and return (8-bit peaks, level, number of levels).
+
+    Without an explicit `level`, the finest one with at most `max_peaks` peaks
+    is used. Raises ValueError for a level that does not exist.
+    """
+    levels = level_count(len(peaks))
+    if level is None:
+        level, length = 0, len(peaks)
+        while length > max_peaks and level < levels - 1:
+            length = (length + 1) // 2
+            level += 1
+    elif level >= levels:
+        raise ValueError(f"Level must be between 0 and {levels - 1}")
+    # Top byte of each 16-bit sample is plenty for drawing
+    return (zoom_out(peaks, level) >> 8).astype(np.int8), level, levels
+
+
+def encode_dat(peaks: np.ndarray, sample_rate: int, samples_per_peak: int) -> bytes:
+    """audiowaveform .dat, version 1 with 8-bit samples (readable by peaks.js)"""
+    header = struct.pack("<iIiiI", 1, 1, sample_rate, samples_per_peak, len(peaks))
+    return header + peaks.astype(np.int8).tobytes()
+
+
+async def compute_peaks(metadata: dict) -> Tuple[np.ndarray, int]:
+    """Decode the edited timeline and reduce it to finest-level peaks"""
+    media = metadata.get('media') or {}
+    sample_rate = media.get('sample_rate') or DEFAULT_SAMPLE_RATE
+    args = [toolchain.path("ffmpeg"), "-v", "error", "-i", metadata['path'], "-map", "0:a:0"]
+    graph = build_filtergraph(metadata.get('edits') or [], source_duration(metadata))
+    if graph:
+        args += ["-af", graph]
+    args += ["-ac", "1", "-ar", str(sample_rate), "-f", "s16le", "-"]
+
+    accumulator = PeakAccumulator()
+    async for chunk in stream_process(args, tool="ffmpeg", timeout=PEAKS_TIMEOUT):
+        accumulator.feed(chunk)
+    return accumulator.finish(), sample_rate
+
+
+async def session_peaks(file_id: str, metadata: dict) -> Tuple[np.ndarray, dict]:
+    """Finest-level peaks for the session's edit list, computed once and cached on disk.
+
+    `metadata` may be a snapshot read without the edit lock: nothing is
+    written back to the session, since the cache file is named after the
+    edit list it was computed from.
+    """
+    key = edit_key(metadata.get('edits') or [])
+    name = f"{file_id}.peaks.{key[:12]}.npy"
+    path = artifacts.path_for(name)
+    media = metadata.get('media') or {}
+    info = {'sample_rate': media.get('sample_rate') or DEFAULT_SAMPLE_RATE, 'samples_per_peak': SAMPLES_PER_PEAK}
+    if artifacts.lookup(path):
+        try:
+            return await asyncio.to_thread(np.load, path), info
+        except (OSError, ValueError):
+            pass    # evicted since the lookup; compute it again
+
+    peaks, info['sample_rate'] = await compute_peaks(metadata)
+    with artifacts.create(name=name) as output:
+        await asyncio.to_thread(np.save, output.temp, peaks)
+    return peaks, info
@@ -0,0 +1,228 @@
+import asyncio
+import os
+import re
+import weakref
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional
+
+from core.config import settings
+
+# Shared runner for ffmpeg/ffprobe/fpcalc.
+#
+# Processes are started with asyncio.create_subprocess_exec so the event loop
+# keeps serving other requests while they run. A global semaphore plus one per
+# tool bound how many run at once; timeouts and cancellation (including a
+# client disconnect) kill the child so no orphaned ffmpeg is left behind.
+
+STDERR_TAIL_LINES = 50
+STDERR_CHUNK_SIZE = 4096
+MAX_STDERR_LINE = 64 * 1024
+STREAM_CHUNK_SIZE = 256 * 1024
+DISCONNECT_POLL_SECONDS = 0.5
+
+CPU_COUNT = os.cpu_count() or 1
+TOOL_LIMITS: Dict[str, int] = {
+    "ffmpeg": settings.FFMPEG_CONCURRENCY or CPU_COUNT,
+    "ffprobe": CPU_COUNT * 2,
+    "fpcalc": CPU_COUNT,
+}
+GLOBAL_LIMIT = settings.PROCESS_CONCURRENCY or CPU_COUNT * 2
+
+
+class ProcessError(RuntimeError):
+    """A tool exited with a non-zero status"""
+
+    def __init__(self, tool: str, returncode: int, stderr: str):
+        self.tool = tool
+        self.returncode = returncode
+        self.stderr = stderr
+        super().__init__(stderr or f"{tool} exited with status {returncode}")
+
+
+class ProcessTimeout(TimeoutError):
+    """A tool ran longer than its timeout and was killed"""
+
+
+@dataclass
+class ProcessResult:
+    returncode: int
+    stdout: bytes
+    stderr: str
+
+    @property
+    def text(self) -> str:
+        return self.stdout.decode("utf-8", errors="replace")
+
+
+_semaphores = weakref.WeakKeyDictionary()
+_running = 0
+
+
+def _semaphore(name: str, limit: int) -> asyncio.Semaphore:
+    # One set per event loop; semaphores cannot be shared across loops
+    per_loop = _semaphores.setdefault(asyncio.get_running_loop(), {})
+    if name not in per_loop:
+        per_loop[name] = asyncio.Semaphore(limit)
+    return per_loop[name]
+
+
+# ffmpeg ends progress lines in a bare \r, so stderr is read in chunks and
+# split on both line endings; readline() would hit the StreamReader limit
+# on a long run of progress updates and stop draining the pipe.
+_LINE_BREAK = re.compile(rb"[\r\n]")
+
+
+async def _read_tail(stream: asyncio.StreamReader, tail: deque):
+    pending = b""
+    while True:
+        chunk = await stream.read(STDERR_CHUNK_SIZE)
+        if not chunk:
+            break
+        *lines, pending = _LINE_BREAK.split(pending + chunk)
+        # A line that never ends is cut rather than buffered without bound
+        pending = pending[-MAX_STDERR_LINE:]
+        for line in lines:
+            if line.strip():
+                tail.append(line.decode("utf-8", errors="replace").rstrip())
+    if pending.strip():
+        tail.append(pending.decode("utf-8", errors="replace").rstrip())
+
+
+async def _kill(proc: asyncio.subprocess.Process):
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+
+
+async def _watch_disconnect(request, task: asyncio.Task):
+    while not task.done():
+        if await request.is_disconnected():
+            task.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+
+async def _communicate(proc: asyncio.subprocess.Process, stderr_task: asyncio.Task) -> bytes:
+    stdout = await proc.stdout.read()
+    await proc.wait()
+    await stderr_task
+    return stdout
+
+
+async def _execute(tool: str, args: List[str], timeout: float, stdin: Optional[bytes], stderr_lines: int) -> ProcessResult:
+    global _running
+    async with _semaphore("*", GLOBAL_LIMIT), _semaphore(tool, TOOL_LIMITS.get(tool, CPU_COUNT)):
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _running += 1
+        tail: deque = deque(maxlen=stderr_lines)
+        stderr_task = asyncio.create_task(_read_tail(proc.stderr, tail))
+        try:
+            if stdin is not None:
+                proc.stdin.write(stdin)
+                await proc.stdin.drain()
+                proc.stdin.close()
+            try:
+                stdout = await asyncio.wait_for(_communicate(proc, stderr_task), timeout)
+            except asyncio.TimeoutError:
+                raise ProcessTimeout(f"{tool} timed out after {timeout}s")
+        finally:
+            _running -= 1
+            stderr_task.cancel()
+            await _kill(proc)
+        return ProcessResult(proc.returncode, stdout, "\n".join(tail))
+
+
+async def run_process(
+    args: List[str],
+    tool: str,
+    timeout: float = 60,
+    check: bool = True,
+    stdin: Optional[bytes] = None,
+    request=None,
+    stderr_lines: int = STDERR_TAIL_LINES,
+) -> ProcessResult:
+    """Run an external tool without blocking the event loop.
+
+    `tool` selects the concurrency budget. If `request` is given the process
+    is killed as soon as the client disconnects. Only the last `stderr_lines`
+    lines of stderr are kept. Raises ProcessTimeout on timeout and, when
+    `check` is set, ProcessError on a non-zero exit.
+    """
+    if not args or args[0] is None:
+        raise FileNotFoundError(f"{tool} is not installed")
+    task = asyncio.ensure_future(_execute(tool, args, timeout, stdin, stderr_lines))
+    watcher = asyncio.create_task(_watch_disconnect(request, task)) if request is not None else None
+    try:
+        result = await task
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+    if check and result.returncode != 0:
+        raise ProcessError(tool, result.returncode, result.stderr)
+    return result
+
+
+async def stream_process(
+    args: List[str],
+    tool: str,
+    timeout: float = 60,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    stderr_lines: int = STDERR_TAIL_LINES,
+) -> AsyncIterator[bytes]:
+    """Run an external tool and yield its stdout in chunks as it is produced.
+
+    `timeout` bounds the wait for each chunk rather than the whole run, so a
+    slow consumer does not count against it. Closing the generator early
+    (or cancelling the task consuming it) kills the process. Raises
+    ProcessError after the last chunk if the tool exited with an error.
+    """
+    global _running
+    if not args or args[0] is None:
+        raise FileNotFoundError(f"{tool} is not installed")
+    async with _semaphore("*", GLOBAL_LIMIT), _semaphore(tool, TOOL_LIMITS.get(tool, CPU_COUNT)):
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _running += 1
+        tail: deque = deque(maxlen=stderr_lines)
+        stderr_task = asyncio.create_task(_read_tail(proc.stderr, tail))
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(proc.stdout.read(chunk_size), timeout)
+                except asyncio.TimeoutError:
+                    raise ProcessTimeout(f"{tool} produced no output for {timeout}s")
+                if not chunk:
+                    break
+                yield chunk
+            try:
+                await asyncio.wait_for(proc.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise ProcessTimeout(f"{tool} did not exit within {timeout}s")
+            await stderr_task
+        finally:
+            _running -= 1
+            stderr_task.cancel()
+            await _kill(proc)
+    if proc.returncode != 0:
+        raise ProcessError(tool, proc.returncode, "\n".join(tail))
+
+
+def stats() -> dict:
+    return {
+        "running": _running,
+        "global_limit": GLOBAL_LIMIT,
+        "tool_limits": TOOL_LIMITS,
+    }
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+
+from core.config import settings
+from core.sessions import get_session_registry
+from core.edl import session_files
+from core.artifacts import artifacts
+from core.jobs import job_queue
+
+
+class ExpiryReaper:
+    """Deletes expired audio sessions, old job rows and stale files in processed/ in the background.
+
+    Audio sessions are reaped through the registry's uploaded_at index.
+    Router outputs in processed/ live in the artifact store, whose expiry
+    heap means each tick only touches entries that are actually due. Every
+    `rescan_ticks`-th tick also rescans processed/ so this worker's index
+    (and so the byte budget) sees files the other uvicorn workers wrote or
+    deleted; that full listing is kept off the other ticks.
+    """
+
+    def __init__(self, interval: float, batch_size: int, session_ttl: int, job_ttl: int, rescan_ticks: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.rescan_ticks = max(1, rescan_ticks)
+        self.session_ttl = session_ttl
+        self.job_ttl = job_ttl
+        self._task = None
+
+        self.files_reclaimed = 0
+        self.bytes_reclaimed = 0
+        self.runs = 0
+        self.last_duration = 0.0
+        self.total_duration = 0.0
+
+    def _remove(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            # Cached renders are store files that a download may still be reading
+            if artifacts.owns(path):
+                artifacts.discard(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"Reaper could not delete {path}: {e}")
+            return
+        self.files_reclaimed += 1
+        self.bytes_reclaimed += size
+
+    def _reap_sessions(self):
+        sessions = get_session_registry()
+        cutoff = datetime.now() - timedelta(seconds=self.session_ttl)
+        for file_id, metadata in sessions.expired(cutoff, limit=self.batch_size):
+            for path in session_files(metadata):
+                self._remove(path)
+            sessions.delete(file_id)
+
+    def reap_once(self):
+        """Run one bounded reaping pass"""
+        started = time.perf_counter()
+        try:
+            self._reap_sessions()
+        except Exception as e:
+            print(f"Reaper session pass failed: {type(e).__name__}: {e}")
+        try:
+            # Job rows go with their results (or, if stuck, after as long)
+            job_queue.reap(datetime.now() - timedelta(seconds=self.job_ttl), self.batch_size)
+        except Exception as e:
+            print(f"Reaper job pass failed: {type(e).__name__}: {e}")
+        if self.runs % self.rescan_ticks == 0:
+            try:
+                artifacts.rescan()
+            except OSError as e:
+                print(f"Reaper artifact rescan failed: {e}")
+        artifacts.expire(self.batch_size)
+        self.last_duration = time.perf_counter() - started
+        self.total_duration += self.last_duration
+        self.runs += 1
+
+    async def run(self):
+        while True:
+            await asyncio.to_thread(self.reap_once)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "files_reclaimed": self.files_reclaimed,
+            "bytes_reclaimed": self.bytes_reclaimed,
+            "runs": self.runs,
+            "last_reap_seconds": round(self.last_duration, 4),
+            "total_reap_seconds": round(self.total_duration, 4),
+        }
+
+
+reaper = ExpiryReaper(
+    interval=settings.REAPER_INTERVAL_SECONDS,
+    batch_size=settings.REAPER_BATCH_SIZE,
+    session_ttl=settings.SESSION_TTL_SECONDS,
+    job_ttl=settings.PROCESSED_TTL_SECONDS,
+    rescan_ticks=settings.REAPER_RESCAN_TICKS,
+)
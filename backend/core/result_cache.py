@@ -0,0 +1,278 @@
+import asyncio
+import hashlib
+import importlib.metadata
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from core.artifacts import artifacts
+from core.config import settings
+from core.downloads import CACHE_CONTROL, download_response, not_modified, strong_etag
+
+# Cross-router cache of finished outputs.
+#
+# A result is keyed by what determines its bytes: the upload's SHA-256, the
+# tool, its normalized parameters and the version of whatever produced it
+# (Pillow, ffmpeg, ...). Outputs stay in the artifact store (the disk tier,
+# with its own byte budget inside processed/); small ones are also kept in
+# memory and served without touching the disk. Concurrent requests for a
+# key that is still being computed wait for that computation instead of
+# starting their own.
+#
+# Each worker keeps its own index, but every result also leaves a small
+# JSON record named after its key in the artifact store: a worker that
+# misses in its index reads that record, so a result computed by another
+# uvicorn worker (or before a restart) is a disk hit rather than a
+# recomputation.
+
+HIT = "HIT"
+MISS = "MISS"
+SHARED = "SHARED"   # waited for an identical request already in progress
+
+# Outputs up to this size also go to the memory tier
+MEMORY_ITEM_LIMIT = 1024 * 1024
+
+
+@dataclass
+class CachedResult:
+    key: str
+    path: str
+    size: int
+    media_type: str
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+def cache_key(digest: str, tool: str, params: dict, version: str) -> str:
+    """Content address of a result; params are normalized so key order and types like 1 vs 1.0 agree"""
+    normalized = {name: float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value
+                  for name, value in params.items()}
+    payload = json.dumps([digest, tool, normalized, version], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def package_versions(*names: str) -> str:
+    """Installed versions of the packages behind a tool, for its cache keys"""
+    versions = []
+    for name in names:
+        try:
+            versions.append(f"{name}-{importlib.metadata.version(name)}")
+        except importlib.metadata.PackageNotFoundError:
+            versions.append(f"{name}-none")
+    return ",".join(versions)
+
+
+class ResultCache:
+    def __init__(self, memory_bytes: int, disk_bytes: int, ttl: float):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.ttl = ttl
+        self._disk: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.disk_used = 0
+        self.memory_used = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+
+    def _get(self, key: str) -> Tuple[Optional[CachedResult], Optional[bytes]]:
+        with self._lock:
+            entry = self._disk.get(key)
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._disk.move_to_end(key)
+                self.memory_hits += 1
+                return entry, data
+        if entry is None:
+            entry = self._read_record(key)
+            if entry is None:
+                return None, None
+            self._index(entry)
+        if not artifacts.lookup(entry.path):
+            # Evicted or expired by the artifact store itself
+            with self._lock:
+                if self._disk.get(key) is entry:
+                    del self._disk[key]
+                    self.disk_used -= entry.size
+            return None, None
+        with self._lock:
+            self._disk.move_to_end(key)
+            self.disk_hits += 1
+        return entry, self._remember(entry)
+
+    def _remember(self, entry: CachedResult) -> Optional[bytes]:
+        """Copy a small output into the memory tier (on its first hit, so one-offs stay on disk)"""
+        if entry.size > MEMORY_ITEM_LIMIT or entry.size > self.memory_bytes:
+            return None
+        try:
+            with open(entry.path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        with self._lock:
+            if entry.key not in self._memory:
+                self._memory[entry.key] = data
+                self.memory_used += len(data)
+            while self.memory_used > self.memory_bytes:
+                _, dropped = self._memory.popitem(last=False)
+                self.memory_used -= len(dropped)
+        return data
+
+    def _record_path(self, key: str) -> str:
+        return artifacts.path_for(f"{key}.json")
+
+    def _read_record(self, key: str) -> Optional[CachedResult]:
+        """The entry another worker stored for `key`, from its record on disk"""
+        record = self._record_path(key)
+        if not artifacts.lookup(record):
+            return None
+        try:
+            with open(record) as f:
+                fields = json.load(f)
+            return CachedResult(key, fields["path"], fields["size"], fields["media_type"], fields["headers"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_record(self, entry: CachedResult):
+        fields = {"path": entry.path, "size": entry.size, "media_type": entry.media_type, "headers": entry.headers}
+        with artifacts.create(name=f"{entry.key}.json", ttl=self.ttl) as record:
+            with open(record.temp, "w") as f:
+                json.dump(fields, f)
+
+    def _store(self, key: str, result: dict) -> CachedResult:
+        path = result["path"]
+        # Cached outputs outlive ordinary ones
+        artifacts.adopt(path, ttl=self.ttl)
+        entry = CachedResult(key, path, os.path.getsize(path), result["media_type"], result.get("headers") or {})
+        try:
+            self._write_record(entry)
+        except OSError as e:
+            print(f"Result cache could not record {key}: {e}")
+        self._index(entry)
+        return entry
+
+    def _index(self, entry: CachedResult):
+        """Add an entry to this worker's disk tier, evicting past its budget"""
+        key = entry.key
+        victims = []
+        with self._lock:
+            previous = self._disk.pop(key, None)
+            if previous is not None:
+                self.disk_used -= previous.size
+            self._disk[key] = entry
+            self.disk_used += entry.size
+            while self.disk_used > self.disk_bytes and len(self._disk) > 1:
+                _, victim = self._disk.popitem(last=False)
+                self.disk_used -= victim.size
+                dropped = self._memory.pop(victim.key, None)
+                if dropped is not None:
+                    self.memory_used -= len(dropped)
+                victims += [victim.path, self._record_path(victim.key)]
+                self.evictions += 1
+        for victim in victims:
+            artifacts.discard(victim)
+
+    async def fetch(self, key: str, compute: Callable[[], Awaitable[dict]]):
+        """(entry, memory copy or None, HIT | MISS | SHARED) for `key`, running `compute` on a miss.
+
+        `compute` returns {path, media_type, headers} with `path` committed
+        to the artifact store. Its exceptions reach every request waiting on it.
+        """
+        while True:
+            entry, data = self._get(key)
+            if entry is not None:
+                return entry, data, HIT
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            try:
+                entry = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if pending.cancelled():
+                    continue    # the first request went away; try again
+                raise
+            with self._lock:
+                self.shared += 1
+            return entry, None, SHARED
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            with self._lock:
+                self.misses += 1
+            entry = self._store(key, await compute())
+            future.set_result(entry)
+            return entry, None, MISS
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # retrieved, even if no one else was waiting
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._disk),
+                "memory_entries": len(self._memory),
+                "memory_bytes": self.memory_used,
+                "max_memory_bytes": self.memory_bytes,
+                "disk_bytes": self.disk_used,
+                "max_disk_bytes": self.disk_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "shared": self.shared,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+async def cached_response(request: Request, entry: CachedResult, data: Optional[bytes], state: str,
+                          filename: Optional[str] = None) -> Response:
+    """Serve a cached result, from memory when it is there; the key doubles as the ETag.
+
+    Range requests go to the disk copy, so a memory hit answers Range and
+    If-Range exactly as a disk hit does.
+    """
+    etag = strong_etag(entry.key)
+    headers = {**entry.headers, "X-Cache": state}
+    if data is None or ("range" in request.headers and artifacts.lookup(entry.path)):
+        return await download_response(
+            request, entry.path, filename=filename, media_type=entry.media_type,
+            etag=etag, headers=headers, background=artifacts.hold(entry.path)
+        )
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    headers.update({"etag": etag, "cache-control": CACHE_CONTROL, "accept-ranges": "bytes"})
+    if filename:
+        # As FileResponse writes it
+        quoted = quote(filename)
+        headers["Content-Disposition"] = (
+            f'attachment; filename="{filename}"' if quoted == filename else f"attachment; filename*=utf-8''{quoted}"
+        )
+    return Response(data, media_type=entry.media_type, headers=headers)
+
+
+result_cache = ResultCache(
+    memory_bytes=settings.RESULT_CACHE_MEMORY_MB * 1024 * 1024,
+    disk_bytes=settings.RESULT_CACHE_DISK_MB * 1024 * 1024,
+    ttl=settings.RESULT_CACHE_TTL_SECONDS,
+)
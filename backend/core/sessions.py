@@ -0,0 +1,321 @@
+import asyncio
+import json
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from uuid import uuid4
+
+from core.config import settings
+
+# How long a per-file edit lock is held before another worker may steal it.
+# Protects against a worker crashing mid-edit and leaving the file locked forever.
+# The holder renews the lease well before it runs out, so a long render keeps it.
+LOCK_LEASE_SECONDS = 120
+LOCK_RENEW_SECONDS = LOCK_LEASE_SECONDS / 3
+LOCK_POLL_INTERVAL = 0.05
+
+
+class SessionBusyError(Exception):
+    """Raised when a file's edit lock could not be acquired in time"""
+
+
+def _encode(metadata: dict) -> str:
+    data = dict(metadata)
+    data.pop('uploaded_at', None)
+    return json.dumps(data)
+
+
+def _decode(raw: str, uploaded_at: datetime) -> dict:
+    metadata = json.loads(raw)
+    metadata['uploaded_at'] = uploaded_at
+    return metadata
+
+
+class LockLease:
+    """A held edit lock; `held` turns False if the lease could not be renewed"""
+
+    def __init__(self, held: bool = True):
+        self.held = held
+
+
+class SessionRegistry(ABC):
+    """Shared store for uploaded file metadata, keyed by file_id.
+
+    Backends must keep lookups by file_id and range scans by uploaded_at
+    indexed, so both stay O(log n) or better however many sessions are live.
+    All methods block on the database or Redis; async code calls them
+    through asyncio.to_thread.
+    """
+
+    @abstractmethod
+    def get(self, file_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def put(self, file_id: str, metadata: dict) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, file_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def expired(self, cutoff: datetime, limit: int = 100) -> List[Tuple[str, dict]]:
+        """Return up to `limit` sessions uploaded before `cutoff`, oldest first"""
+
+    @abstractmethod
+    def acquire_lock(self, file_id: str, token: str, lease_seconds: int) -> bool:
+        ...
+
+    @abstractmethod
+    def renew_lock(self, file_id: str, token: str, lease_seconds: int) -> bool:
+        """Extend a lock we still hold; False if it expired and was taken"""
+
+    @abstractmethod
+    def release_lock(self, file_id: str, token: str) -> None:
+        ...
+
+    def __contains__(self, file_id: str) -> bool:
+        return self.get(file_id) is not None
+
+    async def _keep_lease(self, file_id: str, token: str, lease: LockLease):
+        while True:
+            await asyncio.sleep(LOCK_RENEW_SECONDS)
+            try:
+                renewed = await asyncio.to_thread(self.renew_lock, file_id, token, LOCK_LEASE_SECONDS)
+            except Exception as e:
+                # Try again next round; the lease still has time left
+                print(f"Renewing the edit lock on {file_id} failed: {type(e).__name__}: {e}")
+                continue
+            if not renewed:
+                print(f"Edit lock on {file_id} was lost before it was released")
+                lease.held = False
+                return
+
+    @asynccontextmanager
+    async def lock(self, file_id: str, timeout: float = 30.0):
+        """Hold the edit lock for one file_id across all workers.
+
+        The lease is renewed in the background for as long as the lock is
+        held. Callers check the yielded LockLease before writing back.
+        """
+        token = str(uuid4())
+        lease = LockLease()
+        deadline = time.monotonic() + timeout
+        while not await asyncio.to_thread(self.acquire_lock, file_id, token, LOCK_LEASE_SECONDS):
+            if not await asyncio.to_thread(self.__contains__, file_id):
+                # Nothing to protect; let the caller report the missing file
+                lease.held = False
+                break
+            if time.monotonic() >= deadline:
+                raise SessionBusyError(f"File {file_id} is locked by another request")
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+        keeper = asyncio.create_task(self._keep_lease(file_id, token, lease)) if lease.held else None
+        try:
+            yield lease
+        finally:
+            if keeper is not None:
+                keeper.cancel()
+            await asyncio.to_thread(self.release_lock, file_id, token)
+
+
+class DatabaseSessionRegistry(SessionRegistry):
+    """Registry stored in the `audio_sessions` table of the main database"""
+
+    def __init__(self):
+        from database import SessionLocal
+        from models import AudioSession
+        self._session_factory = SessionLocal
+        self._model = AudioSession
+
+    def get(self, file_id: str) -> Optional[dict]:
+        with self._session_factory() as db:
+            row = db.get(self._model, file_id)
+            if row is None:
+                return None
+            return _decode(row.data, row.uploaded_at)
+
+    def put(self, file_id: str, metadata: dict) -> None:
+        with self._session_factory() as db:
+            row = db.get(self._model, file_id)
+            if row is None:
+                row = self._model(file_id=file_id)
+                db.add(row)
+            row.uploaded_at = metadata['uploaded_at']
+            row.data = _encode(metadata)
+            db.commit()
+
+    def delete(self, file_id: str) -> Optional[dict]:
+        with self._session_factory() as db:
+            row = db.get(self._model, file_id)
+            if row is None:
+                return None
+            metadata = _decode(row.data, row.uploaded_at)
+            db.delete(row)
+            db.commit()
+            return metadata
+
+    def expired(self, cutoff: datetime, limit: int = 100) -> List[Tuple[str, dict]]:
+        with self._session_factory() as db:
+            rows = (
+                db.query(self._model)
+                .filter(self._model.uploaded_at < cutoff)
+                .order_by(self._model.uploaded_at)
+                .limit(limit)
+                .all()
+            )
+            return [(row.file_id, _decode(row.data, row.uploaded_at)) for row in rows]
+
+    def acquire_lock(self, file_id: str, token: str, lease_seconds: int) -> bool:
+        # A single conditional UPDATE is atomic on both SQLite and PostgreSQL
+        now = datetime.now()
+        model = self._model
+        with self._session_factory() as db:
+            updated = (
+                db.query(model)
+                .filter(
+                    model.file_id == file_id,
+                    (model.lock_token.is_(None)) | (model.locked_until < now),
+                )
+                .update(
+                    {
+                        model.lock_token: token,
+                        model.locked_until: now + timedelta(seconds=lease_seconds),
+                    },
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            return updated == 1
+
+    def renew_lock(self, file_id: str, token: str, lease_seconds: int) -> bool:
+        model = self._model
+        with self._session_factory() as db:
+            updated = (
+                db.query(model)
+                .filter(model.file_id == file_id, model.lock_token == token)
+                .update(
+                    {model.locked_until: datetime.now() + timedelta(seconds=lease_seconds)},
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            return updated == 1
+
+    def release_lock(self, file_id: str, token: str) -> None:
+        model = self._model
+        with self._session_factory() as db:
+            (
+                db.query(model)
+                .filter(model.file_id == file_id, model.lock_token == token)
+                .update(
+                    {model.lock_token: None, model.locked_until: None},
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+
+
+class RedisSessionRegistry(SessionRegistry):
+    """Registry stored in Redis (or any Redis-compatible server).
+
+    Each session is a JSON string key; a sorted set scored by upload time
+    serves the expiry scan in O(log n + k).
+    """
+
+    KEY_PREFIX = "audio:session:"
+    LOCK_PREFIX = "audio:lock:"
+    TIME_INDEX = "audio:sessions:uploaded_at"
+
+    # Only delete the lock if we still own it
+    _RELEASE_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('del', KEYS[1])
+    end
+    return 0
+    """
+
+    # Only extend the lease if we still own the lock
+    _RENEW_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('expire', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SESSION_BACKEND=redis requires the 'redis' package: pip install redis")
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._release = self._redis.register_script(self._RELEASE_SCRIPT)
+        self._renew = self._redis.register_script(self._RENEW_SCRIPT)
+
+    def _load(self, raw: Optional[str]) -> Optional[dict]:
+        if raw is None:
+            return None
+        metadata = json.loads(raw)
+        metadata['uploaded_at'] = datetime.fromisoformat(metadata['uploaded_at'])
+        return metadata
+
+    def get(self, file_id: str) -> Optional[dict]:
+        return self._load(self._redis.get(self.KEY_PREFIX + file_id))
+
+    def put(self, file_id: str, metadata: dict) -> None:
+        data = dict(metadata)
+        data['uploaded_at'] = metadata['uploaded_at'].isoformat()
+        pipe = self._redis.pipeline()
+        pipe.set(self.KEY_PREFIX + file_id, json.dumps(data))
+        pipe.zadd(self.TIME_INDEX, {file_id: metadata['uploaded_at'].timestamp()})
+        pipe.execute()
+
+    def delete(self, file_id: str) -> Optional[dict]:
+        pipe = self._redis.pipeline()
+        pipe.get(self.KEY_PREFIX + file_id)
+        pipe.delete(self.KEY_PREFIX + file_id)
+        pipe.zrem(self.TIME_INDEX, file_id)
+        raw, _, _ = pipe.execute()
+        return self._load(raw)
+
+    def expired(self, cutoff: datetime, limit: int = 100) -> List[Tuple[str, dict]]:
+        file_ids = self._redis.zrangebyscore(self.TIME_INDEX, "-inf", cutoff.timestamp(), start=0, num=limit)
+        if not file_ids:
+            return []
+        raws = self._redis.mget([self.KEY_PREFIX + file_id for file_id in file_ids])
+        results = []
+        for file_id, raw in zip(file_ids, raws):
+            if raw is None:
+                # Index entry without data; drop it so it is not returned again
+                self._redis.zrem(self.TIME_INDEX, file_id)
+                continue
+            results.append((file_id, self._load(raw)))
+        return results
+
+    def acquire_lock(self, file_id: str, token: str, lease_seconds: int) -> bool:
+        return bool(self._redis.set(self.LOCK_PREFIX + file_id, token, nx=True, ex=lease_seconds))
+
+    def renew_lock(self, file_id: str, token: str, lease_seconds: int) -> bool:
+        return bool(self._renew(keys=[self.LOCK_PREFIX + file_id], args=[token, lease_seconds]))
+
+    def release_lock(self, file_id: str, token: str) -> None:
+        self._release(keys=[self.LOCK_PREFIX + file_id], args=[token])
+
+
+_registry: Optional[SessionRegistry] = None
+
+
+def get_session_registry() -> SessionRegistry:
+    """Return the process-wide registry for the configured backend"""
+    global _registry
+    if _registry is None:
+        backend = settings.SESSION_BACKEND.lower()
+        if backend == "redis":
+            _registry = RedisSessionRegistry(settings.REDIS_URL)
+        elif backend == "database":
+            _registry = DatabaseSessionRegistry()
+        else:
+            raise RuntimeError(f"Unknown SESSION_BACKEND: {settings.SESSION_BACKEND}")
+    return _registry
@@ -0,0 +1,108 @@
+import math
+from typing import Optional, Tuple
+
+from core.artifacts import artifacts
+from core.config import settings
+from core.media_probe import probe_video
+from core.process import run_process
+from core.toolchain import toolchain
+
+# Preview sprite sheets for uploaded videos.
+#
+# One ffmpeg pass builds the whole sheet: only keyframes are decoded
+# (-skip_frame nokey), the fps filter picks the latest keyframe at each of N
+# evenly spaced times, and the tile filter lays them out on one JPEG. A
+# WebVTT file maps each time slot to its tile (#xywh media fragments), which
+# is what video players read for scrubbing previews. Both files are stored
+# under the upload's content hash and the sprite parameters, so a repeat
+# request for the same video is served from disk without running ffmpeg.
+
+SPRITE_TIMEOUT = 300
+SPRITE_QUALITY = 4          # mjpeg qscale: 2 (best) .. 31
+SPRITE_NAME = "sprite.jpg"  # as referenced from the VTT, relative to its URL
+
+
+def sprite_key(sha256: str, count: int, width: int, columns: int) -> str:
+    return f"{sha256[:32]}-{count}-{width}-{columns}"
+
+
+def sprite_paths(key: str) -> Tuple[str, str]:
+    """(sheet, index) paths for a sprite key"""
+    return artifacts.path_for(f"{key}.jpg"), artifacts.path_for(f"{key}.vtt")
+
+
+def tile_size(video: dict, width: int) -> Tuple[int, int]:
+    """Thumbnail size for `width`, keeping the displayed aspect ratio (even height)"""
+    height = width * video["height"] / video["width"]
+    return width, max(2, int(round(height / 2)) * 2)
+
+
+def sprite_args(src: str, dst: str, duration: float, count: int, size: Tuple[int, int], columns: int) -> list:
+    rows = math.ceil(count / columns)
+    # Only keyframes reach the graph, so the last one is held (tpad) to fill
+    # the slots after it; ffmpeg stops as soon as the sheet is complete
+    graph = (
+        f"tpad=stop_mode=clone:stop_duration={duration:.6f},"
+        f"fps={count}/{duration:.6f},"
+        f"scale={size[0]}:{size[1]},setsar=1,"
+        f"tile={columns}x{rows}:nb_frames={count}"
+    )
+    return [
+        toolchain.path("ffmpeg"), "-y", "-v", "error",
+        "-skip_frame", "nokey", "-i", src,
+        "-map", "0:v:0", "-vf", graph, "-frames:v", "1",
+        "-c:v", "mjpeg", "-q:v", str(SPRITE_QUALITY), "-f", "image2", "-update", "1",
+        dst
+    ]
+
+
+def _timestamp(seconds: float) -> str:
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}"
+
+
+def build_vtt(duration: float, count: int, size: Tuple[int, int], columns: int) -> str:
+    """WebVTT thumbnail track: one cue per tile, pointing into the sprite"""
+    interval = duration / count
+    cues = ["WEBVTT", ""]
+    for i in range(count):
+        x, y = (i % columns) * size[0], (i // columns) * size[1]
+        end = duration if i == count - 1 else (i + 1) * interval
+        cues.append(f"{_timestamp(i * interval)} --> {_timestamp(end)}")
+        cues.append(f"{SPRITE_NAME}#xywh={x},{y},{size[0]},{size[1]}")
+        cues.append("")
+    return "\n".join(cues)
+
+
+async def video_sprite(src: str, sha256: str, count: int, width: int, columns: int,
+                       request=None) -> Optional[dict]:
+    """Sprite sheet and WebVTT index for a video, from cache when already built.
+
+    Returns None when the file has no decodable video stream.
+    """
+    key = sprite_key(sha256, count, width, columns)
+    sheet_path, vtt_path = sprite_paths(key)
+    layout = {"key": key, "count": count, "columns": columns, "rows": math.ceil(count / columns)}
+    # Both are needed: either may have been evicted on its own
+    if artifacts.lookup(vtt_path) and artifacts.lookup(sheet_path):
+        return {**layout, "cached": True}
+
+    video = await probe_video(src)
+    if not video or not video["duration"] or not video["width"]:
+        return None
+    size = tile_size(video, width)
+
+    # Staged under unique names: concurrent requests for one key each write
+    # their own, and whichever finishes last replaces the other's
+    ttl = settings.THUMBNAIL_CACHE_TTL_SECONDS
+    with artifacts.create(name=f"{key}.jpg", ttl=ttl) as sheet, artifacts.create(name=f"{key}.vtt", ttl=ttl) as vtt:
+        await run_process(
+            sprite_args(src, sheet.temp, video["duration"], count, size, columns),
+            tool="ffmpeg", timeout=SPRITE_TIMEOUT, request=request
+        )
+        with open(vtt.temp, "w") as f:
+            f.write(build_vtt(video["duration"], count, size, columns))
+    return {**layout, "cached": False}
@@ -0,0 +1,162 @@
+from typing import Iterable, Iterator
+
+import numpy as np
+
+# Pitch-preserving time stretch (WSOLA) used when ffmpeg's atempo is not
+# available.
+#
+# Output is built from Hann-windowed frames overlap-added at a fixed
+# synthesis hop; each frame is read from the input around position
+# k * hop * speed, shifted within a small tolerance to the offset whose
+# waveform best continues the previous frame (cross-correlation via FFT).
+# Input is consumed in blocks and only the window needed for the next frame
+# search is kept, so memory does not grow with the file length.
+
+FRAME_SECONDS = 0.04
+TOLERANCE_SECONDS = 0.01
+BLOCK_SECONDS = 5.0
+
+
+class TimeStretcher:
+    """Streaming WSOLA: feed() blocks of (samples, channels) float audio, then flush()"""
+
+    def __init__(self, speed: float, sample_rate: int, channels: int = 1,
+                 frame_seconds: float = FRAME_SECONDS, tolerance_seconds: float = TOLERANCE_SECONDS):
+        if speed <= 0:
+            raise ValueError("Speed must be positive")
+        self.speed = speed
+        self.channels = channels
+        self.frame = max(int(round(frame_seconds * sample_rate)) // 2 * 2, 4)
+        self.hop = self.frame // 2
+        self.tolerance = max(int(round(tolerance_seconds * sample_rate)), 1)
+        # Periodic Hann: overlapping at half a frame sums to exactly 1
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(self.frame) / self.frame)).astype(np.float32)
+        self._fft_size = 1 << int(np.ceil(np.log2(2 * self.frame + 2 * self.tolerance)))
+
+        # Input buffer in "padded" coordinates: half a frame of silence is
+        # prepended so the first frame's fade-in falls on it
+        self._input = np.zeros((self.hop, channels), dtype=np.float32)
+        self._base = 0
+        self._received = 0
+        self._index = 0
+        self._previous = 0
+        self._overlap = np.zeros((self.frame, channels), dtype=np.float32)
+        self._skip = self.hop
+        self._emitted = 0
+
+    def _slice(self, start: int, length: int) -> np.ndarray:
+        return self._input[start - self._base:start - self._base + length]
+
+    def _best_start(self, nominal: int) -> int:
+        low = max(nominal - self.tolerance, self._base)
+        high = nominal + self.tolerance
+        template = self._slice(self._previous + self.hop, self.frame).mean(axis=1)
+        segment = self._slice(low, high - low + self.frame).mean(axis=1)
+        spectrum = np.fft.rfft(segment, self._fft_size) * np.conj(np.fft.rfft(template, self._fft_size))
+        correlation = np.fft.irfft(spectrum, self._fft_size)[:high - low + 1]
+        return low + int(np.argmax(correlation))
+
+    def _process(self, final: bool) -> np.ndarray:
+        end = self.hop + self._received
+        out = []
+        while True:
+            nominal = int(round(self._index * self.hop * self.speed))
+            needed = max(nominal + self.tolerance, self._previous + self.hop) + self.frame
+            available = self._base + len(self._input)
+            if needed > available:
+                if not final or nominal >= end:
+                    break
+                padding = np.zeros((needed - available, self.channels), dtype=np.float32)
+                self._input = np.concatenate([self._input, padding])
+
+            start = self._best_start(nominal) if self._index else 0
+            self._overlap += self._slice(start, self.frame) * self.window[:, None]
+            out.append(self._overlap[:self.hop].copy())
+            self._overlap = np.concatenate([self._overlap[self.hop:], np.zeros((self.hop, self.channels), dtype=np.float32)])
+            self._previous = start
+            self._index += 1
+
+            # Nothing before the next search window or continuation is read again
+            keep_from = min(int(round(self._index * self.hop * self.speed)) - self.tolerance, self._previous + self.hop)
+            if keep_from > self._base:
+                self._input = self._input[keep_from - self._base:]
+                self._base = keep_from
+
+        if final:
+            out.append(self._overlap[:self.frame - self.hop])
+        return self._emit(np.concatenate(out) if out else np.zeros((0, self.channels), dtype=np.float32), final)
+
+    def _emit(self, block: np.ndarray, final: bool) -> np.ndarray:
+        if self._skip:
+            dropped = min(self._skip, len(block))
+            block = block[dropped:]
+            self._skip -= dropped
+        if final:
+            # Match the analytic length the edit list reports
+            target = int(round(self._received / self.speed))
+            remaining = target - self._emitted
+            if len(block) >= remaining:
+                block = block[:max(remaining, 0)]
+            else:
+                block = np.concatenate([block, np.zeros((remaining - len(block), self.channels), dtype=np.float32)])
+        self._emitted += len(block)
+        return block
+
+    def feed(self, samples: np.ndarray) -> np.ndarray:
+        """Add input; returns whatever output is complete so far"""
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1, self.channels)
+        self._input = np.concatenate([self._input, samples])
+        self._received += len(samples)
+        return self._process(final=False)
+
+    def flush(self) -> np.ndarray:
+        """Finish the stream and return the remaining output"""
+        return self._process(final=True)
+
+
+def time_stretch(samples: np.ndarray, speed: float, sample_rate: int, block_seconds: float = BLOCK_SECONDS) -> np.ndarray:
+    """Stretch a (samples, channels) float array, feeding it through in blocks"""
+    samples = samples.reshape(len(samples), -1)
+    stretcher = TimeStretcher(speed, sample_rate, samples.shape[1])
+    block = max(int(block_seconds * sample_rate), 1)
+    parts = [stretcher.feed(samples[i:i + block]) for i in range(0, len(samples), block)]
+    parts.append(stretcher.flush())
+    return np.concatenate(parts)
+
+
+def pcm_dtype(sample_width: int) -> str:
+    if sample_width not in (1, 2, 4):
+        raise ValueError(f"Unsupported sample width: {sample_width}")
+    return "u1" if sample_width == 1 else f"<i{sample_width}"
+
+
+def pcm_blocks(raw: bytes, frame_width: int, frame_rate: int, block_seconds: float = BLOCK_SECONDS) -> Iterator[memoryview]:
+    """Whole-frame blocks of `raw`, as views (nothing is copied)"""
+    view = memoryview(raw)
+    block = max(int(block_seconds * frame_rate), 1) * frame_width
+    for i in range(0, len(view), block):
+        yield view[i:i + block]
+
+
+def stretch_pcm(blocks: Iterable[bytes], sample_width: int, channels: int, sample_rate: int,
+                speed: float) -> Iterator[bytes]:
+    """Stretch interleaved integer PCM (as held by pydub) without changing its pitch.
+
+    Input blocks are converted one at a time and output is yielded as it is
+    completed, so only a block of each is held here.
+    """
+    dtype = pcm_dtype(sample_width)
+    scale = float(1 << (8 * sample_width - 1))
+    offset = scale if sample_width == 1 else 0.0
+    low, high = (0, 255) if sample_width == 1 else (-scale, scale - 1)
+
+    def to_pcm(block: np.ndarray) -> bytes:
+        return np.clip(np.round(block.astype(np.float64) * scale + offset), low, high).astype(dtype).tobytes()
+
+    stretcher = TimeStretcher(speed, sample_rate, channels)
+    for raw in blocks:
+        samples = np.frombuffer(raw, dtype=dtype).reshape(-1, channels)
+        out = stretcher.feed((samples.astype(np.float32) - offset) / scale)
+        if len(out):
+            yield to_pcm(out)
+    yield to_pcm(stretcher.flush())
@@ -0,0 +1,179 @@
+import asyncio
+import shutil
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional
+
+from core.config import settings
+
+# Candidate executables per tool, tried in order after PATH lookup
+CANDIDATES: Dict[str, List[str]] = {
+    "ffmpeg": ["ffmpeg", "ffmpeg.exe", r"C:\Program Files\ffmpeg\bin\ffmpeg.exe", r"C:\ffmpeg\bin\ffmpeg.exe"],
+    "ffprobe": ["ffprobe", "ffprobe.exe", r"C:\Program Files\ffmpeg\bin\ffprobe.exe", r"C:\ffmpeg\bin\ffprobe.exe"],
+    "fpcalc": ["fpcalc.exe", "fpcalc", r"C:\Program Files\ffmpeg\bin\fpcalc.exe", r"C:\ffmpeg\bin\fpcalc.exe"],
+}
+
+VERSION_FLAGS = {
+    "ffmpeg": "-version",
+    "ffprobe": "-version",
+    "fpcalc": "-version",
+}
+
+PROBE_TIMEOUT = 5
+
+
+@dataclass(frozen=True)
+class ToolInfo:
+    name: str
+    path: Optional[str] = None
+    version: Optional[str] = None
+    encoders: FrozenSet[str] = field(default_factory=frozenset)
+    decoders: FrozenSet[str] = field(default_factory=frozenset)
+    filters: FrozenSet[str] = field(default_factory=frozenset)
+
+    @property
+    def available(self) -> bool:
+        return self.path is not None
+
+    def as_dict(self) -> dict:
+        return {
+            "available": self.available,
+            "path": self.path,
+            "version": self.version,
+            "encoders": len(self.encoders),
+            "decoders": len(self.decoders),
+            "filters": len(self.filters),
+        }
+
+
+def _run(args: List[str]) -> Optional[str]:
+    try:
+        result = subprocess.run(args, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout or result.stderr
+
+
+def _parse_codec_list(output: Optional[str]) -> FrozenSet[str]:
+    """Parse `ffmpeg -encoders`/`-decoders`: names follow the '------' separator"""
+    if not output:
+        return frozenset()
+    names = set()
+    started = False
+    for line in output.splitlines():
+        if not started:
+            started = line.strip().startswith("------")
+            continue
+        parts = line.split()
+        if len(parts) >= 2:
+            names.add(parts[1])
+    return frozenset(names)
+
+
+def _parse_filter_list(output: Optional[str]) -> FrozenSet[str]:
+    """Parse `ffmpeg -filters`: rows look like ' TSC atempo  A->A  Adjust audio tempo.'"""
+    if not output:
+        return frozenset()
+    names = set()
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) >= 3 and "->" in parts[2]:
+            names.add(parts[1])
+    return frozenset(names)
+
+
+def probe_tool(name: str) -> ToolInfo:
+    """Locate a binary and read its version (and ffmpeg capabilities)"""
+    candidates = list(CANDIDATES[name])
+    resolved = shutil.which(name)
+    if resolved:
+        candidates.insert(0, resolved)
+
+    for candidate in candidates:
+        output = _run([candidate, VERSION_FLAGS[name]])
+        if output is None:
+            continue
+        first_line = output.strip().splitlines()[0] if output.strip() else ""
+        if name != "ffmpeg":
+            return ToolInfo(name=name, path=candidate, version=first_line)
+        return ToolInfo(
+            name=name,
+            path=candidate,
+            version=first_line,
+            encoders=_parse_codec_list(_run([candidate, "-hide_banner", "-encoders"])),
+            decoders=_parse_codec_list(_run([candidate, "-hide_banner", "-decoders"])),
+            filters=_parse_filter_list(_run([candidate, "-hide_banner", "-filters"])),
+        )
+    return ToolInfo(name=name)
+
+
+class Toolchain:
+    """Cached view of the external media binaries.
+
+    Probing spawns processes, so it happens once at startup and then on a
+    schedule or explicit reload; request handlers only read the cache.
+    """
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._tools: Dict[str, ToolInfo] = {}
+        self._probed_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._task = None
+
+    def reload(self) -> Dict[str, ToolInfo]:
+        tools = {name: probe_tool(name) for name in CANDIDATES}
+        with self._lock:
+            self._tools = tools
+            self._probed_at = time.time()
+        for info in tools.values():
+            print(f"Toolchain: {info.name} -> {info.path or 'not found'}")
+        return tools
+
+    def get(self, name: str) -> ToolInfo:
+        if self._probed_at is None:
+            # Used outside the app lifespan (scripts, shell); probe lazily once
+            self.reload()
+        return self._tools[name]
+
+    def available(self, name: str) -> bool:
+        return self.get(name).available
+
+    def path(self, name: str) -> Optional[str]:
+        return self.get(name).path
+
+    def has_filter(self, name: str) -> bool:
+        return name in self.get("ffmpeg").filters
+
+    def has_encoder(self, name: str) -> bool:
+        return name in self.get("ffmpeg").encoders
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await asyncio.to_thread(self.reload)
+
+    async def start(self):
+        await asyncio.to_thread(self.reload)
+        if self.refresh_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self) -> dict:
+        tools = {name: self.get(name).as_dict() for name in CANDIDATES}
+        return {"probed_at": self._probed_at, "tools": tools}
+
+
+toolchain = Toolchain(refresh_interval=settings.TOOLCHAIN_REFRESH_SECONDS)
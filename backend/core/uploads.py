@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import os
+import struct
+from dataclasses import dataclass
+from typing import Iterable, Optional
+from uuid import uuid4
+
+from fastapi import HTTPException, UploadFile
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB per read/write; memory per upload stays at one chunk
+SNIFF_BYTES = 512
+
+# ISO base media (mp4/mov/m4a/heic/avif) major brands we care about
+_FTYP_BRANDS = {
+    b"M4A ": "m4a", b"M4B ": "m4a", b"M4P ": "m4a",
+    b"qt  ": "mov",
+    b"heic": "heic", b"heix": "heic", b"mif1": "heic",
+    b"avif": "avif", b"avis": "avif",
+}
+
+
+@dataclass
+class SavedUpload:
+    file_id: str
+    path: str
+    size: int
+    sha256: str
+    detected_type: Optional[str]
+    filename: str
+    # Content of uploads read into memory (read_upload); those have no path
+    data: Optional[bytes] = None
+
+    @property
+    def extension(self) -> str:
+        return f".{self.detected_type}" if self.detected_type else os.path.splitext(self.filename)[1].lower()
+
+
+# DIB header sizes: OS/2 core (12), BITMAPINFOHEADER (40) and its extensions
+_BMP_INFO_SIZES = {12, 16, 40, 52, 56, 64, 108, 124}
+
+
+def _is_bmp(head: bytes) -> bool:
+    """Whether a "BM" file starts with a consistent BITMAPFILEHEADER and DIB header"""
+    if len(head) < 18 or not head.startswith(b"BM"):
+        return False
+    file_size, reserved, pixel_offset, info_size = struct.unpack_from("<IIII", head, 2)
+    return (
+        reserved == 0
+        and info_size in _BMP_INFO_SIZES
+        and 14 + info_size <= pixel_offset <= file_size
+    )
+
+
+def sniff_type(head: bytes) -> Optional[str]:
+    """Identify a file from its magic bytes; returns a canonical extension"""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if _is_bmp(head):
+        return "bmp"
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    if head.startswith(b"PK\x03\x04"):
+        return "zip"
+    if head[:4] == b"RIFF":
+        return {b"WAVE": "wav", b"WEBP": "webp", b"AVI ": "avi"}.get(head[8:12])
+    if head.startswith(b"fLaC"):
+        return "flac"
+    if head.startswith(b"OggS"):
+        return "ogg"
+    if head.startswith(b"ID3"):
+        return "mp3"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "webm" if b"webm" in head[:64] else "mkv"
+    if head.startswith(b"\x30\x26\xb2\x75\x8e\x66\xcf\x11"):
+        return "wma"
+    if head[4:8] == b"ftyp":
+        return _FTYP_BRANDS.get(head[8:12], "mp4")
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        # MPEG audio frame sync: layer bits 00 mean ADTS AAC, anything else is MP3
+        return "aac" if head[1] & 0x06 == 0 else "mp3"
+    text = head.lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if text.startswith(b"<svg") or (text.startswith(b"<?xml") and b"<svg" in text):
+        return "svg"
+    return None
+
+
+class _CheckedReader:
+    """Reads an upload chunk by chunk, enforcing the size limit and type and hashing as bytes arrive"""
+
+    def __init__(self, file: UploadFile, limit_mb: int, allowed: Optional[Iterable[str]]):
+        self.file = file
+        self.limit_mb = limit_mb
+        self.allowed = allowed
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.detected = None
+
+    async def chunks(self):
+        max_bytes = self.limit_mb * 1024 * 1024
+        while True:
+            chunk = await self.file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if self.size == 0:
+                self.detected = sniff_type(chunk[:SNIFF_BYTES])
+                if self.allowed is not None and self.detected not in self.allowed:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Invalid file format. Supported: {', '.join(sorted(self.allowed))}"
+                    )
+            self.size += len(chunk)
+            if self.size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"File too large. Maximum size is {self.limit_mb} MB")
+            self.digest.update(chunk)
+            yield chunk
+
+    def result(self, file_id: str) -> SavedUpload:
+        if self.size == 0:
+            raise HTTPException(status_code=400, detail="Uploaded file is empty")
+        return SavedUpload(
+            file_id=file_id,
+            path="",
+            size=self.size,
+            sha256=self.digest.hexdigest(),
+            detected_type=self.detected,
+            filename=self.file.filename or "",
+        )
+
+
+async def save_upload(
+    file: UploadFile,
+    dest_dir: str,
+    limit_mb: int,
+    allowed: Optional[Iterable[str]] = None,
+) -> SavedUpload:
+    """Stream an upload to disk in fixed-size chunks.
+
+    Enforces `limit_mb` while bytes arrive, hashes the content in the same
+    pass and checks the sniffed type against `allowed`. The file is written
+    under a temporary name and renamed once it is complete.
+    """
+    file_id = str(uuid4())
+    partial_path = os.path.join(dest_dir, f"{file_id}.part")
+    reader = _CheckedReader(file, limit_mb, allowed)
+
+    try:
+        with open(partial_path, "wb") as buffer:
+            async for chunk in reader.chunks():
+                await asyncio.to_thread(buffer.write, chunk)
+        saved = reader.result(file_id)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+    saved.path = os.path.join(dest_dir, f"{file_id}{saved.extension}")
+    os.replace(partial_path, saved.path)
+    return saved
+
+
+async def read_upload(
+    file: UploadFile,
+    limit_mb: int,
+    allowed: Optional[Iterable[str]] = None,
+) -> SavedUpload:
+    """Read an upload into memory (`.data`) with the same checks as save_upload.
+
+    For tools that decode straight from bytes; nothing touches the disk.
+    """
+    reader = _CheckedReader(file, limit_mb, allowed)
+    chunks = [chunk async for chunk in reader.chunks()]
+    saved = reader.result(str(uuid4()))
+    saved.data = b"".join(chunks)
+    return saved
@@ -0,0 +1,274 @@
+import bisect
+import json
+import os
+import re
+import shutil
+import tempfile
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from core.process import ProcessError, ProcessTimeout, run_process
+from core.toolchain import toolchain
+
+# Frame-accurate video trim at close to remux speed.
+#
+# A packet index splits the requested range into up to three pieces: the
+# partial GOP before the first keyframe inside the range, the whole GOPs
+# between the first and last keyframes (stream-copied, never decoded), and
+# the partial GOP after the last keyframe. Only the two partial pieces are
+# re-encoded, with the source codec, and the pieces are joined with the
+# concat demuxer, which moves each piece's H.264 parameter sets in-band so
+# copied and re-encoded GOPs decode as one stream. Audio is cheap, so it is
+# cut sample-accurately from the source in the final mux.
+#
+# Pieces are cut by frame count from the index rather than by duration:
+# stream copy stops on decode timestamps, so with B-frames a time-based cut
+# would carry a few frames of the next GOP along, and -t counts from the
+# first output frame rather than from the seek point.
+
+INDEX_TIMEOUT = 120
+PIECE_TIMEOUT = 600
+# Enough stderr to keep the input banner (codec and pixel format)
+INDEX_STDERR_LINES = 500
+# Encoded pieces seek this much early so millisecond timestamps never round
+# their first frame out (well under a frame at 120fps)
+SEEK_NUDGE = 0.002
+# Keyframes this close outside the range still start or end the copied part
+KEYFRAME_TOLERANCE = 0.001
+
+# Codecs whose partial GOPs can be re-encoded and joined to copied ones
+SMART_CUT_ENCODERS = {
+    "h264": "libx264",
+    "mpeg4": "mpeg4",
+}
+ENCODER_QUALITY = {
+    "libx264": ["-preset", "veryfast", "-crf", "18"],
+    "mpeg4": ["-q:v", "2"],
+}
+FALLBACK_ENCODER = "libx264"
+DEFAULT_TIMESCALE = 90000
+# Audio re-encode per output container
+AUDIO_ENCODERS = {
+    ".avi": "libmp3lame",
+}
+DEFAULT_AUDIO_ENCODER = "aac"
+
+
+@dataclass
+class VideoIndex:
+    codec: Optional[str] = None
+    pix_fmt: Optional[str] = None
+    time_base: Optional[str] = None
+    # Presentation times (seconds from the start of the file) of every frame
+    # and of the keyframes, with the keyframes' positions in decode order
+    frames: List[float] = field(default_factory=list)
+    keyframes: List[float] = field(default_factory=list)
+    positions: List[int] = field(default_factory=list)
+
+    def frames_between(self, start: float, end: float) -> int:
+        return bisect.bisect_left(self.frames, end) - bisect.bisect_left(self.frames, start)
+
+
+def _keyframe_index(index: VideoIndex, packets: List[Tuple[float, bool]], start_time: float) -> VideoIndex:
+    index.frames = sorted(pts - start_time for pts, _ in packets)
+    keys = sorted((pts - start_time, position) for position, (pts, key) in enumerate(packets) if key)
+    index.keyframes = [pts for pts, _ in keys]
+    index.positions = [position for _, position in keys]
+    return index
+
+
+def _parse_ffprobe_index(output: str) -> VideoIndex:
+    data = json.loads(output)
+    stream = (data.get("streams") or [{}])[0]
+    start_time = float(data.get("format", {}).get("start_time") or 0)
+    packets = [
+        (float(packet["pts_time"]), "K" in packet.get("flags", ""))
+        for packet in data.get("packets", []) if packet.get("pts_time") not in (None, "N/A")
+    ]
+    index = VideoIndex(stream.get("codec_name"), stream.get("pix_fmt"), stream.get("time_base"))
+    return _keyframe_index(index, packets, start_time)
+
+
+def _parse_framecrc_index(stdout: str, stderr: str) -> VideoIndex:
+    index = VideoIndex()
+    stream = re.search(r"Stream #0:\d+.*?: Video: (\w+)[^,]*, (\w+)", stderr)
+    if stream:
+        index.codec, index.pix_fmt = stream.group(1), stream.group(2)
+    time_base = re.search(r"#tb 0: (\d+)/(\d+)", stdout)
+    if not time_base:
+        return index
+    index.time_base = f"{time_base.group(1)}/{time_base.group(2)}"
+    scale = int(time_base.group(1)) / int(time_base.group(2))
+    packets = []
+    for line in stdout.splitlines():
+        if line.startswith("#"):
+            continue
+        # stream, dts, pts, duration, size, crc[, F=flags]; keyframes carry no flags field
+        fields = [f.strip() for f in line.split(",")]
+        if len(fields) < 6 or fields[2] == "NOPTS":
+            continue
+        flags = int(fields[6][2:], 16) if len(fields) > 6 and fields[6].startswith("F=") else 1
+        packets.append((int(fields[2]) * scale, bool(flags & 1)))
+    # ffmpeg already shifts output timestamps to the file's start time, as -ss does
+    return _keyframe_index(index, packets, 0.0)
+
+
+async def index_video(path: str) -> VideoIndex:
+    """Codec, pixel format and keyframe layout of the first video stream"""
+    if toolchain.available("ffprobe"):
+        args = [
+            toolchain.path("ffprobe"), "-v", "error", "-select_streams", "v:0",
+            "-show_entries", "format=start_time:stream=codec_name,pix_fmt,time_base:packet=pts_time,flags",
+            "-of", "json", path
+        ]
+        try:
+            result = await run_process(args, tool="ffprobe", timeout=INDEX_TIMEOUT)
+            return _parse_ffprobe_index(result.text)
+        except (OSError, ProcessError, ProcessTimeout, ValueError) as e:
+            print(f"ffprobe keyframe index failed for {path}: {e}")
+
+    # Demux only: framecrc lists every packet without decoding any of them
+    args = [
+        toolchain.path("ffmpeg"), "-hide_banner", "-nostats", "-i", path,
+        "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"
+    ]
+    result = await run_process(args, tool="ffmpeg", timeout=INDEX_TIMEOUT, stderr_lines=INDEX_STDERR_LINES)
+    return _parse_framecrc_index(result.text, result.stderr)
+
+
+def plan_pieces(index: VideoIndex, start: float, end: float) -> List[Tuple[str, float, float, int]]:
+    """Split [start, end] into ("encode" | "copy", from, to, frames) pieces along keyframes"""
+    inside = [
+        i for i, k in enumerate(index.keyframes)
+        if start - KEYFRAME_TOLERANCE <= k <= end + KEYFRAME_TOLERANCE
+    ]
+    if len(inside) < 2:
+        return [("encode", start, end, index.frames_between(start, end))]
+    first, last = index.keyframes[inside[0]], index.keyframes[inside[-1]]
+    pieces = []
+    # A range edge between frames leaves nothing to encode on that side
+    if index.frames_between(start, first):
+        pieces.append(("encode", start, first, index.frames_between(start, first)))
+    pieces.append(("copy", first, last, index.positions[inside[-1]] - index.positions[inside[0]]))
+    if index.frames_between(last, end):
+        pieces.append(("encode", last, end, index.frames_between(last, end)))
+    return pieces
+
+
+def _video_encode_args(index: VideoIndex, encoder: str) -> list:
+    # Source timestamps as they are: constant frame rate sync would pad short pieces
+    args = ["-fps_mode", "passthrough", "-c:v", encoder] + ENCODER_QUALITY.get(encoder, [])
+    if index.pix_fmt:
+        args += ["-pix_fmt", index.pix_fmt]
+    return args
+
+
+def _timescale(index: VideoIndex) -> int:
+    num, _, den = (index.time_base or "").partition("/")
+    if num == "1" and den.isdigit():
+        return int(den)
+    return DEFAULT_TIMESCALE
+
+
+def _piece_args(src: str, dst: str, kind: str, start: float, frames: int,
+                index: VideoIndex, encoder: str) -> list:
+    if kind == "copy":
+        # ffmpeg rounds the seek to the nearest stream tick, so the keyframe
+        # time to the microsecond lands exactly on it
+        args = [
+            toolchain.path("ffmpeg"), "-y", "-v", "error",
+            "-ss", f"{start:.6f}", "-i", src,
+            "-map", "0:v:0", "-frames:v", str(frames), "-c:v", "copy",
+        ]
+    else:
+        # Accurate seek: decoded from the previous keyframe, kept from `start`
+        args = [
+            toolchain.path("ffmpeg"), "-y", "-v", "error",
+            "-ss", f"{max(start - SEEK_NUDGE, 0):.6f}", "-i", src,
+            "-map", "0:v:0", "-frames:v", str(frames),
+        ] + _video_encode_args(index, encoder)
+    # The concat demuxer needs every piece on the same clock: the source's
+    return args + ["-an", "-sn", "-dn", "-video_track_timescale", str(_timescale(index)), "-f", "mp4", dst]
+
+
+def _audio_encoder(dst: str) -> str:
+    return AUDIO_ENCODERS.get(os.path.splitext(dst)[1].lower(), DEFAULT_AUDIO_ENCODER)
+
+
+def reencode_args(src: str, dst: str, start: float, end: float, encoder: str, index: VideoIndex) -> list:
+    """Full re-encode of the range: the fallback, and what smart cuts are measured against"""
+    args = [
+        toolchain.path("ffmpeg"), "-y", "-v", "error",
+        "-ss", f"{max(start - SEEK_NUDGE, 0):.6f}", "-i", src,
+        "-t", f"{end - start:.6f}",
+        "-map", "0:v:0", "-map", "0:a:0?",
+    ]
+    if index.frames:
+        args += ["-frames:v", str(index.frames_between(start, end))]
+    return args + _video_encode_args(index, encoder) + ["-c:a", _audio_encoder(dst), dst]
+
+
+async def _smart_cut(src: str, dst: str, start: float, end: float, pieces: list,
+                     index: VideoIndex, encoder: str, request=None):
+    workdir = tempfile.mkdtemp(prefix="trim_", dir=os.path.dirname(os.path.abspath(dst)))
+    try:
+        listing = []
+        for i, (kind, piece_start, _, frames) in enumerate(pieces):
+            piece = os.path.join(workdir, f"{i}.mp4")
+            await run_process(
+                _piece_args(src, piece, kind, piece_start, frames, index, encoder),
+                tool="ffmpeg", timeout=PIECE_TIMEOUT, request=request
+            )
+            listing.append(f"file '{piece}'")
+        list_path = os.path.join(workdir, "pieces.txt")
+        with open(list_path, "w") as f:
+            f.write("\n".join(listing) + "\n")
+
+        # Joined video plus the source audio, cut sample-accurately
+        args = [
+            toolchain.path("ffmpeg"), "-y", "-v", "error",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-ss", f"{start:.6f}", "-t", f"{end - start:.6f}", "-i", src,
+            "-map", "0:v:0", "-map", "1:a:0?",
+            "-c:v", "copy", "-c:a", _audio_encoder(dst),
+            dst
+        ]
+        await run_process(args, tool="ffmpeg", timeout=PIECE_TIMEOUT, request=request)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def trim_video(src: str, dst: str, start: float, end: float, request=None) -> dict:
+    """Frame-accurate trim of [start, end] into `dst`.
+
+    Returns the mode used ("copy", "smart" or "reencode") and how many
+    seconds were stream-copied rather than re-encoded. Raises ValueError if
+    the range holds no video frames.
+    """
+    index = await index_video(src)
+    if not index.frames:
+        raise ValueError("No video stream found")
+    if not index.frames_between(start, end):
+        raise ValueError("No video frames in the selected range")
+    encoder = SMART_CUT_ENCODERS.get(index.codec)
+    if encoder and toolchain.has_encoder(encoder):
+        pieces = plan_pieces(index, start, end)
+        copied = sum(piece_end - piece_start for kind, piece_start, piece_end, _ in pieces if kind == "copy")
+        if copied:
+            try:
+                await _smart_cut(src, dst, start, end, pieces, index, encoder, request)
+                return {
+                    "mode": "copy" if len(pieces) == 1 else "smart",
+                    "copied_seconds": round(copied, 3),
+                    "keyframes": len(index.keyframes),
+                }
+            except ProcessError as e:
+                print(f"Smart cut failed for {src}, re-encoding: {e}")
+    else:
+        encoder = FALLBACK_ENCODER
+
+    await run_process(
+        reencode_args(src, dst, start, end, encoder, index),
+        tool="ffmpeg", timeout=PIECE_TIMEOUT, request=request
+    )
+    return {"mode": "reencode", "copied_seconds": 0.0, "keyframes": len(index.keyframes)}
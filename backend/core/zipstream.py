@@ -0,0 +1,79 @@
+import asyncio
+import os
+import zipfile
+from typing import AsyncIterator, Optional, Tuple
+
+# ZIP archives written straight into a streaming response.
+#
+# zipfile supports unseekable outputs (it writes a data descriptor after
+# each entry instead of seeking back to patch the header), so entries can be
+# sent as soon as their file is ready, without building the archive on disk.
+
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+
+def unique_name(name: str, used: set) -> str:
+    """`name`, or `name_2`, `name_3`... if the archive already has it"""
+    base, extension = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in used:
+        n += 1
+        candidate = f"{base}_{n}{extension}"
+    used.add(candidate)
+    return candidate
+
+
+class _Buffer:
+    """Write-only sink that zipfile treats as an unseekable stream"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _copy_chunk(src, dest) -> bool:
+    chunk = src.read(ZIP_CHUNK_SIZE)
+    if chunk:
+        dest.write(chunk)
+    return bool(chunk)
+
+
+async def zip_stream(
+    entries: AsyncIterator[Tuple[str, Optional[str], Optional[bytes]]],
+    compression: int = zipfile.ZIP_STORED,
+) -> AsyncIterator[bytes]:
+    """Yield a ZIP archive of `entries` as it is built.
+
+    Each entry is (name in archive, file path, None) or (name, None, bytes).
+    Media files are already compressed, so entries are stored by default.
+    Memory is bounded by one read chunk.
+    """
+    buffer = _Buffer()
+    with zipfile.ZipFile(buffer, "w", compression=compression) as archive:
+        async for name, path, data in entries:
+            if path is None:
+                archive.writestr(name, data)
+            else:
+                info = zipfile.ZipInfo.from_file(path, name)
+                info.compress_type = compression
+                with open(path, "rb") as src, archive.open(info, "w") as dest:
+                    while await asyncio.to_thread(_copy_chunk, src, dest):
+                        pending = buffer.drain()
+                        if pending:
+                            yield pending
+            pending = buffer.drain()
+            if pending:
+                yield pending
+    # Central directory
+    yield buffer.drain()
@@ -1,16 +1,41 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from database import engine
 import models
-from routers import auth, audio, video, image, converter, socials, music_recognition
+from core.reaper import reaper
+from core.artifacts import artifacts
+from core.result_cache import result_cache
+from core.toolchain import toolchain
+from core import process
+from core.jobs import job_queue
+from core.image_batch import image_pool
+from routers import auth, audio, video, image, converter, socials, music_recognition, jobs
 import os
+import asyncio
 from dotenv import load_dotenv
 
 load_dotenv()
 
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="Daily Life Tools API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Probe ffmpeg/ffprobe/fpcalc once so requests only read the cached result
+    await toolchain.start()
+    # Index processed/ as left by the last run before anything writes to it
+    await asyncio.to_thread(artifacts.load)
+    # Expired uploads and stale processed/ outputs are removed off the request path
+    reaper.start()
+    job_queue.start()
+    image_pool.start()
+    yield
+    image_pool.stop()
+    await job_queue.stop()
+    await reaper.stop()
+    await toolchain.stop()
+
+app = FastAPI(title="Daily Life Tools API", lifespan=lifespan)
 
 # Get frontend URL from environment variable
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
@@ -31,6 +56,7 @@ app.include_router(image.router, prefix="/api/v1/image", tags=["image"])
 app.include_router(converter.router, prefix="/api/v1/converter", tags=["converter"])
 app.include_router(socials.router, prefix="/api/v1/socials", tags=["socials"])
 app.include_router(music_recognition.router, prefix="/api/v1/music-id", tags=["music-recognition"])
+app.include_router(jobs.router, prefix="/api/v1/jobs", tags=["jobs"])
 
 @app.get("/")
 def read_root():
@@ -39,3 +65,16 @@ def read_root():
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
+
+@app.get("/metrics")
+def metrics():
+    return {"reaper": reaper.stats(), "artifacts": artifacts.stats(), "result_cache": result_cache.stats(), "processes": process.stats(), "jobs": job_queue.stats(), "image_pool": image_pool.stats()}
+
+@app.get("/toolchain")
+def toolchain_status():
+    return toolchain.status()
+
+@app.post("/toolchain/reload")
+async def toolchain_reload():
+    await asyncio.to_thread(toolchain.reload)
+    return toolchain.status()
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -35,3 +35,27 @@ class Usage(Base):
 
     user = relationship("User", back_populates="usages")
     tool = relationship("Tool", back_populates="usages")
+
+class AudioSession(Base):
+    __tablename__ = "audio_sessions"
+
+    file_id = Column(String(36), primary_key=True)
+    uploaded_at = Column(DateTime, index=True, nullable=False)
+    data = Column(Text, nullable=False) # JSON metadata (path, original_filename, duration, ...)
+    lock_token = Column(String(36), nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String(36), primary_key=True)
+    kind = Column(String, index=True)
+    owner = Column(String, index=True)
+    worker = Column(String, nullable=True) # host:pid of the server worker running it
+    priority = Column(Integer, default=0)
+    status = Column(String, index=True) # queued, running, done, failed
+    result = Column(Text, nullable=True) # JSON: path, filename, media_type, headers
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, index=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
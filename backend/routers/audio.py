@@ -1,52 +1,56 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
-from fastapi.responses import FileResponse
-from pydub import AudioSegment
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from urllib.parse import quote
+from pydantic import BaseModel
+from typing import List, Optional
+import json
 import os
-import shutil
-from uuid import uuid4
-from datetime import datetime, timedelta
-from typing import Dict
-import subprocess
+from datetime import datetime
+from contextlib import asynccontextmanager
+import asyncio
+from core.sessions import get_session_registry, SessionBusyError
+from core.toolchain import toolchain
+from core.media_probe import probe_media
+from core.uploads import save_upload
+from core.edl import apply_edit, undo_edit, render, session_files, transcode
+from core.edl import TRANSCODE_FORMATS, TRANSCODE_SAMPLE_RATES, OPUS_SAMPLE_RATES
+from core.config import settings
+from core.downloads import download_response, not_modified, strong_etag, CACHE_CONTROL
+from core.peaks import session_peaks, select_level, encode_dat
+from core.zipstream import zip_stream, unique_name
+from core.artifacts import artifacts
 
 router = APIRouter()
 
 UPLOAD_DIR = "uploads"
-PROCESSED_DIR = "processed"
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(PROCESSED_DIR, exist_ok=True)
 
-# Store uploaded files with metadata
-# In production, use Redis or database
-uploaded_files: Dict[str, dict] = {}
+# Sniffed upload types; many .m4a files carry a generic mp4 brand
+AUDIO_TYPES = {'mp3', 'wav', 'ogg', 'm4a', 'mp4', 'flac'}
+
+# Uploaded file metadata, shared by all workers (database or Redis backed)
+sessions = get_session_registry()
 
 def check_ffmpeg_available():
-    """Check if ffmpeg is available"""
+    """Check if ffmpeg is available (cached toolchain probe)"""
+    return toolchain.available("ffmpeg")
+
+@asynccontextmanager
+async def edit_session(file_id: str):
+    """Lock a file's session for editing and save its metadata on success"""
     try:
-        result = subprocess.run(
-            ["ffmpeg", "-version"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=5
-        )
-        return result.returncode == 0
-    except (FileNotFoundError, subprocess.TimeoutExpired):
-        return False
-
-def cleanup_old_files():
-    """Remove files older than 1 hour"""
-    current_time = datetime.now()
-    to_delete = []
-    
-    for file_id, metadata in uploaded_files.items():
-        if current_time - metadata['uploaded_at'] > timedelta(hours=1):
-            to_delete.append(file_id)
-            # Delete physical file
-            if os.path.exists(metadata['path']):
-                os.remove(metadata['path'])
-    
-    for file_id in to_delete:
-        del uploaded_files[file_id]
+        async with sessions.lock(file_id) as lease:
+            metadata = await asyncio.to_thread(sessions.get, file_id)
+            if metadata is None:
+                raise HTTPException(status_code=404, detail="File not found. Please upload the file first.")
+            yield metadata
+            if not lease.held:
+                # Another request may have edited since; don't overwrite its metadata
+                raise HTTPException(status_code=409, detail="The edit lock expired before the changes were saved. Please retry.")
+            await asyncio.to_thread(sessions.put, file_id, metadata)
+    except SessionBusyError:
+        raise HTTPException(status_code=409, detail="File is being edited by another request. Please retry.")
 
 @router.post("/upload")
 async def upload_audio(file: UploadFile = File(...)):
@@ -54,45 +58,34 @@ async def upload_audio(file: UploadFile = File(...)):
     try:
         print(f"Upload request received: filename={file.filename}, content_type={file.content_type}")
         
-        if not file.filename.endswith(('.mp3', '.wav', '.ogg', '.m4a', '.flac')):
-            raise HTTPException(status_code=400, detail="Invalid file format. Supported: mp3, wav, ogg, m4a, flac")
-        
-        cleanup_old_files()
-        
-        file_id = str(uuid4())
-        file_extension = os.path.splitext(file.filename)[1]
-        file_path = os.path.join(UPLOAD_DIR, f"{file_id}{file_extension}")
-        
-        print(f"Saving file to: {file_path}")
+        # Stream to disk; the format is taken from the file's magic bytes, not its name
+        saved = await save_upload(file, UPLOAD_DIR, settings.MAX_AUDIO_UPLOAD_MB, allowed=AUDIO_TYPES)
+        file_id = saved.file_id
+        file_path = saved.path
+        file_extension = saved.extension
         
-        # Save uploaded file
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        print(f"File saved to {file_path} ({saved.size} bytes), reading audio metadata...")
         
-        print(f"File saved, reading audio metadata...")
+        # Read duration and stream info from the headers (no sample decoding)
+        media = await probe_media(file_path)
+        duration = media['duration'] if media else 0.0
+        if media:
+            print(f"Audio duration: {duration}s ({media['codec']}, probed with {media['probed_with']})")
+        else:
+            print(f"Warning: Could not read audio metadata. Continuing with upload anyway...")
         
-        # Get audio duration (optional - may fail without ffmpeg)
-        duration = 0.0  # Default duration
-        audio = None
-        try:
-            audio = AudioSegment.from_file(file_path)
-            duration = len(audio) / 1000.0  # Convert to seconds
-            print(f"Audio duration: {duration}s")
-        except Exception as e:
-            print(f"Warning: Could not read audio metadata (ffmpeg may not be installed): {str(e)}")
-            print(f"Continuing with upload anyway...")
-            # Ensure audio object is closed if it was created
-            if audio is not None:
-                del audio
-        
-        uploaded_files[file_id] = {
+        await asyncio.to_thread(sessions.put, file_id, {
             'path': file_path,
             'original_filename': file.filename,
             'uploaded_at': datetime.now(),
             'duration': duration,
-            'extension': file_extension
-        }
+            'extension': file_extension,
+            'sha256': saved.sha256,
+            'size': saved.size,
+            'media': media,
+            'edits': [],
+            'version': 0
+        })
         
         print(f"Upload successful: file_id={file_id}")
         
@@ -110,181 +103,436 @@ async def upload_audio(file: UploadFile = File(...)):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+async def record_edit(file_id: str, edit: dict, message: str) -> dict:
+    """Append an edit to the file's edit list; rendering waits for download/preview"""
+    async with edit_session(file_id) as metadata:
+        try:
+            apply_edit(metadata, edit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        return {
+            "message": message,
+            "file_id": file_id,
+            "duration": metadata['duration'],
+            "edits": len(metadata['edits']),
+            "version": metadata['version']
+        }
+
 @router.post("/trim/{file_id}")
 async def trim_audio(
     file_id: str,
     start_time: float = Form(...),  # in seconds
-    end_time: float = Form(...)     # in seconds
+    end_time: float = Form(...),    # in seconds
+    exact: bool = Form(False)       # sample-accurate cut (re-encodes)
 ):
-    """Trim an uploaded audio file"""
-    if file_id not in uploaded_files:
-        raise HTTPException(status_code=404, detail="File not found. Please upload the file first.")
-    
+    """Trim an uploaded audio file.
+
+    By default a trim-only edit list renders as a lossless stream copy
+    snapped to codec frame boundaries; pass exact=true for a sample-accurate
+    re-encode.
+    """
     if not check_ffmpeg_available():
         raise HTTPException(
             status_code=400,
             detail="FFmpeg is required for audio trimming. Please install FFmpeg: https://ffmpeg.org/download.html"
         )
     
-    metadata = uploaded_files[file_id]
-    file_path = metadata['path']
+    return await record_edit(
+        file_id,
+        {"op": "trim", "start": start_time, "end": end_time, "exact": exact},
+        "Audio trimmed successfully"
+    )
+
+@router.post("/speed/{file_id}")
+async def change_speed(
+    file_id: str,
+    speed: float = Form(...)
+):
+    """Change the speed of an uploaded audio file.
+
+    Rendered with ffmpeg's atempo, or without ffmpeg by the NumPy WSOLA
+    stretch; both keep the pitch.
+    """
+    if speed < 0.5 or speed > 2.0:
+        raise HTTPException(status_code=400, detail="Speed must be between 0.5 and 2.0")
     
-    try:
-        audio = AudioSegment.from_file(file_path)
-        
-        # pydub works in milliseconds
-        start_ms = start_time * 1000
-        end_ms = end_time * 1000
-        
-        if start_ms < 0 or end_ms > len(audio) or start_ms >= end_ms:
-            raise HTTPException(status_code=400, detail="Invalid start or end time")
-        
-        trimmed_audio = audio[start_ms:end_ms]
-        
-        # Update the file in place
-        trimmed_audio.export(file_path, format=metadata['extension'][1:])  # Remove the dot
-        
-        # Update metadata
-        metadata['duration'] = len(trimmed_audio) / 1000.0
+    return await record_edit(file_id, {"op": "speed", "speed": speed}, "Speed changed successfully")
+
+@router.post("/fade/{file_id}")
+async def fade_audio(
+    file_id: str,
+    direction: str = Form(...),  # "in" or "out"
+    seconds: float = Form(...)
+):
+    """Fade the start or end of an uploaded audio file"""
+    return await record_edit(
+        file_id,
+        {"op": "fade", "direction": direction, "seconds": seconds},
+        f"Fade {direction} added successfully"
+    )
+
+@router.post("/gain/{file_id}")
+async def change_gain(
+    file_id: str,
+    db: float = Form(...)
+):
+    """Raise or lower the volume of an uploaded audio file (in dB)"""
+    return await record_edit(file_id, {"op": "gain", "db": db}, "Gain changed successfully")
+
+@router.post("/undo/{file_id}")
+async def undo_audio_edit(file_id: str):
+    """Remove the most recent edit"""
+    async with edit_session(file_id) as metadata:
+        edit = undo_edit(metadata)
+        if edit is None:
+            raise HTTPException(status_code=400, detail="Nothing to undo")
         
         return {
-            "message": "Audio trimmed successfully",
+            "message": f"Undid {edit['op']}",
             "file_id": file_id,
-            "duration": metadata['duration']
+            "duration": metadata['duration'],
+            "edits": len(metadata['edits']),
+            "version": metadata['version']
         }
+
+async def render_session(file_id: str, kind: str, request: Request) -> dict:
+    """Render the edit list (once per distinct list) and return the updated metadata"""
+    async with edit_session(file_id) as metadata:
+        try:
+            await render(file_id, metadata, kind, request=request)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Rendering failed: {str(e)}")
+        return metadata
+
+def session_etag(metadata: dict, kind: str) -> str:
+    """Strong ETag for a rendition: upload hash plus edit version"""
+    return strong_etag(metadata['sha256'], metadata.get('version', 0), None if kind == "download" else kind)
+
+async def cached_render(file_id: str, kind: str, request: Request):
+    """304 for a client that already holds this version, checked before rendering"""
+    metadata = await asyncio.to_thread(sessions.get, file_id)
+    if metadata is None or not metadata.get('sha256'):
+        return None
+    return not_modified(request, session_etag(metadata, kind))
+
+@router.get("/download/{file_id}")
+async def download_audio(file_id: str, request: Request):
+    """Download the processed audio file"""
+    cached = await cached_render(file_id, "download", request)
+    if cached is not None:
+        return cached
     
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Trim failed: {str(e)}")
+    metadata = await render_session(file_id, "download", request)
+    path = metadata['renders']['download']['path'] if metadata.get('edits') else metadata['path']
+    
+    return await download_response(
+        request,
+        path,
+        filename=f"processed_{metadata['original_filename']}",
+        media=metadata.get('media'),
+        etag=session_etag(metadata, "download") if metadata.get('sha256') else None,
+        background=artifacts.hold(path)
+    )
 
-@router.post("/speed/{file_id}")
-async def change_speed(
+@router.get("/preview/{file_id}")
+async def preview_audio(file_id: str, request: Request):
+    """Stream a small MP3 preview of the file with its pending edits applied"""
+    cached = await cached_render(file_id, "preview", request)
+    if cached is not None:
+        return cached
+    
+    metadata = await render_session(file_id, "preview", request)
+    path = metadata['renders']['preview']['path']
+    
+    return await download_response(
+        request,
+        path,
+        media_type="audio/mpeg",
+        etag=session_etag(metadata, "preview") if metadata.get('sha256') else None,
+        background=artifacts.hold(path)
+    )
+
+MAX_BATCH_FILES = 100
+BATCH_CONCURRENCY = settings.BATCH_CONCURRENCY or os.cpu_count() or 1
+
+class BatchOperation(BaseModel):
+    op: str                             # trim, speed, fade or gain
+    start: Optional[float] = None       # trim
+    end: Optional[float] = None         # trim
+    exact: bool = False                 # trim
+    speed: Optional[float] = None       # speed
+    direction: Optional[str] = None     # fade
+    seconds: Optional[float] = None     # fade
+    db: Optional[float] = None          # gain
+
+class BatchRequest(BaseModel):
+    file_ids: List[str]
+    operation: BatchOperation
+
+def batch_edit(operation: BatchOperation) -> dict:
+    """Edit-list entry for a batch operation, shaped like the single-file endpoints' edits"""
+    fields = {
+        "trim": ("start", "end", "exact"),
+        "speed": ("speed",),
+        "fade": ("direction", "seconds"),
+        "gain": ("db",),
+    }
+    if operation.op not in fields:
+        raise HTTPException(status_code=400, detail="Operation must be one of: trim, speed, fade, gain")
+    edit = {"op": operation.op}
+    for name in fields[operation.op]:
+        value = getattr(operation, name)
+        if value is None:
+            raise HTTPException(status_code=400, detail=f"'{name}' is required for {operation.op}")
+        edit[name] = value
+    return edit
+
+async def process_batch_item(file_id: str, edit: dict, limit: asyncio.Semaphore) -> dict:
+    """Apply one batch edit and render the result; failures are reported, not raised"""
+    async with limit:
+        try:
+            async with edit_session(file_id) as metadata:
+                apply_edit(metadata, dict(edit))
+                path = await render(file_id, metadata, "download")
+                return {
+                    "file_id": file_id,
+                    "ok": True,
+                    "filename": f"processed_{metadata['original_filename']}",
+                    "duration": metadata['duration'],
+                    "edits": len(metadata['edits']),
+                    "version": metadata['version'],
+                    "download_url": f"/api/v1/audio/download/{file_id}",
+                    "path": path
+                }
+        except HTTPException as e:
+            return {"file_id": file_id, "ok": False, "error": e.detail}
+        except ValueError as e:
+            return {"file_id": file_id, "ok": False, "error": str(e)}
+        except Exception as e:
+            print(f"Batch item {file_id} failed: {type(e).__name__}: {str(e)}")
+            return {"file_id": file_id, "ok": False, "error": str(e)}
+
+async def run_batch(file_ids: List[str], edit: dict):
+    """Yield item results in completion order; pending items are cancelled if the client goes away"""
+    limit = asyncio.Semaphore(BATCH_CONCURRENCY)
+    tasks = [asyncio.create_task(process_batch_item(file_id, edit, limit)) for file_id in file_ids]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+@router.post("/batch")
+async def batch_process(batch: BatchRequest, bundle: Optional[str] = Query(None)):
+    """Apply one operation to many files in parallel.
+
+    Results stream back as NDJSON, one line per file as it finishes, then a
+    summary line. With bundle=zip the rendered files stream back as a ZIP
+    instead (with a batch_report.json entry listing every result).
+    """
+    file_ids = list(dict.fromkeys(batch.file_ids))
+    if not file_ids:
+        raise HTTPException(status_code=400, detail="No file_ids given")
+    if len(file_ids) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_FILES} files per batch")
+    if bundle not in (None, "zip"):
+        raise HTTPException(status_code=400, detail="Bundle must be 'zip'")
+    edit = batch_edit(batch.operation)
+    if edit["op"] == "trim" and not check_ffmpeg_available():
+        raise HTTPException(
+            status_code=400,
+            detail="FFmpeg is required for audio trimming. Please install FFmpeg: https://ffmpeg.org/download.html"
+        )
+    
+    if bundle == "zip":
+        async def entries():
+            report, used = [], set()
+            async for result in run_batch(file_ids, edit):
+                path = result.pop('path', None)
+                report.append(result)
+                if path and os.path.exists(path):
+                    # Pinned until the archive has read it
+                    artifacts.acquire(path)
+                    try:
+                        yield unique_name(result['filename'], used), path, None
+                    finally:
+                        artifacts.release(path)
+            yield "batch_report.json", None, json.dumps(report, indent=2).encode()
+        
+        return StreamingResponse(
+            zip_stream(entries()),
+            media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="batch.zip"'}
+        )
+    
+    async def lines():
+        succeeded = 0
+        async for result in run_batch(file_ids, edit):
+            result.pop('path', None)
+            succeeded += result['ok']
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"done": True, "succeeded": succeeded, "failed": len(file_ids) - succeeded}) + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@router.get("/transcode/{file_id}")
+async def transcode_audio(
     file_id: str,
-    speed: float = Form(...)
+    format: str = Query("mp3"),                          # mp3, opus, aac, flac, wav
+    bitrate: Optional[int] = Query(None, ge=32, le=512),  # kbps, lossy formats only
+    sample_rate: Optional[int] = Query(None)
 ):
-    """Change the speed of an uploaded audio file"""
-    if file_id not in uploaded_files:
-        raise HTTPException(status_code=404, detail="File not found. Please upload the file first.")
-    
+    """Convert the edited audio to another format, streamed while ffmpeg encodes it"""
+    if format not in TRANSCODE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of: {', '.join(TRANSCODE_FORMATS)}")
+    if sample_rate is not None and sample_rate not in TRANSCODE_SAMPLE_RATES:
+        raise HTTPException(status_code=400, detail=f"Sample rate must be one of: {', '.join(map(str, sorted(TRANSCODE_SAMPLE_RATES)))}")
+    if format == "opus" and sample_rate is not None and sample_rate not in OPUS_SAMPLE_RATES:
+        raise HTTPException(status_code=400, detail=f"Opus sample rate must be one of: {', '.join(map(str, sorted(OPUS_SAMPLE_RATES)))}")
     if not check_ffmpeg_available():
         raise HTTPException(
             status_code=400,
-            detail="FFmpeg is required for speed changes. Please install FFmpeg: https://ffmpeg.org/download.html"
+            detail="FFmpeg is required for transcoding. Please install FFmpeg: https://ffmpeg.org/download.html"
         )
     
-    if speed < 0.5 or speed > 2.0:
-        raise HTTPException(status_code=400, detail="Speed must be between 0.5 and 2.0")
+    encoder, _, extension, media_type = TRANSCODE_FORMATS[format]
+    if not toolchain.has_encoder(encoder):
+        raise HTTPException(status_code=400, detail=f"This FFmpeg build has no {encoder} encoder")
     
-    metadata = uploaded_files[file_id]
-    file_path = metadata['path']
-    temp_output = os.path.join(UPLOAD_DIR, f"temp_{file_id}{metadata['extension']}")
+    metadata = await asyncio.to_thread(sessions.get, file_id)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="File not found")
     
+    # Wait for the first chunk so a failing encode still gets a proper error status
+    stream = transcode(metadata, format, bitrate, sample_rate)
     try:
-        # Try using ffmpeg first (better quality)
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Transcoding failed: {str(e)}")
+    
+    async def body():
         try:
-            command = [
-                "ffmpeg", "-y",
-                "-i", file_path,
-                "-filter:a", f"atempo={speed}",
-                "-vn",
-                temp_output
-            ]
-            
-            result = subprocess.run(
-                command, 
-                check=True, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE,
-                timeout=60
-            )
-            
-            # Replace original with processed
-            os.remove(file_path)
-            shutil.move(temp_output, file_path)
-            
-            # Update duration
-            audio = AudioSegment.from_file(file_path)
-            metadata['duration'] = len(audio) / 1000.0
-            
-            return {
-                "message": "Speed changed successfully (using ffmpeg)",
-                "file_id": file_id,
-                "duration": metadata['duration']
-            }
-            
-        except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired) as ffmpeg_error:
-            # Fallback to pydub (lower quality but works without ffmpeg)
-            print(f"FFmpeg failed, using pydub fallback: {ffmpeg_error}")
-            
-            audio = AudioSegment.from_file(file_path)
-            
-            # Change speed using frame rate manipulation
-            # This changes both speed and pitch
-            sound_with_altered_frame_rate = audio._spawn(
-                audio.raw_data,
-                overrides={"frame_rate": int(audio.frame_rate * speed)}
-            )
-            
-            # Convert back to normal frame rate (keeps the speed change)
-            speed_changed = sound_with_altered_frame_rate.set_frame_rate(audio.frame_rate)
-            
-            # Export
-            speed_changed.export(file_path, format=metadata['extension'][1:])
-            
-            # Update duration
-            metadata['duration'] = len(speed_changed) / 1000.0
-            
-            return {
-                "message": "Speed changed successfully (using pydub - install ffmpeg for better quality)",
-                "file_id": file_id,
-                "duration": metadata['duration'],
-                "warning": "FFmpeg not found. For better quality, install ffmpeg: https://ffmpeg.org/download.html"
-            }
+            yield first
+            async for chunk in stream:
+                yield chunk
+        except Exception as e:
+            print(f"Transcode of {file_id} failed mid-stream: {type(e).__name__}: {e}")
+            raise
+        finally:
+            await stream.aclose()
     
-    except Exception as e:
-        # Clean up temp file if it exists
-        if os.path.exists(temp_output):
-            os.remove(temp_output)
-        raise HTTPException(status_code=500, detail=f"Speed change failed: {str(e)}")
+    filename = os.path.splitext(metadata['original_filename'] or file_id)[0] + extension
+    return StreamingResponse(
+        body(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}"}
+    )
 
-@router.get("/download/{file_id}")
-async def download_audio(file_id: str):
-    """Download the processed audio file"""
-    if file_id not in uploaded_files:
-        raise HTTPException(status_code=404, detail="File not found")
+@router.get("/peaks/{file_id}")
+async def get_peaks(
+    file_id: str,
+    request: Request,
+    level: Optional[int] = Query(None, ge=0),
+    max_peaks: int = Query(2048, ge=1),
+    format: str = Query("json")  # "json" or "dat" (audiowaveform binary)
+):
+    """Min/max waveform peaks of the edited audio, for drawing the timeline.
+
+    Level 0 has one peak per 256 samples and each level above halves that.
+    Without `level`, the finest level with at most `max_peaks` peaks is used.
+    """
+    if format not in ("json", "dat"):
+        raise HTTPException(status_code=400, detail="Format must be 'json' or 'dat'")
+    if not check_ffmpeg_available():
+        raise HTTPException(
+            status_code=400,
+            detail="FFmpeg is required for waveform peaks. Please install FFmpeg: https://ffmpeg.org/download.html"
+        )
     
-    metadata = uploaded_files[file_id]
-    return FileResponse(
-        metadata['path'],
-        media_type="audio/mpeg",
-        filename=f"processed_{metadata['original_filename']}"
-    )
+    # Read-only: computed from a snapshot of the session, without the edit
+    # lock, so edits are not turned away while a waveform is drawn
+    metadata = await asyncio.to_thread(sessions.get, file_id)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="File not found. Please upload the file first.")
+    
+    # The response depends on the query as well as the edit version
+    variant = f"peaks-{format}-" + (f"l{level}" if level is not None else f"max{max_peaks}")
+    etag = session_etag(metadata, variant) if metadata.get('sha256') else None
+    cached = not_modified(request, etag) if etag else None
+    if cached is not None:
+        return cached
+    
+    try:
+        peaks, entry = await session_peaks(file_id, metadata)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Computing peaks failed: {str(e)}")
+    
+    try:
+        data, level, levels = select_level(peaks, level, max_peaks)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    samples_per_peak = entry['samples_per_peak'] << level
+    headers = {"cache-control": CACHE_CONTROL}
+    if etag:
+        headers["etag"] = etag
+    
+    if format == "dat":
+        return Response(
+            encode_dat(data, entry['sample_rate'], samples_per_peak),
+            media_type="application/octet-stream",
+            headers=headers
+        )
+    
+    return JSONResponse({
+        "file_id": file_id,
+        "version": metadata.get('version', 0),
+        "sample_rate": entry['sample_rate'],
+        "samples_per_peak": samples_per_peak,
+        "level": level,
+        "levels": levels,
+        "bits": 8,
+        "length": len(data),
+        "data": data.reshape(-1).tolist()
+    }, headers=headers)
 
 @router.delete("/delete/{file_id}")
 async def delete_audio(file_id: str):
     """Delete an uploaded audio file"""
-    if file_id not in uploaded_files:
-        raise HTTPException(status_code=404, detail="File not found")
-    
-    metadata = uploaded_files[file_id]
-    
-    if os.path.exists(metadata['path']):
-        os.remove(metadata['path'])
+    async with edit_session(file_id) as metadata:
+        for path in session_files(metadata):
+            if artifacts.owns(path):
+                artifacts.discard(path)
+            elif os.path.exists(path):
+                os.remove(path)
     
-    del uploaded_files[file_id]
+    await asyncio.to_thread(sessions.delete, file_id)
     
     return {"message": "File deleted successfully"}
 
 @router.get("/info/{file_id}")
 async def get_audio_info(file_id: str):
     """Get information about an uploaded audio file"""
-    if file_id not in uploaded_files:
+    metadata = await asyncio.to_thread(sessions.get, file_id)
+    if metadata is None:
         raise HTTPException(status_code=404, detail="File not found")
     
-    metadata = uploaded_files[file_id]
+    media = metadata.get('media') or {}
     
     return {
         "file_id": file_id,
         "filename": metadata['original_filename'],
         "duration": metadata['duration'],
+        "sample_rate": media.get('sample_rate'),
+        "channels": media.get('channels'),
+        "codec": media.get('codec'),
+        "bit_rate": media.get('bit_rate'),
+        "format": media.get('format'),
+        "edits": metadata.get('edits', []),
+        "version": metadata.get('version', 0),
         "uploaded_at": metadata['uploaded_at'].isoformat()
     }
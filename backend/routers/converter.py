@@ -1,23 +1,29 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Query, Request
 from PIL import Image
 import img2pdf
 import os
-import shutil
-from uuid import uuid4
+from core.artifacts import artifacts
+from core.uploads import save_upload
+from core.config import settings
+from core.jobs import job_queue, client_key, accepted
+from core.downloads import media_type_for
+from core.result_cache import result_cache, cache_key, cached_response, package_versions
 from typing import Optional
+import asyncio
 import io
 
 router = APIRouter()
 
 UPLOAD_DIR = "uploads"
-PROCESSED_DIR = "processed"
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(PROCESSED_DIR, exist_ok=True)
 
 SUPPORTED_FORMATS = ['png', 'jpg', 'jpeg', 'svg', 'webp', 'bmp', 'gif']
 
+# Libraries whose upgrade can change the output, for the result cache keys
+IMAGE_TO_PDF_VERSION = package_versions("img2pdf", "Pillow", "CairoSVG")
+PDF_TO_IMAGE_VERSION = package_versions("PyMuPDF", "Pillow")
+
 def detect_image_format(file_path: str) -> str:
     """Detect image format from file"""
     try:
@@ -28,23 +34,89 @@ def detect_image_format(file_path: str) -> str:
         ext = os.path.splitext(file_path)[1][1:].lower()
         return ext if ext in SUPPORTED_FORMATS else None
 
+def write_pdf(input_path: str, output_path: str, final_format: str, file_id: str):
+    """Write the image at `input_path` to `output_path` as a single-page PDF"""
+    # Handle SVG separately (needs conversion to raster first)
+    if final_format == 'svg':
+        try:
+            from cairosvg import svg2png
+            # Convert SVG to PNG first, then to PDF
+            png_data = svg2png(url=input_path)
+            pdf_bytes = img2pdf.convert(png_data)
+            with open(output_path, "wb") as f:
+                f.write(pdf_bytes)
+        except ImportError:
+            # Fallback: try to open with PIL (limited SVG support)
+            with Image.open(input_path) as img:
+                # Convert to RGB if necessary
+                if img.mode in ('RGBA', 'LA', 'P'):
+                    rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+                    if img.mode == 'P':
+                        img = img.convert('RGBA')
+                    rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+                    img = rgb_img
+
+                # Save as PDF
+                img.save(output_path, 'PDF', resolution=100.0)
+    else:
+        # For other formats, use img2pdf for better quality
+        try:
+            # Open image to check if conversion needed
+            with Image.open(input_path) as img:
+                # img2pdf doesn't support RGBA, need to convert
+                if img.mode in ('RGBA', 'LA', 'P'):
+                    rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+                    if img.mode == 'P':
+                        img = img.convert('RGBA')
+                    if img.mode in ('RGBA', 'LA'):
+                        rgb_img.paste(img, mask=img.split()[-1])
+                    else:
+                        rgb_img.paste(img)
+
+                    # Save as temporary RGB image
+                    temp_rgb_path = os.path.join(UPLOAD_DIR, f"{file_id}_rgb.png")
+                    rgb_img.save(temp_rgb_path, 'PNG')
+
+                    # Convert to PDF
+                    with open(output_path, "wb") as f:
+                        f.write(img2pdf.convert(temp_rgb_path))
+
+                    # Clean up temp file
+                    os.remove(temp_rgb_path)
+                else:
+                    # Direct conversion
+                    with open(output_path, "wb") as f:
+                        f.write(img2pdf.convert(input_path))
+        except Exception as e:
+            print(f"img2pdf failed, using PIL fallback: {e}")
+            # Fallback to PIL
+            with Image.open(input_path) as img:
+                if img.mode in ('RGBA', 'LA', 'P'):
+                    rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+                    if img.mode == 'P':
+                        img = img.convert('RGBA')
+                    if img.mode in ('RGBA', 'LA'):
+                        rgb_img.paste(img, mask=img.split()[-1])
+                    else:
+                        rgb_img.paste(img)
+                    img = rgb_img
+                img.save(output_path, 'PDF', resolution=100.0)
+
 @router.post("/image-to-pdf")
 async def convert_image_to_pdf(
+    request: Request,
     file: UploadFile = File(...),
     format: Optional[str] = Form(None)  # Optional manual format override
 ):
     """Convert image to PDF with auto-detection or manual format selection"""
+    input_path = None
     try:
         print(f"Image to PDF conversion request: filename={file.filename}, manual_format={format}")
         
-        file_id = str(uuid4())
-        file_extension = os.path.splitext(file.filename)[1] if file.filename else '.png'
-        input_path = os.path.join(UPLOAD_DIR, f"{file_id}{file_extension}")
-        
-        # Save uploaded file
-        with open(input_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # Save uploaded file (named after its sniffed type, not the client's extension)
+        saved = await save_upload(file, UPLOAD_DIR, settings.MAX_IMAGE_UPLOAD_MB)
+        file_id = saved.file_id
+        input_path = saved.path
         
         # Detect format if not provided
         detected_format = detect_image_format(input_path)
@@ -59,88 +131,28 @@ async def convert_image_to_pdf(
                 detail=f"Unsupported or unknown image format. Supported: {', '.join(SUPPORTED_FORMATS)}"
             )
         
-        # Convert to PDF
+        # Convert to PDF (or reuse the PDF made from identical bytes before)
         output_filename = f"{os.path.splitext(file.filename)[0] if file.filename else 'converted'}.pdf"
-        output_path = os.path.join(PROCESSED_DIR, f"{file_id}_{output_filename}")
         
-        # Handle SVG separately (needs conversion to raster first)
-        if final_format == 'svg':
-            try:
-                from cairosvg import svg2png
-                # Convert SVG to PNG first, then to PDF
-                png_data = svg2png(url=input_path)
-                pdf_bytes = img2pdf.convert(png_data)
-                with open(output_path, "wb") as f:
-                    f.write(pdf_bytes)
-            except ImportError:
-                # Fallback: try to open with PIL (limited SVG support)
-                with Image.open(input_path) as img:
-                    # Convert to RGB if necessary
-                    if img.mode in ('RGBA', 'LA', 'P'):
-                        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                        if img.mode == 'P':
-                            img = img.convert('RGBA')
-                        rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                        img = rgb_img
-                    
-                    # Save as PDF
-                    img.save(output_path, 'PDF', resolution=100.0)
-        else:
-            # For other formats, use img2pdf for better quality
-            try:
-                # Open image to check if conversion needed
-                with Image.open(input_path) as img:
-                    # img2pdf doesn't support RGBA, need to convert
-                    if img.mode in ('RGBA', 'LA', 'P'):
-                        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                        if img.mode == 'P':
-                            img = img.convert('RGBA')
-                        if img.mode in ('RGBA', 'LA'):
-                            rgb_img.paste(img, mask=img.split()[-1])
-                        else:
-                            rgb_img.paste(img)
-                        
-                        # Save as temporary RGB image
-                        temp_rgb_path = os.path.join(UPLOAD_DIR, f"{file_id}_rgb.png")
-                        rgb_img.save(temp_rgb_path, 'PNG')
-                        
-                        # Convert to PDF
-                        with open(output_path, "wb") as f:
-                            f.write(img2pdf.convert(temp_rgb_path))
-                        
-                        # Clean up temp file
-                        os.remove(temp_rgb_path)
-                    else:
-                        # Direct conversion
-                        with open(output_path, "wb") as f:
-                            f.write(img2pdf.convert(input_path))
-            except Exception as e:
-                print(f"img2pdf failed, using PIL fallback: {e}")
-                # Fallback to PIL
-                with Image.open(input_path) as img:
-                    if img.mode in ('RGBA', 'LA', 'P'):
-                        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                        if img.mode == 'P':
-                            img = img.convert('RGBA')
-                        if img.mode in ('RGBA', 'LA'):
-                            rgb_img.paste(img, mask=img.split()[-1])
-                        else:
-                            rgb_img.paste(img)
-                        img = rgb_img
-                    img.save(output_path, 'PDF', resolution=100.0)
+        async def convert():
+            with artifacts.create(".pdf") as output:
+                await asyncio.to_thread(write_pdf, input_path, output.temp, final_format, file_id)
+            return {
+                "path": output.path,
+                "media_type": "application/pdf",
+                "headers": {"X-Detected-Format": detected_format or "unknown"}
+            }
+        
+        key = cache_key(saved.sha256, "converter.image_to_pdf", {"format": final_format}, IMAGE_TO_PDF_VERSION)
+        entry, data, state = await result_cache.fetch(key, convert)
         
         # Clean up input file
         if os.path.exists(input_path):
             os.remove(input_path)
         
-        print(f"Conversion successful: {output_path}")
+        print(f"Conversion successful: {entry.path} ({state})")
         
-        return FileResponse(
-            output_path,
-            media_type="application/pdf",
-            filename=output_filename,
-            headers={"X-Detected-Format": detected_format or "unknown"}
-        )
+        return await cached_response(request, entry, data, state, filename=output_filename)
     
     except HTTPException:
         raise
@@ -149,68 +161,43 @@ async def convert_image_to_pdf(
         import traceback
         traceback.print_exc()
         # Clean up files
-        if os.path.exists(input_path):
+        if input_path and os.path.exists(input_path):
             os.remove(input_path)
         raise HTTPException(status_code=500, detail=f"Conversion failed: {str(e)}")
 
 
-@router.post("/pdf-to-image")
-async def convert_pdf_to_image(
-    file: UploadFile = File(...),
-    format: str = Form("png")  # Output format: png, jpg, jpeg, svg
-):
-    """Convert PDF to images (one image per page)"""
+def render_pdf_pages(input_path: str, base_filename: str, format: str) -> dict:
+    """Render every page of a PDF to an image (runs in a thread or job worker).
+
+    Raises ValueError if the file cannot be opened as a PDF.
+    """
+    import fitz  # PyMuPDF
+    import zipfile
+
+    # Pages are staged in the artifact store; only the final file is committed
+    output_files = []
     try:
-        import fitz  # PyMuPDF
-        import zipfile
-        from PIL import Image
-        import io
-        
-        print(f"PDF to Image conversion request: filename={file.filename}, output_format={format}")
-        
-        if format.lower() not in ['png', 'jpg', 'jpeg', 'svg']:
-            raise HTTPException(
-                status_code=400,
-                detail="Unsupported output format. Supported: png, jpg, jpeg, svg"
-            )
-        
-        file_id = str(uuid4())
-        input_path = os.path.join(UPLOAD_DIR, f"{file_id}.pdf")
-        
-        # Save uploaded PDF
-        with open(input_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
         # Convert PDF to images using PyMuPDF
         try:
             pdf_document = fitz.open(input_path)
             page_count = len(pdf_document)
             print(f"PDF has {page_count} page(s)")
         except Exception as e:
-            os.remove(input_path)
-            raise HTTPException(
-                status_code=400,
-                detail=f"Failed to read PDF file. Make sure it's a valid PDF. Error: {str(e)}"
-            )
+            raise ValueError(f"Failed to read PDF file. Make sure it's a valid PDF. Error: {str(e)}")
         
         # Determine output format
         is_svg = format.lower() == 'svg'
         output_format = 'JPEG' if format.lower() in ['jpg', 'jpeg'] else 'PNG'
         output_ext = format.lower() if format.lower() in ['jpg', 'jpeg', 'svg'] else 'png'
         
-        base_filename = os.path.splitext(file.filename)[0] if file.filename else 'converted'
-        
         # Convert pages to images
-        output_files = []
-        
         for page_num in range(page_count):
             page = pdf_document[page_num]
             
             if is_svg:
                 # Extract SVG
                 svg_content = page.get_svg_image()
-                output_path = os.path.join(PROCESSED_DIR, f"{file_id}_page_{page_num+1}.svg")
+                output_path = artifacts.temp_path(".svg")
                 with open(output_path, "w", encoding="utf-8") as f:
                     f.write(svg_content)
                 output_files.append(output_path)
@@ -223,7 +210,7 @@ async def convert_pdf_to_image(
                 img_data = pix.tobytes("png")
                 img = Image.open(io.BytesIO(img_data))
                 
-                output_path = os.path.join(PROCESSED_DIR, f"{file_id}_page_{page_num+1}.{output_ext}")
+                output_path = artifacts.temp_path(f".{output_ext}")
                 img.save(output_path, output_format)
                 output_files.append(output_path)
         
@@ -231,47 +218,90 @@ async def convert_pdf_to_image(
         
         # If single page, return single file
         if len(output_files) == 1:
-            final_output_path = os.path.join(PROCESSED_DIR, f"{file_id}_{base_filename}.{output_ext}")
-            # Rename the single file to the final name
-            shutil.move(output_files[0], final_output_path)
-            
-            # Clean up input
-            os.remove(input_path)
+            final_output_path = artifacts.commit(output_files[0])
             
             print(f"Single page conversion successful: {final_output_path}")
             
-            media_type = "image/svg+xml" if is_svg else f"image/{output_ext}"
-            
-            return FileResponse(
-                final_output_path,
-                media_type=media_type,
-                filename=f"{base_filename}.{output_ext}"
-            )
+            return {
+                "path": final_output_path,
+                "media_type": media_type_for(final_output_path),
+                "filename": f"{base_filename}.{output_ext}",
+            }
         
         # If multiple pages, create ZIP file
-        else:
-            zip_filename = f"{base_filename}_pages.zip"
-            zip_path = os.path.join(PROCESSED_DIR, f"{file_id}_{zip_filename}")
-            
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
+        zip_filename = f"{base_filename}_pages.zip"
+        
+        with artifacts.create(".zip") as output:
+            with zipfile.ZipFile(output.temp, 'w') as zipf:
                 for i, file_path in enumerate(output_files, start=1):
                     image_filename = f"{base_filename}_page_{i}.{output_ext}"
                     zipf.write(file_path, image_filename)
                     
                     # Clean up individual file
                     os.remove(file_path)
-            
-            # Clean up input
-            os.remove(input_path)
-            
-            print(f"Multi-page conversion successful: {zip_path}")
-            
-            return FileResponse(
-                zip_path,
-                media_type="application/zip",
-                filename=zip_filename,
-                headers={"X-Page-Count": str(len(output_files))}
+        zip_path = output.path
+        
+        print(f"Multi-page conversion successful: {zip_path}")
+        
+        return {
+            "path": zip_path,
+            "media_type": "application/zip",
+            "filename": zip_filename,
+            "headers": {"X-Page-Count": str(len(output_files))},
+        }
+    finally:
+        # Clean up input and any pages left behind by a failure
+        for path in [input_path] + output_files:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+@router.post("/pdf-to-image")
+async def convert_pdf_to_image(
+    request: Request,
+    file: UploadFile = File(...),
+    format: str = Form("png"),  # Output format: png, jpg, jpeg, svg
+    run_async: bool = Query(False, alias="async")
+):
+    """Convert PDF to images (one image per page)"""
+    try:
+        print(f"PDF to Image conversion request: filename={file.filename}, output_format={format}")
+        
+        if format.lower() not in ['png', 'jpg', 'jpeg', 'svg']:
+            raise HTTPException(
+                status_code=400,
+                detail="Unsupported output format. Supported: png, jpg, jpeg, svg"
+            )
+        
+        # Save uploaded PDF
+        saved = await save_upload(file, UPLOAD_DIR, settings.MAX_PDF_UPLOAD_MB, allowed={'pdf'})
+        base_filename = os.path.splitext(file.filename)[0] if file.filename else 'converted'
+        
+        if run_async:
+            job = await job_queue.submit(
+                "converter.pdf_to_image", render_pdf_pages, client_key(request),
+                input_path=saved.path, base_filename=base_filename, format=format
             )
+            return accepted(job)
+        
+        async def render():
+            try:
+                return await asyncio.to_thread(render_pdf_pages, saved.path, base_filename, format)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        
+        try:
+            key = cache_key(saved.sha256, "converter.pdf_to_image", {"format": format.lower()}, PDF_TO_IMAGE_VERSION)
+            entry, data, state = await result_cache.fetch(key, render)
+        finally:
+            # Rendering removes the upload itself; a cache hit never gets there
+            if os.path.exists(saved.path):
+                os.remove(saved.path)
+        
+        # The name follows this upload; the cached output may come from another
+        extension = os.path.splitext(entry.path)[1]
+        filename = f"{base_filename}_pages.zip" if extension == ".zip" else f"{base_filename}{extension}"
+        return await cached_response(request, entry, data, state, filename=filename)
     
     except HTTPException:
         raise
@@ -279,9 +309,6 @@ async def convert_pdf_to_image(
         print(f"PDF conversion error: {type(e).__name__}: {str(e)}")
         import traceback
         traceback.print_exc()
-        # Clean up files
-        if 'input_path' in locals() and os.path.exists(input_path):
-            os.remove(input_path)
         raise HTTPException(status_code=500, detail=f"Conversion failed: {str(e)}")
 
 
@@ -1,91 +1,304 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
-from fastapi.responses import FileResponse
-from PIL import Image, ImageFilter, ImageEnhance
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Request
+from fastapi.responses import StreamingResponse
 import os
-import shutil
-from uuid import uuid4
+import json
+import asyncio
+import zipfile
+from typing import List, Optional
+from core.uploads import save_upload, read_upload, sniff_type, SNIFF_BYTES
+from core.config import settings
+from core.result_cache import result_cache, cache_key, cached_response, package_versions
+from core.image_batch import image_pool
+from core.zipstream import zip_stream, unique_name
+from core import image_ops, image_encode, image_filters
 
 router = APIRouter()
 
+IMAGE_TYPES = {'png', 'jpeg', 'gif'}
+
 UPLOAD_DIR = "uploads"
-PROCESSED_DIR = "processed"
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(PROCESSED_DIR, exist_ok=True)
+
+MAX_PIPELINE_OPERATIONS = 20
+MAX_BATCH_FILES = 500
+
+# Part of every result cache key: a Pillow or NumPy upgrade, or a change to
+# the filter engine, may change the output
+ENGINE_VERSION = f"{package_versions('Pillow', 'numpy')};filters-{image_filters.VERSION}"
+
+def parse_operations(operations: str):
+    """Validate a JSON operations list; returns (stages, output format, quality) or raises a 400"""
+    try:
+        try:
+            spec = json.loads(operations)
+        except json.JSONDecodeError:
+            raise ValueError("operations must be a JSON list")
+        if not isinstance(spec, list) or not 1 <= len(spec) <= MAX_PIPELINE_OPERATIONS:
+            raise ValueError(f"operations must be a list of 1 to {MAX_PIPELINE_OPERATIONS} operations")
+        return image_ops.build_pipeline(spec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def output_options(request: Request, format: Optional[str], quality: Optional[int]):
+    """(format, quality, negotiated): an explicit format, else the best one the Accept header allows.
+
+    A None format means the input's own.
+    """
+    format = format.lower() if format else None
+    if format == "jpg":
+        format = "jpeg"
+    try:
+        image_encode.check_options(format, quality)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if format is not None:
+        return format, quality, False
+    return image_encode.accepted_format(request.headers.get("accept", "")), quality, True
+
+async def encoded_response(request: Request, file: UploadFile, tool: str, prefix: str, params: dict,
+                           run, output_format: Optional[str], quality: Optional[int], strip: bool,
+                           negotiated: bool = False):
+    """Run `run(data, output_format, quality, strip)` on the upload in a thread, through the result cache"""
+    saved = await read_upload(file, settings.MAX_IMAGE_UPLOAD_MB, allowed=IMAGE_TYPES)
+
+    async def process():
+        try:
+            return await asyncio.to_thread(run, saved.data, output_format, quality, strip)
+        except (ValueError, OSError) as e:
+            raise HTTPException(status_code=400, detail=f"Could not process image: {e}")
+
+    params = {**params, "format": output_format or "source", "quality": quality, "strip": strip}
+    key = cache_key(saved.sha256, tool, params, ENGINE_VERSION)
+    entry, data, state = await result_cache.fetch(key, process)
+    name = os.path.splitext(file.filename or "image")[0]
+    response = await cached_response(request, entry, data, state, filename=f"{prefix}_{name}{os.path.splitext(entry.path)[1]}")
+    if negotiated:
+        response.headers["Vary"] = "Accept"
+    return response
 
 @router.post("/crop")
 async def crop_image(
+    request: Request,
     file: UploadFile = File(...),
     left: int = Form(...),
     top: int = Form(...),
     right: int = Form(...),
-    bottom: int = Form(...)
+    bottom: int = Form(...),
+    format: Optional[str] = Form(None),     # jpeg, png, webp, avif, gif; default by Accept, else the input's
+    quality: Optional[int] = Form(None),
+    strip_metadata: bool = Form(False)
 ):
-    if not file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
-        raise HTTPException(status_code=400, detail="Invalid file format")
+    output_format, quality, negotiated = output_options(request, format, quality)
+    stages = [("crop", {"left": left, "top": top, "right": right, "bottom": bottom})]
 
-    file_id = str(uuid4())
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}_{file.filename}")
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    def crop(data, output_format, quality, strip):
+        return image_ops.run_pipeline(data, stages, output_format, quality, strip)
 
-    try:
-        img = Image.open(file_path)
-        cropped_img = img.crop((left, top, right, bottom))
-        
-        output_filename = f"cropped_{file.filename}"
-        output_path = os.path.join(PROCESSED_DIR, output_filename)
-        
-        cropped_img.save(output_path)
-        
-        return FileResponse(output_path, media_type="image/jpeg", filename=output_filename)
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    return await encoded_response(
+        request, file, "image.crop", "cropped", stages[0][1], crop,
+        output_format, quality, strip_metadata, negotiated
+    )
 
 @router.post("/filter")
 async def apply_filter(
+    request: Request,
     file: UploadFile = File(...),
-    filter_type: str = Form(...)
+    filter_type: str = Form(...),
+    format: Optional[str] = Form(None),
+    quality: Optional[int] = Form(None),
+    strip_metadata: bool = Form(False)
 ):
-    if not file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
-        raise HTTPException(status_code=400, detail="Invalid file format")
+    output_format, quality, negotiated = output_options(request, format, quality)
+    stages = [("filter", {"filter_type": filter_type})]
 
-    file_id = str(uuid4())
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}_{file.filename}")
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    def apply(data, output_format, quality, strip):
+        return image_ops.run_pipeline(data, stages, output_format, quality, strip)
 
-    try:
-        img = Image.open(file_path)
-        
-        if filter_type == "blur":
-            processed_img = img.filter(ImageFilter.BLUR)
-        elif filter_type == "contour":
-            processed_img = img.filter(ImageFilter.CONTOUR)
-        elif filter_type == "detail":
-            processed_img = img.filter(ImageFilter.DETAIL)
-        elif filter_type == "edge_enhance":
-            processed_img = img.filter(ImageFilter.EDGE_ENHANCE)
-        elif filter_type == "grayscale":
-            processed_img = img.convert("L")
-        else:
-            processed_img = img
-        
-        output_filename = f"{filter_type}_{file.filename}"
-        output_path = os.path.join(PROCESSED_DIR, output_filename)
-        
-        processed_img.save(output_path)
-        
-        return FileResponse(output_path, media_type="image/jpeg", filename=output_filename)
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    return await encoded_response(
+        request, file, "image.filter", filter_type, {"filter": filter_type}, apply,
+        output_format, quality, strip_metadata, negotiated
+    )
+
+@router.post("/pipeline")
+async def image_pipeline(
+    request: Request,
+    file: UploadFile = File(...),
+    operations: str = Form(...),    # JSON list, applied in order
+    strip_metadata: bool = Form(False)
+):
+    """Run several operations over a single decode and encode once at the end.
+
+    `operations` is a JSON list such as
+    [{"op": "crop", "left": 0, "top": 0, "right": 800, "bottom": 600},
+     {"op": "filter", "type": "blur"}, {"op": "format", "format": "webp", "quality": 80}].
+    Operations: crop, resize (width and/or height), rotate (degrees, expand),
+    filter (type), enhance (kind, factor), grayscale, color_matrix (matrix:
+    12 numbers), curve (points: [input, output] pairs), convolve (kernel,
+    kernel_y, normalize, mix; separable), and one format
+    (format, quality), which sets the output encoding; without it the
+    Accept header picks the format, as for the other tools. The upload is
+    decoded from memory; nothing but the result is written to disk.
+    """
+    stages, output_format, quality = parse_operations(operations)
+    negotiated = output_format is None
+    if negotiated:
+        output_format, quality, _ = output_options(request, None, quality)
+
+    def run(data, output_format, quality, strip):
+        return image_ops.run_pipeline(data, stages, output_format, quality, strip)
+
+    return await encoded_response(
+        request, file, "image.pipeline", "edited", {"stages": json.dumps(stages)}, run,
+        output_format, quality, strip_metadata, negotiated
+    )
+
+async def resized_response(request: Request, file: UploadFile, tool: str, prefix: str,
+                           width: Optional[int], height: Optional[int], fit: bool,
+                           format: Optional[str], quality: Optional[int], strip: bool):
+    for value in (width, height):
+        if value is not None and not 1 <= value <= image_ops.MAX_DIMENSION:
+            raise HTTPException(status_code=400, detail=f"Dimensions must be between 1 and {image_ops.MAX_DIMENSION}")
+    output_format, quality, negotiated = output_options(request, format, quality)
+
+    def resize(data, output_format, quality, strip):
+        return image_ops.run_resize(data, width, height, fit, output_format, quality, strip)
+
+    params = {"width": width, "height": height, "max_megapixels": settings.MAX_IMAGE_OUTPUT_MEGAPIXELS}
+    return await encoded_response(request, file, tool, prefix, params, resize, output_format, quality, strip, negotiated)
+
+@router.post("/resize")
+async def resize_image(
+    request: Request,
+    file: UploadFile = File(...),
+    width: Optional[int] = Form(None),
+    height: Optional[int] = Form(None),
+    format: Optional[str] = Form(None),
+    quality: Optional[int] = Form(None),
+    strip_metadata: bool = Form(False)
+):
+    """Resize to width x height, or keep the aspect ratio when only one is given.
+
+    JPEGs are shrunk while they are decoded and EXIF orientation is applied.
+    The output is capped at MAX_IMAGE_OUTPUT_MEGAPIXELS; its size is in X-Image-Size.
+    """
+    if width is None and height is None:
+        raise HTTPException(status_code=400, detail="Resize needs a width, a height or both")
+    return await resized_response(
+        request, file, "image.resize", "resized", width, height, False, format, quality, strip_metadata
+    )
+
+@router.post("/thumbnail")
+async def thumbnail_image(
+    request: Request,
+    file: UploadFile = File(...),
+    size: int = Form(512),      # longest side; the image is never enlarged
+    format: Optional[str] = Form(None),
+    quality: Optional[int] = Form(None),
+    strip_metadata: bool = Form(False)
+):
+    """Preview that fits in size x size, made like /resize"""
+    return await resized_response(
+        request, file, "image.thumbnail", "thumb", size, size, True, format, quality, strip_metadata
+    )
+
+def read_image(src, limit: int) -> bytes:
+    """Read one batch item (at most `limit` bytes); ValueError if it is too large or not an image"""
+    data = src.read(limit + 1)
+    if len(data) > limit:
+        raise ValueError(f"File too large. Maximum size is {settings.MAX_IMAGE_UPLOAD_MB} MB")
+    if sniff_type(data[:SNIFF_BYTES]) not in IMAGE_TYPES:
+        raise ValueError(f"Invalid file format. Supported: {', '.join(sorted(IMAGE_TYPES))}")
+    return data
+
+def upload_reader(file: UploadFile, limit: int):
+    def read():
+        file.file.seek(0)
+        return read_image(file.file, limit)
+    return read
+
+def member_reader(archive: zipfile.ZipFile, info: zipfile.ZipInfo, limit: int):
+    def read():
+        # The header's size is only a hint; read_image enforces the limit on what is inflated
+        if info.file_size > limit:
+            raise ValueError(f"File too large. Maximum size is {settings.MAX_IMAGE_UPLOAD_MB} MB")
+        with archive.open(info) as src:
+            return read_image(src, limit)
+    return read
+
+def archive_members(archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    return [
+        info for info in archive.infolist()
+        if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+        and not os.path.basename(info.filename).startswith(".")
+    ]
+
+@router.post("/batch")
+async def batch_process(
+    files: List[UploadFile] = File(...),
+    operations: str = Form(...),    # JSON list, as for /pipeline
+    strip_metadata: bool = Form(False)
+):
+    """Apply one operations list to many images and stream the results back as a ZIP.
+
+    Send the images as several `files`, or a single ZIP of images. Items are
+    processed in parallel on the image process pool, with a bounded number
+    in flight, and each is written to the archive as soon as it is done; a
+    batch_report.json entry lists every item in upload order, with the error
+    for items that failed.
+    """
+    stages, output_format, quality = parse_operations(operations)
+    limit = settings.MAX_IMAGE_UPLOAD_MB * 1024 * 1024
+
+    archive, archive_path = None, None
+    head = await files[0].read(SNIFF_BYTES)
+    await files[0].seek(0)
+    if len(files) == 1 and sniff_type(head) == "zip":
+        saved = await save_upload(files[0], UPLOAD_DIR, settings.MAX_IMAGE_BATCH_UPLOAD_MB, allowed={"zip"})
+        archive_path = saved.path
+        try:
+            archive = zipfile.ZipFile(archive_path)
+            members = archive_members(archive)
+        except zipfile.BadZipFile:
+            os.remove(archive_path)
+            raise HTTPException(status_code=400, detail="Could not read the ZIP archive")
+        names = [os.path.basename(info.filename) for info in members]
+        readers = [member_reader(archive, info, limit) for info in members]
+    else:
+        names = [file.filename or "image" for file in files]
+        readers = [upload_reader(file, limit) for file in files]
+
+    if not 1 <= len(readers) <= MAX_BATCH_FILES:
+        if archive is not None:
+            archive.close()
+            os.remove(archive_path)
+        raise HTTPException(status_code=400, detail=f"A batch must have 1 to {MAX_BATCH_FILES} images")
+
+    # Output names follow upload order, not completion order
+    used = set()
+    stems = [unique_name(os.path.splitext(name)[0] or "image", used) for name in names]
+    print(f"Image batch: {len(readers)} item(s) on {image_pool.workers} worker(s)")
+
+    async def entries():
+        report = {}
+        try:
+            async for result in image_pool.run(readers, stages, output_format, quality, strip_metadata):
+                index = result["index"]
+                if result["ok"]:
+                    filename = f"{stems[index]}{result['extension']}"
+                    report[index] = {"source": names[index], "status": "ok", "filename": filename}
+                    yield filename, None, result["data"]
+                else:
+                    report[index] = {"source": names[index], "status": "failed", "error": result["error"]}
+            summary = [report[index] for index in sorted(report)]
+            yield "batch_report.json", None, json.dumps(summary, indent=2).encode()
+        finally:
+            if archive is not None:
+                archive.close()
+                os.remove(archive_path)
+
+    return StreamingResponse(
+        zip_stream(entries()),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="images.zip"'}
+    )
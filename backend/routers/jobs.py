@@ -0,0 +1,36 @@
+from fastapi import APIRouter, HTTPException, Request
+from core.artifacts import artifacts
+from core.jobs import job_queue, public_view, DONE
+from core.downloads import download_response
+
+router = APIRouter()
+
+@router.get("/{job_id}")
+async def get_job(job_id: str):
+    """Get the status of a background job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return public_view(job)
+
+@router.get("/{job_id}/result")
+async def get_job_result(job_id: str, request: Request):
+    """Download the output of a finished job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job['status'] != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    
+    result = job['result']
+    if not artifacts.lookup(result['path']):
+        raise HTTPException(status_code=410, detail="Job result has expired")
+    
+    return await download_response(
+        request,
+        result['path'],
+        media_type=result['media_type'],
+        filename=result['filename'],
+        headers=result.get('headers'),
+        background=artifacts.hold(result['path'])
+    )
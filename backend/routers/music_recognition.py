@@ -1,12 +1,14 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, UploadFile, File, Request
 from fastapi.responses import JSONResponse
 import requests
 import os
 from pathlib import Path
-import uuid
-import subprocess
 import json
 from dotenv import load_dotenv
+from core.toolchain import toolchain
+from core.process import run_process, ProcessError, ProcessTimeout
+from core.uploads import save_upload
+from core.config import settings
 
 load_dotenv()
 
@@ -15,6 +17,8 @@ router = APIRouter()
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+ALLOWED_TYPES = {'mp3', 'wav', 'm4a', 'mp4', 'flac', 'ogg', 'webm', 'mkv', 'aac', 'wma'}
+
 # AcoustID API key - Get yours free at https://acoustid.org/new-application
 ACOUSTID_API_KEY = os.getenv("ACOUSTID_API_KEY", "")
 
@@ -27,26 +31,10 @@ def cleanup_file(path: str):
         print(f"Error deleting file {path}: {e}")
 
 def get_fpcalc_path():
-    """Find fpcalc executable"""
-    # Try common locations
-    possible_paths = [
-        "fpcalc.exe",
-        "fpcalc",
-        r"C:\Program Files\ffmpeg\bin\fpcalc.exe",
-        r"C:\ffmpeg\bin\fpcalc.exe",
-    ]
-    
-    for path in possible_paths:
-        try:
-            result = subprocess.run([path, "-version"], capture_output=True, timeout=5)
-            if result.returncode == 0:
-                return path
-        except:
-            continue
-    
-    return None
+    """Find fpcalc executable (cached toolchain probe)"""
+    return toolchain.path("fpcalc")
 
-def generate_fingerprint(file_path: str):
+async def generate_fingerprint(file_path: str, request: Request = None):
     """Generate audio fingerprint using fpcalc"""
     fpcalc = get_fpcalc_path()
     
@@ -54,28 +42,22 @@ def generate_fingerprint(file_path: str):
         raise Exception("fpcalc not found. Please download from https://acoustid.org/chromaprint and add to PATH")
     
     try:
-        result = subprocess.run(
-            [fpcalc, "-json", file_path],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-        
-        if result.returncode != 0:
-            raise Exception(f"fpcalc failed: {result.stderr}")
+        result = await run_process([fpcalc, "-json", file_path], tool="fpcalc", timeout=30, request=request)
         
-        data = json.loads(result.stdout)
+        data = json.loads(result.text)
         return data.get('fingerprint'), data.get('duration')
     
-    except subprocess.TimeoutExpired:
+    except ProcessTimeout:
         raise Exception("Audio processing timeout")
+    except ProcessError as e:
+        raise Exception(f"fpcalc failed: {e.stderr}")
     except json.JSONDecodeError:
         raise Exception("Failed to parse fpcalc output")
     except Exception as e:
         raise Exception(f"Fingerprint generation failed: {str(e)}")
 
 @router.post("/recognize")
-async def recognize_music(file: UploadFile = File(...)):
+async def recognize_music(request: Request, file: UploadFile = File(...)):
     """
     Recognize music from uploaded audio file using AcoustID (completely FREE!).
     Supports: MP3, WAV, M4A, FLAC, OGG, and other common audio formats.
@@ -86,29 +68,15 @@ async def recognize_music(file: UploadFile = File(...)):
             detail="Music recognition API key not configured. Please add ACOUSTID_API_KEY to your .env file. Get a FREE key at https://acoustid.org/new-application (no credit card required!)"
         )
     
-    # Validate file type
-    allowed_extensions = {'.mp3', '.wav', '.m4a', '.flac', '.ogg', '.webm', '.opus', '.aac', '.wma'}
-    file_ext = Path(file.filename or "").suffix.lower()
-    
-    if file_ext not in allowed_extensions:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Unsupported file format. Allowed formats: {', '.join(allowed_extensions)}"
-        )
-    
-    # Save uploaded file temporarily
-    temp_filename = f"{uuid.uuid4()}{file_ext}"
-    temp_path = UPLOAD_DIR / temp_filename
+    # Save uploaded file temporarily; the type is validated from its magic bytes
+    # (opus is sniffed as ogg)
+    saved = await save_upload(file, str(UPLOAD_DIR), settings.MAX_MUSIC_ID_UPLOAD_MB, allowed=ALLOWED_TYPES)
+    temp_path = Path(saved.path)
     
     try:
-        # Save file
-        content = await file.read()
-        with open(temp_path, "wb") as f:
-            f.write(content)
-        
         # Generate fingerprint
         try:
-            fingerprint, duration = generate_fingerprint(str(temp_path))
+            fingerprint, duration = await generate_fingerprint(str(temp_path), request)
             if not fingerprint or not duration:
                 raise Exception("Failed to extract audio fingerprint")
         except Exception as e:
@@ -1,29 +1,30 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Query, Request
 from pydantic import BaseModel
 import yt_dlp
 import os
-import uuid
 from pathlib import Path
+import asyncio
+from core.artifacts import artifacts
+from core.jobs import job_queue, client_key, accepted
+from core.downloads import download_response, media_type_for
 
 router = APIRouter()
 
 UPLOAD_DIR = Path("uploads")
-PROCESSED_DIR = Path("processed")
 
 # Ensure directories exist
 UPLOAD_DIR.mkdir(exist_ok=True)
-PROCESSED_DIR.mkdir(exist_ok=True)
 
 class SocialURL(BaseModel):
     url: str
 
-def cleanup_file(path: str):
-    try:
-        if os.path.exists(path):
-            os.remove(path)
-    except Exception as e:
-        print(f"Error deleting file {path}: {e}")
+def cleanup_files(paths):
+    for path in paths:
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            print(f"Error deleting file {path}: {e}")
 
 @router.post("/info")
 async def get_info(data: SocialURL):
@@ -56,60 +57,87 @@ async def get_info(data: SocialURL):
         else:
             raise HTTPException(status_code=400, detail=f"Failed to fetch info: {error_msg}")
 
-@router.post("/download")
-async def download_media(data: SocialURL, type: str = "video"):
-    try:
-        filename = f"{uuid.uuid4()}"
-        
-        if type == "audio":
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-                'outtmpl': str(PROCESSED_DIR / f"{filename}.%(ext)s"),
-                'quiet': True,
-                'no_warnings': True,
-                'socket_timeout': 30,
-            }
-            final_ext = "mp3"
-        else:
-            ydl_opts = {
-                'format': 'best',
-                'outtmpl': str(PROCESSED_DIR / f"{filename}.%(ext)s"),
-                'quiet': True,
-                'no_warnings': True,
-                'socket_timeout': 30,
-            }
-            final_ext = "mp4" # This might vary, but usually mp4 for socials
+def fetch_social_media(url: str, type: str = "video") -> dict:
+    """Download a social media post with yt-dlp (runs in a thread or job worker)"""
+    # yt-dlp picks the extension, so it downloads into staging under a unique stem
+    staged = Path(artifacts.temp_path())
+    
+    if type == "audio":
+        ydl_opts = {
+            'format': 'bestaudio/best',
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': '192',
+            }],
+            'outtmpl': f"{staged}.%(ext)s",
+            'quiet': True,
+            'no_warnings': True,
+            'socket_timeout': 30,
+        }
+    else:
+        ydl_opts = {
+            'format': 'best',
+            'outtmpl': f"{staged}.%(ext)s",
+            'quiet': True,
+            'no_warnings': True,
+            'socket_timeout': 30,
+        }
 
+    try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(data.url, download=True)
+            info = ydl.extract_info(url, download=True)
             ext = info.get('ext', 'mp4')
             if type == "audio":
                 # yt-dlp with FFmpegExtractAudio converts to the preferred codec
                 # so the file extension will be the preferred codec
-                final_path = PROCESSED_DIR / f"{filename}.mp3"
+                final_path = Path(f"{staged}.mp3")
             else:
-                final_path = PROCESSED_DIR / f"{filename}.{ext}"
+                final_path = Path(f"{staged}.{ext}")
                 
         if not final_path.exists():
-             # Fallback check if extension was different
-             found_files = list(PROCESSED_DIR.glob(f"{filename}.*"))
-             if found_files:
-                 final_path = found_files[0]
-             else:
-                raise HTTPException(status_code=500, detail="Download failed")
+            # Fallback check if extension was different
+            found_files = list(staged.parent.glob(f"{staged.name}.*"))
+            if not found_files:
+                raise RuntimeError("Download failed")
+            final_path = found_files[0]
+        
+        final_path = Path(artifacts.commit(str(final_path)))
+    finally:
+        # Fragments, .part files and intermediates yt-dlp left behind
+        cleanup_files(staged.parent.glob(f"{staged.name}.*"))
+
+    return {
+        "path": str(final_path),
+        "media_type": media_type_for(final_path),
+        "filename": f"social_media_{type}.{final_path.suffix.lstrip('.')}",
+    }
+
+@router.post("/download")
+async def download_media(
+    request: Request,
+    data: SocialURL,
+    type: str = "video",
+    run_async: bool = Query(False, alias="async")
+):
+    if run_async:
+        job = await job_queue.submit(
+            "socials.download", fetch_social_media, client_key(request),
+            url=data.url, type=type
+        )
+        return accepted(job)
+
+    try:
+        result = await asyncio.to_thread(fetch_social_media, data.url, type)
 
-        # Return file as download
-        media_type = "audio/mpeg" if type == "audio" else "video/mp4"
-        return FileResponse(
-            path=str(final_path),
-            media_type=media_type,
-            filename=f"social_media_{type}.{final_path.suffix.lstrip('.')}",
-            background=BackgroundTasks().add_task(cleanup_file, str(final_path))
+        # Return file as download; deleted once sent (the TTL catches it otherwise)
+        return await download_response(
+            request,
+            result['path'],
+            media_type=result['media_type'],
+            filename=result['filename'],
+            background=artifacts.hold(result['path'], discard=True),
+            one_shot=True
         )
 
     except Exception as e:
@@ -1,51 +1,288 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query, Request
 from moviepy import VideoFileClip
 import os
-import shutil
-from uuid import uuid4
+import re
+import math
+import asyncio
+from core.artifacts import artifacts
+from core.uploads import save_upload
+from core.config import settings
+from core.toolchain import toolchain
+from core.process import run_process, ProcessError, ProcessTimeout
+from core.jobs import job_queue, client_key, accepted
+from core.downloads import download_response, media_type_for, strong_etag
+from core.video_trim import trim_video
+from core.thumbnails import video_sprite, sprite_paths
+from core.result_cache import result_cache, cache_key, cached_response, package_versions
 
 router = APIRouter()
 
+VIDEO_TYPES = {'mp4', 'mov', 'avi', 'mkv'}
+
 UPLOAD_DIR = "uploads"
-PROCESSED_DIR = "processed"
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(PROCESSED_DIR, exist_ok=True)
 
-@router.post("/remove-sound")
-async def remove_sound(
-    file: UploadFile = File(...)
-):
-    if not file.filename.endswith(('.mp4', '.mov', '.avi', '.mkv')):
-        raise HTTPException(status_code=400, detail="Invalid file format")
+REMUX_TIMEOUT = 600
 
-    file_id = str(uuid4())
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}_{file.filename}")
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+MAX_THUMBNAILS = 400
+MIN_THUMBNAIL_WIDTH = 32
+MAX_THUMBNAIL_WIDTH = 640
+SPRITE_KEY_RE = re.compile(r"^[0-9a-f]{32}-\d+-\d+-\d+$")
 
+def engine_version() -> str:
+    """What produced a video output, for the result cache keys"""
+    return f"{toolchain.get('ffmpeg').version};{package_versions('moviepy')}"
+
+def remux_args(file_path: str, output_path: str) -> list:
+    """Copy every stream except audio into the same container; nothing is decoded"""
+    return [
+        toolchain.path("ffmpeg"), "-y", "-v", "error",
+        "-i", file_path,
+        "-map", "0", "-map", "-0:a",
+        "-c", "copy",
+        output_path
+    ]
+
+def mute_result(output_path: str, output_filename: str, mode: str) -> dict:
+    return {
+        "path": output_path,
+        "media_type": media_type_for(output_path),
+        "filename": output_filename,
+        "headers": {"X-Mute-Mode": mode}
+    }
+
+def encode_without_audio(file_path: str, output_path: str):
+    """Slow path: decode and re-encode every frame with moviepy"""
+    video = None
+    new_video = None
     try:
         video = VideoFileClip(file_path)
         new_video = video.without_audio()
         
-        output_filename = f"muted_{file.filename}"
-        output_path = os.path.join(PROCESSED_DIR, output_filename)
-        
         new_video.write_videofile(output_path, codec="libx264", audio_codec=None)
-        
-        return FileResponse(output_path, media_type="video/mp4", filename=output_filename)
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
     finally:
-        # Cleanup upload
-        if os.path.exists(file_path):
-            os.remove(file_path)
         # Close video to release file handle
         try:
-            if 'video' in locals(): video.close()
-            if 'new_video' in locals(): new_video.close()
+            if video is not None: video.close()
+            if new_video is not None: new_video.close()
         except:
             pass
+
+def discard(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+def mute_video(file_path: str, output_filename: str) -> dict:
+    """Drop the audio track (runs in a job worker): remux, re-encode only if that fails.
+
+    Job workers have no event loop of their own, so ffmpeg goes through the
+    shared process runner under asyncio.run, as in trim_video_job.
+    """
+    output = artifacts.create(os.path.splitext(output_filename)[1])
+    try:
+        if toolchain.available("ffmpeg"):
+            try:
+                asyncio.run(run_process(remux_args(file_path, output.temp), tool="ffmpeg", timeout=REMUX_TIMEOUT))
+                return mute_result(output.commit(), output_filename, "remux")
+            except (ProcessError, ProcessTimeout, FileNotFoundError) as e:
+                print(f"Remux failed, re-encoding instead: {e}")
+                output.discard()
+        
+        encode_without_audio(file_path, output.temp)
+        return mute_result(output.commit(), output_filename, "reencode")
+    finally:
+        # Cleanup upload and anything left half-written
+        discard(file_path)
+        output.discard()
+
+async def mute_video_now(file_path: str, output_filename: str, request: Request) -> dict:
+    """Same as mute_video, for the request itself: ffmpeg via the shared runner, moviepy in a thread"""
+    output = artifacts.create(os.path.splitext(output_filename)[1])
+    try:
+        try:
+            await run_process(remux_args(file_path, output.temp), tool="ffmpeg", timeout=REMUX_TIMEOUT, request=request)
+            return mute_result(output.commit(), output_filename, "remux")
+        except (ProcessError, ProcessTimeout, FileNotFoundError) as e:
+            print(f"Remux failed, re-encoding instead: {e}")
+            output.discard()
+        
+        await asyncio.to_thread(encode_without_audio, file_path, output.temp)
+        return mute_result(output.commit(), output_filename, "reencode")
+    finally:
+        # Cleanup upload and anything left half-written
+        discard(file_path)
+        output.discard()
+
+@router.post("/remove-sound")
+async def remove_sound(
+    request: Request,
+    file: UploadFile = File(...),
+    run_async: bool = Query(False, alias="async")
+):
+    saved = await save_upload(file, UPLOAD_DIR, settings.MAX_VIDEO_UPLOAD_MB, allowed=VIDEO_TYPES)
+    # Keep the input container: the remux writes whatever the extension names
+    name, extension = os.path.splitext(file.filename or "video")
+    output_filename = f"muted_{name}{extension or saved.extension}"
+
+    if run_async:
+        job = await job_queue.submit(
+            "video.remove_sound", mute_video, client_key(request),
+            file_path=saved.path, output_filename=output_filename
+        )
+        return accepted(job)
+
+    try:
+        key = cache_key(saved.sha256, "video.remove_sound", {"extension": os.path.splitext(output_filename)[1]}, engine_version())
+        entry, data, state = await result_cache.fetch(key, lambda: mute_video_now(saved.path, output_filename, request))
+        return await cached_response(request, entry, data, state, filename=output_filename)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Muting removes the upload itself; a cache hit never gets there
+        discard(saved.path)
+
+def trim_result(output_path: str, output_filename: str, result: dict) -> dict:
+    return {
+        "path": output_path,
+        "media_type": media_type_for(output_path),
+        "filename": output_filename,
+        "headers": {
+            "X-Trim-Mode": result["mode"],
+            "X-Copied-Seconds": str(result["copied_seconds"])
+        }
+    }
+
+def trim_video_job(file_path: str, output_filename: str, start_time: float, end_time: float) -> dict:
+    """Smart trim in a job worker, which has no event loop of its own"""
+    output = artifacts.create(os.path.splitext(output_filename)[1])
+    try:
+        result = asyncio.run(trim_video(file_path, output.temp, start_time, end_time))
+        return trim_result(output.commit(), output_filename, result)
+    finally:
+        discard(file_path)
+        output.discard()
+
+@router.post("/trim")
+async def trim(
+    request: Request,
+    file: UploadFile = File(...),
+    start_time: float = Form(...),  # in seconds
+    end_time: float = Form(...),    # in seconds
+    run_async: bool = Query(False, alias="async")
+):
+    """Frame-accurate trim that only re-encodes the partial GOPs at each end.
+
+    Whole GOPs inside the range are stream-copied; the X-Trim-Mode and
+    X-Copied-Seconds headers report how much of the cut avoided re-encoding.
+    """
+    if start_time < 0 or end_time <= start_time:
+        raise HTTPException(status_code=400, detail="end_time must be greater than start_time, and start_time at least 0")
+    if not toolchain.available("ffmpeg"):
+        raise HTTPException(
+            status_code=400,
+            detail="FFmpeg is required for video trimming. Please install FFmpeg: https://ffmpeg.org/download.html"
+        )
+
+    saved = await save_upload(file, UPLOAD_DIR, settings.MAX_VIDEO_UPLOAD_MB, allowed=VIDEO_TYPES)
+    name, extension = os.path.splitext(file.filename or "video")
+    output_filename = f"trimmed_{name}{extension or saved.extension}"
+
+    if run_async:
+        job = await job_queue.submit(
+            "video.trim", trim_video_job, client_key(request),
+            file_path=saved.path, output_filename=output_filename,
+            start_time=start_time, end_time=end_time
+        )
+        return accepted(job)
+
+    async def trim_now():
+        with artifacts.create(os.path.splitext(output_filename)[1]) as output:
+            try:
+                result = await trim_video(saved.path, output.temp, start_time, end_time, request=request)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            except (ProcessError, ProcessTimeout) as e:
+                raise HTTPException(status_code=500, detail=f"Video trim failed: {e}")
+        return trim_result(output.path, output_filename, result)
+
+    params = {"start": start_time, "end": end_time, "extension": os.path.splitext(output_filename)[1]}
+    try:
+        entry, data, state = await result_cache.fetch(
+            cache_key(saved.sha256, "video.trim", params, engine_version()), trim_now
+        )
+    finally:
+        discard(saved.path)
+    return await cached_response(request, entry, data, state, filename=output_filename)
+
+@router.post("/thumbnails")
+async def thumbnails(
+    request: Request,
+    file: UploadFile = File(...),
+    count: int = Form(16),          # thumbnails, evenly spaced over the video
+    width: int = Form(160),         # pixels per thumbnail; height keeps the aspect ratio
+    columns: int = Form(0)          # sprite columns (0 = square-ish grid)
+):
+    """Preview sprite sheet plus a WebVTT thumbnail track for a video.
+
+    The sheet is built in one keyframe-only ffmpeg pass and cached by the
+    upload's content hash and the parameters; the returned URLs serve it
+    without another upload.
+    """
+    if not 1 <= count <= MAX_THUMBNAILS:
+        raise HTTPException(status_code=400, detail=f"count must be between 1 and {MAX_THUMBNAILS}")
+    if not MIN_THUMBNAIL_WIDTH <= width <= MAX_THUMBNAIL_WIDTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"width must be between {MIN_THUMBNAIL_WIDTH} and {MAX_THUMBNAIL_WIDTH}"
+        )
+    if not 0 <= columns <= count:
+        raise HTTPException(status_code=400, detail="columns must be between 0 and count")
+    if not toolchain.available("ffmpeg"):
+        raise HTTPException(
+            status_code=400,
+            detail="FFmpeg is required for video thumbnails. Please install FFmpeg: https://ffmpeg.org/download.html"
+        )
+    columns = columns or math.ceil(math.sqrt(count))
+
+    saved = await save_upload(file, UPLOAD_DIR, settings.MAX_VIDEO_UPLOAD_MB, allowed=VIDEO_TYPES)
+    try:
+        sprite = await video_sprite(saved.path, saved.sha256, count, width, columns, request=request)
+    except (ProcessError, ProcessTimeout) as e:
+        raise HTTPException(status_code=500, detail=f"Thumbnail generation failed: {e}")
+    finally:
+        discard(saved.path)
+    if sprite is None:
+        raise HTTPException(status_code=400, detail="No video stream found")
+
+    base = f"{settings.API_V1_STR}/video/thumbnails/{sprite['key']}"
+    return {
+        **sprite,
+        "sprite_url": f"{base}/sprite.jpg",
+        "vtt_url": f"{base}/thumbnails.vtt"
+    }
+
+async def sprite_file(request: Request, key: str, kind: str):
+    if not SPRITE_KEY_RE.match(key):
+        raise HTTPException(status_code=404, detail="Thumbnails not found")
+    sheet_path, vtt_path = sprite_paths(key)
+    path = sheet_path if kind == "sprite" else vtt_path
+    if not artifacts.lookup(path):
+        raise HTTPException(status_code=404, detail="Thumbnails not found or expired")
+    # The key names the content and the parameters, so it is a stable ETag
+    digest, params = key.split("-", 1)
+    return await download_response(
+        request, path, etag=strong_etag(digest, variant=f"{params}-{kind}"),
+        background=artifacts.hold(path)
+    )
+
+@router.get("/thumbnails/{key}/sprite.jpg")
+async def thumbnail_sprite(request: Request, key: str):
+    """Cached sprite sheet"""
+    return await sprite_file(request, key, "sprite")
+
+@router.get("/thumbnails/{key}/thumbnails.vtt")
+async def thumbnail_track(request: Request, key: str):
+    """Cached WebVTT track mapping times to sprite tiles"""
+    return await sprite_file(request, key, "vtt")